@@ -0,0 +1,376 @@
+"""
+Benchmarks the WOLNUT control loop at fleet scale.
+
+Each scenario drives `WolnutDaemon.step` through a full outage: every client
+is online, the UPS switches to battery, the clients shut down, power comes
+back and the loop wakes clients until all of them are online again. UPS
+polls, client probes and WOL sends are served by fake backends with
+configurable latency and failure rates, and time is simulated so a scenario
+takes as long as the loop's own work rather than the restore delays.
+
+Run from the project root:
+
+    uv run python -m benchmarks.fleet                  # compare with the baseline
+    uv run python -m benchmarks.fleet --save           # record a new baseline
+    uv run python -m benchmarks.fleet --clients 10 100 # only some fleet sizes
+"""
+
+import argparse
+import json
+import logging
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from contextlib import ExitStack
+from pathlib import Path
+from unittest import mock
+
+from wolnut.clock import VirtualClock
+from wolnut.config import ClientConfig, NutConfig, WolnutConfig
+from wolnut.daemon import WolnutDaemon
+
+BASELINE_FILE = Path(__file__).with_name("baseline.json")
+FLEET_SIZES = (10, 100, 1000, 10000)
+DEFAULT_TOLERANCE = 1.0  # Catches scaling regressions, not scheduler jitter
+DEFAULT_REPEAT = 3  # Runs per fleet size, the best timing of each is kept
+NOISE_FLOOR_MS = 2.0  # Slowdowns smaller than this are never regressions
+OUTAGE_STEPS = 5  # On-battery polls while the clients shut down
+MAX_VIRTUAL_SECONDS = 3600
+
+# Lower is better for every compared metric
+COMPARED_METRICS = (
+    "loop_mean_ms",
+    "loop_p95_ms",
+    "save_mean_ms",
+    "wol_all_sent_wall_ms",
+    "memory_peak_kib",
+)
+
+
+class FakeFleet:
+    """
+    Fake UPS, network and clients sharing one simulated clock.
+
+    Clients boot `boot_delay` simulated seconds after a WOL packet reaches
+    them. Latencies are real sleeps, so they show up in the loop timings.
+    """
+
+    def __init__(
+        self,
+        clients: list[ClientConfig],
+        seed: int = 0,
+        boot_delay: float = 60.0,
+        ups_latency: float = 0.0,
+        probe_latency: float = 0.0,
+        wol_latency: float = 0.0,
+        ups_failure_rate: float = 0.0,
+        probe_loss_rate: float = 0.0,
+        wol_loss_rate: float = 0.0,
+    ):
+        self.clock = VirtualClock(1_000_000.0)
+        self.random = random.Random(seed)
+        self.boot_delay = boot_delay
+        self.ups_latency = ups_latency
+        self.probe_latency = probe_latency
+        self.wol_latency = wol_latency
+        self.ups_failure_rate = ups_failure_rate
+        self.probe_loss_rate = probe_loss_rate
+        self.wol_loss_rate = wol_loss_rate
+
+        self.ups_status = "OL"
+        self.battery_percent = 100
+        self.host_by_name = {client.name: client.host for client in clients}
+        self.online_at = {client.host: 0.0 for client in clients}  # None when off
+        self.wol_packets = 0
+        self.probes = 0
+
+    @property
+    def now(self) -> float:
+        return self.clock.time()
+
+    def shut_down_all(self):
+        for host in self.online_at:
+            self.online_at[host] = None
+
+    def get_ups_status(self, nut_client, ups_name, variables=None) -> dict:
+        if self.ups_latency:
+            time.sleep(self.ups_latency)
+        if self.random.random() < self.ups_failure_rate:
+            return {}
+        return {
+            "ups.status": self.ups_status,
+            "battery.charge": str(self.battery_percent),
+        }
+
+    def probe_rtts(self, hosts, max_concurrency=None, timeout=None, method=None):
+        # Probes run in parallel, so a sweep costs about one probe latency
+        if self.probe_latency:
+            time.sleep(self.probe_latency)
+        self.probes += len(hosts)
+        rtts = {}
+        for host in hosts:
+            online_at = self.online_at[host]
+            online = online_at is not None and online_at <= self.now
+            if online and self.random.random() >= self.probe_loss_rate:
+                rtts[host] = 0.001
+            else:
+                rtts[host] = None
+        return rtts
+
+    def send_wol_packets(
+        self, packets, burst_count=1, burst_interval=0.0, targets=None
+    ) -> dict:
+        sent = {}
+        for name in packets:
+            if self.wol_latency:
+                time.sleep(self.wol_latency)
+            self.wol_packets += 1
+            sent[name] = True
+            host = self.host_by_name[name]
+            if self.online_at[host] is None and (
+                self.random.random() >= self.wol_loss_rate
+            ):
+                self.online_at[host] = self.now + self.boot_delay
+        return sent
+
+
+def build_config(client_count: int, status_file: str) -> WolnutConfig:
+    clients = [
+        ClientConfig(
+            name=f"client-{i}",
+            host=f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+            mac="02:00:00:%02x:%02x:%02x" % (i >> 16 & 255, i >> 8 & 255, i & 255),
+        )
+        for i in range(client_count)
+    ]
+    return WolnutConfig(
+        nut=[NutConfig(ups="ups")], status_file=status_file, clients=clients
+    )
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def run_scenario(
+    client_count: int,
+    journal: bool = False,
+    wake_budget: float = None,
+    seed: int = 0,
+    **fleet_options,
+) -> dict:
+    """
+    Runs one outage -> restore -> all-online scenario.
+
+    Returns:
+        dict: Timings (wall clock, in ms), simulated durations (in seconds)
+        and the traced memory peak of building the daemon and its first
+        step.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir, ExitStack() as stack:
+        config = build_config(client_count, str(Path(tmp_dir) / "state.json"))
+        config.state.journal = journal
+        config.nut[0].wake_budget = wake_budget
+        fleet = FakeFleet(config.clients, seed=seed, **fleet_options)
+
+        for backend in ("get_ups_status", "probe_rtts", "send_wol_packets"):
+            stack.enter_context(
+                mock.patch(f"wolnut.daemon.{backend}", getattr(fleet, backend))
+            )
+
+        loop_times = []
+        save_times = []
+
+        tracemalloc.start()
+        daemon = WolnutDaemon(config, clock=fleet.clock)
+        tracker = daemon.state_tracker
+        save_state = tracker.save_state
+
+        def timed_save_state():
+            started = time.perf_counter()
+            save_state()
+            save_times.append(time.perf_counter() - started)
+
+        tracker.save_state = timed_save_state
+
+        def advance():
+            # Jumps straight to the moment the daemon would wake up
+            daemon.scheduler.wait()
+
+        def step():
+            started = time.perf_counter()
+            daemon.step()
+            loop_times.append(time.perf_counter() - started)
+
+        step()
+        memory_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # Tracing slows everything down, so the first step is not timed
+        loop_times.clear()
+        save_times.clear()
+
+        # Outage: the UPS switches to battery and every client shuts down
+        fleet.ups_status = "OB"
+        step()
+        fleet.shut_down_all()
+        for _ in range(OUTAGE_STEPS):
+            advance()
+            fleet.battery_percent -= 5
+            step()
+
+        # Restore: run deadline to deadline until every client is back
+        fleet.ups_status = "OL"
+        fleet.battery_percent = 100
+        restored_at = fleet.now
+        restore_step = len(loop_times)
+        unit = daemon.units[0]
+        wol_all_sent_at = None
+        wol_all_sent_wall = None
+        all_online_at = None
+        while fleet.now - restored_at < MAX_VIRTUAL_SECONDS:
+            if len(loop_times) > restore_step:
+                advance()
+            step()
+            if wol_all_sent_at is None and all(
+                tracker.has_been_wol_sent(name) or tracker.should_skip(name)
+                for name in unit.client_names
+            ):
+                wol_all_sent_at = fleet.now
+                wol_all_sent_wall = sum(loop_times[restore_step:])
+            if not unit.restoration_event:
+                if not unit.recorded_down_clients:
+                    all_online_at = fleet.now
+                break
+
+    def ms(seconds):
+        return round(seconds * 1000, 3)
+
+    def since_restore(at):
+        return None if at is None else round(at - restored_at, 3)
+
+    return {
+        "clients": client_count,
+        "steps": len(loop_times),
+        "loop_mean_ms": ms(statistics.fmean(loop_times)),
+        "loop_p95_ms": ms(_percentile(loop_times, 95)),
+        "loop_max_ms": ms(max(loop_times)),
+        "save_mean_ms": ms(statistics.fmean(save_times)),
+        "save_total_ms": ms(sum(save_times)),
+        "wol_all_sent_wall_ms": (
+            None if wol_all_sent_wall is None else ms(wol_all_sent_wall)
+        ),
+        "wol_all_sent_sec": since_restore(wol_all_sent_at),
+        "all_online_sec": since_restore(all_online_at),
+        "wol_packets": fleet.wol_packets,
+        "probes": fleet.probes,
+        "memory_peak_kib": round(memory_peak / 1024, 1),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns a description of every metric that regressed beyond tolerance.
+    """
+    regressions = []
+    for size, result in results.items():
+        expected = baseline.get(size)
+        if expected is None:
+            continue
+        for metric in COMPARED_METRICS:
+            value, limit = result.get(metric), expected.get(metric)
+            if value is None or limit is None:
+                continue
+            floor = NOISE_FLOOR_MS if metric.endswith("_ms") else 0
+            if value > limit * (1 + tolerance) and value - limit > floor:
+                regressions.append(
+                    f"{size} clients: {metric} {value} > baseline {limit} "
+                    f"(+{round((value / limit - 1) * 100)}%)"
+                    if limit
+                    else f"{size} clients: {metric} {value} > baseline {limit}"
+                )
+    return regressions
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=FLEET_SIZES)
+    parser.add_argument("--journal", action="store_true", help="Journal state saves")
+    parser.add_argument(
+        "--wake-budget", type=float, help="Wake clients in waves of this size"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--boot-delay", type=float, default=60.0)
+    parser.add_argument("--ups-latency", type=float, default=0.0)
+    parser.add_argument("--probe-latency", type=float, default=0.0)
+    parser.add_argument("--wol-latency", type=float, default=0.0)
+    parser.add_argument("--ups-failure-rate", type=float, default=0.0)
+    parser.add_argument("--probe-loss-rate", type=float, default=0.0)
+    parser.add_argument("--wol-loss-rate", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument(
+        "--save", action="store_true", help="Write the results as the new baseline"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Allowed slowdown before a metric counts as a regression (1.0 = twice as slow)",
+    )
+    args = parser.parse_args(argv)
+
+    # Per-client log lines would dominate the timings
+    logging.getLogger("wolnut").setLevel(logging.CRITICAL)
+
+    options = {
+        "journal": args.journal,
+        "wake_budget": args.wake_budget,
+        "seed": args.seed,
+        "boot_delay": args.boot_delay,
+        "ups_latency": args.ups_latency,
+        "probe_latency": args.probe_latency,
+        "wol_latency": args.wol_latency,
+        "ups_failure_rate": args.ups_failure_rate,
+        "probe_loss_rate": args.probe_loss_rate,
+        "wol_loss_rate": args.wol_loss_rate,
+    }
+    results = {}
+    for client_count in args.clients:
+        runs = [run_scenario(client_count, **options) for _ in range(args.repeat)]
+        # The scenario is deterministic, only the timings vary between runs
+        result = dict(runs[0])
+        for metric in result:
+            if metric.endswith("_ms") and result[metric] is not None:
+                result[metric] = min(run[metric] for run in runs)
+        results[str(client_count)] = result
+        print(json.dumps(result))
+
+    if args.save:
+        baseline = {"options": options, "results": results}
+        args.baseline.write_text(json.dumps(baseline, indent=4) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --save to create one")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline["options"] != options:
+        print("Scenario options differ from the baseline, not comparing")
+        return 0
+
+    regressions = compare(results, baseline["results"], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
+import json
+import logging
+
 import pytest
 from click.testing import CliRunner
 
 from wolnut import main
-from wolnut.cli import wolnut, get_battery_percent
+from wolnut.cli import configure_log_output, wolnut, get_battery_percent
+from wolnut.control import ControlError
+from wolnut.logs import DEFAULT_LOG_RATE_LIMIT, JsonFormatter
 
 
 @pytest.fixture
@@ -111,3 +116,332 @@ def test_wolnut_cli_status_file_env_var(runner, mocker):
     assert result.exit_code == 0
     # The default config file path will be found and used
     mock_main.assert_called_once_with("/config/config.yaml", "/env/status.json", False)
+
+
+def test_notify_sends_event(runner, mocker):
+    """Tests forwarding a upsmon NOTIFYCMD event to the daemon."""
+    mock_main = mocker.patch("wolnut.cli.main")
+    mock_send = mocker.patch("wolnut.cli.send_event")
+
+    result = runner.invoke(
+        wolnut,
+        ["notify", "--socket", "/tmp/wolnut.sock", "UPS ups on battery"],
+        env={"NOTIFYTYPE": "ONBATT", "UPSNAME": "ups@localhost"},
+    )
+
+    assert result.exit_code == 0
+    mock_send.assert_called_once_with("/tmp/wolnut.sock", "ONBATT", "ups@localhost")
+    mock_main.assert_not_called()
+
+
+def test_notify_ignores_other_events(runner, mocker):
+    """Tests that events wolnut does not care about are not forwarded."""
+    mock_send = mocker.patch("wolnut.cli.send_event")
+
+    result = runner.invoke(wolnut, ["notify", "--type", "COMMOK"])
+
+    assert result.exit_code == 0
+    mock_send.assert_not_called()
+
+
+def test_notify_daemon_not_running(runner, mocker):
+    """Tests the error when the daemon's socket cannot be reached."""
+    mocker.patch("wolnut.cli.send_event", side_effect=FileNotFoundError("missing"))
+
+    result = runner.invoke(wolnut, ["notify", "--type", "ONLINE"])
+
+    assert result.exit_code == 1
+    assert "Failed to notify wolnut" in result.output
+
+
+def test_replay_reports_wol_rounds(runner, mocker, tmp_path):
+    """Tests replaying a trace with overridden wake_on settings."""
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(
+        "nut:\n  ups: ups\n"
+        "clients:\n  - name: nas\n    host: 10.0.0.1\n    mac: DE:AD:BE:EF:00:01\n"
+    )
+    trace_file = tmp_path / "trace.jsonl"
+    records = [
+        {"time": 0, "ups": "ups", "status": {"ups.status": "OL"}},
+        {"time": 0, "probe": {"10.0.0.1": 0.001}},
+        {"time": 10, "ups": "ups", "status": {"ups.status": "OB"}},
+        {"time": 20, "probe": {"10.0.0.1": None}},
+        {"time": 100, "ups": "ups", "status": {"ups.status": "OL"}},
+        {"time": 400, "probe": {"10.0.0.1": 0.001}},
+    ]
+    trace_file.write_text("".join(json.dumps(record) + "\n" for record in records))
+    mock_send = mocker.patch("wolnut.daemon.send_wol_packets")
+
+    result = runner.invoke(
+        wolnut,
+        [
+            "--config-file",
+            str(config_file),
+            "replay",
+            str(trace_file),
+            "--restore-delay",
+            "60",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    # Power returned at +100s, then a WOL every 30s until nas answered at +400s
+    assert "Replayed 400s of UPS history, 8 WOL rounds sent:" in result.output
+    assert "  +160s: nas\n  +190s: nas\n" in result.output
+    mock_send.assert_not_called()
+
+
+def test_replay_overrides_retry_policies(runner, mocker, tmp_path):
+    """Tests that the retry overrides also apply to named retry policies."""
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(
+        "nut:\n  ups: ups\n"
+        "retry_policies:\n  slow:\n    reattempt_delay: 120\n"
+        "clients:\n  - name: nas\n    host: 10.0.0.1\n    mac: DE:AD:BE:EF:00:01\n"
+        "    retry_policy: slow\n"
+    )
+    trace_file = tmp_path / "trace.jsonl"
+    records = [
+        {"time": 0, "ups": "ups", "status": {"ups.status": "OL"}},
+        {"time": 0, "probe": {"10.0.0.1": 0.001}},
+        {"time": 10, "ups": "ups", "status": {"ups.status": "OB"}},
+        {"time": 20, "probe": {"10.0.0.1": None}},
+        {"time": 100, "ups": "ups", "status": {"ups.status": "OL"}},
+        {"time": 400, "probe": {"10.0.0.1": 0.001}},
+    ]
+    trace_file.write_text("".join(json.dumps(record) + "\n" for record in records))
+    mocker.patch("wolnut.daemon.send_wol_packets")
+
+    result = runner.invoke(
+        wolnut,
+        [
+            "--config-file",
+            str(config_file),
+            "replay",
+            str(trace_file),
+            "--restore-delay",
+            "60",
+            "--reattempt-delay",
+            "30",
+            "--max-attempts",
+            "3",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "3 WOL rounds sent:" in result.output
+    assert "  +160s: nas\n  +190s: nas\n  +220s: nas\n" in result.output
+
+
+def test_replay_does_not_resolve_macs(runner, mocker, tmp_path):
+    """Tests that a replay never looks up MACs on the live network."""
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(
+        "nut:\n  ups: ups\n"
+        "clients:\n  - name: nas\n    host: 10.0.0.1\n    mac: auto\n"
+    )
+    trace_file = tmp_path / "trace.jsonl"
+    trace_file.write_text(
+        json.dumps({"time": 0, "ups": "ups", "status": {"ups.status": "OL"}}) + "\n"
+    )
+    mock_resolve = mocker.patch("wolnut.config.resolve_macs_from_hosts")
+
+    result = runner.invoke(
+        wolnut,
+        [
+            "--config-file",
+            str(config_file),
+            "--status-file",
+            str(tmp_path / "state.json"),
+            "replay",
+            str(trace_file),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    mock_resolve.assert_not_called()
+    assert not (tmp_path / "state.json").exists()
+
+
+def test_replay_reports_clients_without_cached_macs(runner, mocker, tmp_path):
+    """Tests that clients sharing the unresolved "auto" MAC are all reported."""
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(
+        "nut:\n  ups: ups\n"
+        "clients:\n"
+        "  - name: a\n    host: 10.0.0.1\n    mac: auto\n"
+        "  - name: b\n    host: 10.0.0.2\n    mac: auto\n"
+        "  - name: c\n    host: 10.0.0.3\n    mac: DE:AD:BE:EF:00:03\n"
+    )
+    trace_file = tmp_path / "trace.jsonl"
+    all_hosts = ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+    records = [
+        {"time": 0, "ups": "ups", "status": {"ups.status": "OL"}},
+        {"time": 0, "probe": {host: 0.001 for host in all_hosts}},
+        {"time": 10, "ups": "ups", "status": {"ups.status": "OB"}},
+        {"time": 20, "probe": {host: None for host in all_hosts}},
+        {"time": 100, "ups": "ups", "status": {"ups.status": "OL"}},
+        {"time": 140, "probe": {host: 0.001 for host in all_hosts}},
+    ]
+    trace_file.write_text("".join(json.dumps(record) + "\n" for record in records))
+    mocker.patch("wolnut.config.resolve_macs_from_hosts")
+
+    result = runner.invoke(
+        wolnut,
+        [
+            "--config-file",
+            str(config_file),
+            "--status-file",
+            str(tmp_path / "state.json"),
+            "replay",
+            str(trace_file),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "  +130s: a, b, c\n" in result.output
+
+
+def test_replay_empty_trace(runner, tmp_path):
+    """Tests the error for a trace without readings."""
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text("nut:\n  ups: ups\nclients: []\n")
+    trace_file = tmp_path / "trace.jsonl"
+    trace_file.write_text("")
+
+    result = runner.invoke(
+        wolnut, ["--config-file", str(config_file), "replay", str(trace_file)]
+    )
+
+    assert result.exit_code == 1
+    assert "Failed to load trace" in result.output
+
+
+def test_configure_log_output(mocker):
+    """Tests that the JSON format and rate limit are applied to the log handlers."""
+    handler = logging.StreamHandler()
+    mocker.patch.object(logging.getLogger(), "handlers", [handler])
+
+    configure_log_output("json", 30)
+
+    assert isinstance(handler.formatter, JsonFormatter)
+    assert [f.interval for f in handler.filters] == [30]
+
+
+def test_configure_log_output_no_rate_limit_by_default(mocker):
+    """Tests that repeated messages are only dropped when a limit is configured."""
+    handler = logging.StreamHandler()
+    mocker.patch.object(logging.getLogger(), "handlers", [handler])
+
+    configure_log_output("text", DEFAULT_LOG_RATE_LIMIT)
+
+    assert handler.filters == []
+
+
+STATUS = {
+    "ups": [
+        {
+            "name": "ups",
+            "phase": "restoring",
+            "status": "OL CHRG",
+            "battery_percent": 80,
+            "load_percent": None,
+            "waiting_for": ["nas"],
+        }
+    ],
+    "clients": [
+        {
+            "name": "nas",
+            "host": "10.0.0.1",
+            "mac": "DE:AD:BE:EF:00:01",
+            "ups": ["ups"],
+            "was_online_before_battery": True,
+            "is_online": False,
+            "is_ready": False,
+            "wol_sent": False,
+            "wol_sent_at": 0,
+            "wol_attempts": 0,
+            "wol_retry_at": 0,
+            "skip": False,
+        }
+    ],
+}
+
+
+def test_status(runner, mocker):
+    """Tests printing the daemon's status."""
+    mock_send = mocker.patch("wolnut.cli.send_request", return_value=STATUS)
+
+    result = runner.invoke(wolnut, ["status", "--socket", "/tmp/control.sock"])
+
+    assert result.exit_code == 0
+    mock_send.assert_called_once_with("/tmp/control.sock", "status")
+    assert "UPS ups: restoring (OL CHRG), battery 80%" in result.output
+    assert "waiting for: nas" in result.output
+    assert "nas (10.0.0.1): offline, online before the outage" in result.output
+
+
+def test_status_json(runner, mocker):
+    mocker.patch("wolnut.cli.send_request", return_value=STATUS)
+
+    result = runner.invoke(wolnut, ["status", "--json"])
+
+    assert json.loads(result.output) == STATUS
+
+
+def test_wake(runner, mocker):
+    """Tests forcing a wake of a client and a UPS's clients."""
+    mock_send = mocker.patch(
+        "wolnut.cli.send_request",
+        return_value={"sent": ["nas", "desktop"], "failed": []},
+    )
+
+    result = runner.invoke(wolnut, ["wake", "nas", "rack-a"])
+
+    assert result.exit_code == 0
+    mock_send.assert_called_once_with(
+        "/run/wolnut/control.sock", "wake", targets=["nas", "rack-a"]
+    )
+    assert "Sent WOL packets to: nas, desktop" in result.output
+
+
+def test_wake_reports_failed_sends(runner, mocker):
+    """Tests that clients whose packets could not be sent are reported."""
+    mocker.patch(
+        "wolnut.cli.send_request",
+        return_value={"sent": ["nas"], "failed": ["desktop"]},
+    )
+
+    result = runner.invoke(wolnut, ["wake", "all"])
+
+    assert result.exit_code == 1
+    assert "Sent WOL packets to: nas" in result.output
+    assert "Failed to send WOL packets to: desktop" in result.output
+
+
+def test_probe_and_reset(runner, mocker):
+    mock_send = mocker.patch(
+        "wolnut.cli.send_request", side_effect=[{"nas": True}, ["ups"]]
+    )
+
+    assert "nas: online" in runner.invoke(wolnut, ["probe"]).output
+    assert "Reset: ups" in runner.invoke(wolnut, ["reset", "--ups", "ups"]).output
+    assert mock_send.call_args_list[0].kwargs == {"targets": []}
+    assert mock_send.call_args_list[1].kwargs == {"ups": ["ups"]}
+
+
+@pytest.mark.parametrize(
+    "error, message",
+    [
+        (ControlError("Unknown client or UPS: tv"), "wolnut refused the request"),
+        (FileNotFoundError("missing"), "Failed to reach wolnut"),
+    ],
+)
+def test_control_errors(runner, mocker, error, message):
+    mocker.patch("wolnut.cli.send_request", side_effect=error)
+
+    result = runner.invoke(wolnut, ["wake", "tv"])
+
+    assert result.exit_code == 1
+    assert message in result.output
@@ -0,0 +1,35 @@
+import threading
+
+import pytest
+
+from wolnut.clock import Clock, VirtualClock
+
+
+def test_system_clock_waits_for_event():
+    event = threading.Event()
+    event.set()
+    assert Clock().wait(event, 10)
+
+
+def test_virtual_clock_sleep_advances():
+    clock = VirtualClock(100.0)
+    clock.sleep(30)
+    clock.advance(-5)  # Time never goes backwards
+    assert clock.time() == 130.0
+
+
+def test_virtual_clock_wait():
+    clock = VirtualClock(100.0)
+    event = threading.Event()
+
+    assert not clock.wait(event, 60)
+    assert clock.time() == 160.0
+
+    event.set()
+    assert clock.wait(event, 60)
+    assert clock.time() == 160.0
+
+
+def test_virtual_clock_cannot_wait_forever():
+    with pytest.raises(RuntimeError, match="Cannot wait forever"):
+        VirtualClock().wait(threading.Event(), None)
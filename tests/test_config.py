@@ -1,10 +1,17 @@
+import ipaddress
+
 import pytest
 import yaml
 
 from unittest.mock import MagicMock
 from pathlib import Path
 
-from wolnut import config
+from wolnut import config, wol
+from wolnut.mac_cache import MacCache, mac_cache_path
+from wolnut.readiness import ReadinessCheck
+from wolnut.retry_policy import RetryPolicy
+from wolnut.subnets import Subnet
+from wolnut.wol import WolTarget
 
 
 @pytest.fixture
@@ -35,6 +42,8 @@ def full_config_dict():
             "client_timeout_sec": 900,
             "reattempt_delay": 45,
         },
+        "probe": {"max_concurrency": 4, "timeout_sec": 0.5},
+        "state": {"journal": True},
         "clients": [
             {
                 "name": "desktop",
@@ -52,18 +61,20 @@ def test_load_config_minimal(mocker, minimal_config_dict):
         "builtins.open", mocker.mock_open(read_data=yaml.dump(minimal_config_dict))
     )
     mocker.patch("wolnut.config.validate_config")
-    mocker.patch("wolnut.config.resolve_mac_from_host")  # Prevent actual resolution
+    mock_resolve = mocker.patch("wolnut.config.resolve_macs_from_hosts")
 
     cfg = config.load_config("dummy_path.yaml", None, False)
 
-    assert cfg.nut.ups == "ups@localhost"
+    assert cfg.nut[0].ups == "ups@localhost"
     assert cfg.poll_interval == 10  # Default
     assert cfg.wake_on.min_battery_percent == 20  # Default
+    assert cfg.probe.max_concurrency == 16  # Default
     assert len(cfg.clients) == 1
     assert (
         cfg.clients[0].name == "client-1"
     )  # This was failing because host was missing
     assert cfg.log_level == "INFO"  # Default
+    mock_resolve.assert_not_called()  # No "auto" clients
 
 
 def test_load_config_full(mocker, full_config_dict):
@@ -73,22 +84,149 @@ def test_load_config_full(mocker, full_config_dict):
     )
     mocker.patch("wolnut.config.validate_config")
     mock_resolve_mac = mocker.patch(
-        "wolnut.config.resolve_mac_from_host", return_value="11:22:33:44:55:66"
+        "wolnut.config.resolve_macs_from_hosts",
+        return_value={"server.local": "11:22:33:44:55:66"},
     )
+    mock_cache = mocker.patch("wolnut.config.MacCache").return_value
+    mock_cache.get.return_value = None
 
     cfg = config.load_config("dummy_path.yaml", None, False)
 
     assert cfg.log_level == "DEBUG"
     assert cfg.poll_interval == 5
     assert cfg.status_file == "/data/status.json"
-    assert cfg.nut.ups == "myups@nut-server"
-    assert cfg.nut.username == "monuser"
+    assert cfg.nut[0].ups == "myups@nut-server"
+    assert cfg.nut[0].username == "monuser"
     assert cfg.wake_on.restore_delay_sec == 60
     assert cfg.wake_on.min_battery_percent == 50
+    assert cfg.probe.max_concurrency == 4
+    assert cfg.probe.timeout_sec == 0.5
+    assert cfg.state.journal
     assert len(cfg.clients) == 2
     assert cfg.clients[0].mac == "DE:AD:BE:EF:00:01"
     assert cfg.clients[1].mac == "11:22:33:44:55:66"  # Resolved MAC
-    mock_resolve_mac.assert_called_once_with("server.local")
+    assert cfg.clients[1].magic_packet == bytes.fromhex(
+        "FFFFFFFFFFFF" + "112233445566" * 16
+    )
+    mock_resolve_mac.assert_called_once_with(
+        ["server.local"], timeout=2.0, max_concurrency=4, method="auto"
+    )
+
+
+def write_config(tmp_path, raw):
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(yaml.dump(raw))
+    return str(config_file)
+
+
+def test_load_config_uses_cached_mac(mocker, tmp_path, minimal_config_dict):
+    """Tests that a cached MAC is used without resolving, e.g. for a host that is off."""
+    minimal_config_dict["clients"][0]["mac"] = "auto"
+    status_file = tmp_path / "state.json"
+    cache = MacCache(mac_cache_path(str(status_file)))
+    cache.update({"192.168.1.10": "de:ad:be:ef:00:0a"})
+    cache.save()
+    mock_resolve = mocker.patch("wolnut.config.resolve_macs_from_hosts")
+
+    cfg = config.load_config(
+        write_config(tmp_path, minimal_config_dict), str(status_file)
+    )
+
+    assert cfg.clients[0].mac == "de:ad:be:ef:00:0a"
+    mock_resolve.assert_not_called()
+
+
+def test_load_config_caches_resolved_mac(mocker, tmp_path, minimal_config_dict):
+    """Tests that freshly resolved MACs are written to the cache."""
+    minimal_config_dict["clients"][0]["mac"] = "auto"
+    status_file = tmp_path / "state.json"
+    mocker.patch(
+        "wolnut.config.resolve_macs_from_hosts",
+        return_value={"192.168.1.10": "de:ad:be:ef:00:0a"},
+    )
+
+    config.load_config(write_config(tmp_path, minimal_config_dict), str(status_file))
+
+    cache = MacCache(mac_cache_path(str(status_file)))
+    assert cache.get("192.168.1.10") == "de:ad:be:ef:00:0a"
+
+
+def test_load_config_refreshes_stale_mac(mocker, tmp_path, minimal_config_dict):
+    """Tests that a stale cached MAC is used now and refreshed in the background."""
+    minimal_config_dict["clients"][0]["mac"] = "auto"
+    minimal_config_dict["probe"] = {"mac_cache_ttl_sec": 60}
+    status_file = tmp_path / "state.json"
+    cache = MacCache(mac_cache_path(str(status_file)))
+    mocker.patch("wolnut.mac_cache.time.time", return_value=1000)
+    cache.update({"192.168.1.10": "de:ad:be:ef:00:0a"})
+    cache.save()
+    mocker.patch("wolnut.mac_cache.time.time", return_value=2000)
+    mocker.patch(
+        "wolnut.config.resolve_macs_from_hosts",
+        return_value={"192.168.1.10": "de:ad:be:ef:00:0b"},
+    )
+    mock_refresh = mocker.spy(MacCache, "refresh_in_background")
+
+    cfg = config.load_config(
+        write_config(tmp_path, minimal_config_dict), str(status_file)
+    )
+    assert cfg.clients[0].mac == "de:ad:be:ef:00:0a"
+
+    mock_refresh.spy_return.join(timeout=2)
+    # The refresh only queues the new MAC, the main loop applies it
+    assert cfg.clients[0].mac == "de:ad:be:ef:00:0a"
+    assert cfg.apply_mac_updates() == 1
+    assert cfg.clients[0].mac == "de:ad:be:ef:00:0b"
+    assert cfg.clients[0].magic_packet == wol.build_magic_packet("de:ad:be:ef:00:0b")
+
+
+def test_load_config_offline(mocker, tmp_path, minimal_config_dict):
+    """Tests that offline loading only reads cached MACs, even stale ones."""
+    minimal_config_dict["clients"][0]["mac"] = "auto"
+    minimal_config_dict["clients"].append(
+        {"name": "client-2", "host": "192.168.1.11", "mac": "auto"}
+    )
+    minimal_config_dict["probe"] = {"mac_cache_ttl_sec": 60}
+    status_file = tmp_path / "state.json"
+    cache = MacCache(mac_cache_path(str(status_file)))
+    mocker.patch("wolnut.mac_cache.time.time", return_value=1000)
+    cache.update({"192.168.1.10": "de:ad:be:ef:00:0a"})
+    cache.save()
+    mocker.patch("wolnut.mac_cache.time.time", return_value=2000)
+    mock_resolve = mocker.patch("wolnut.config.resolve_macs_from_hosts")
+    mock_save = mocker.patch.object(MacCache, "save")
+
+    cfg = config.load_config(
+        write_config(tmp_path, minimal_config_dict), str(status_file), offline=True
+    )
+
+    assert [client.mac for client in cfg.clients] == ["de:ad:be:ef:00:0a", "auto"]
+    mock_resolve.assert_not_called()
+    mock_save.assert_not_called()
+
+
+def test_load_config_reuses_known_macs(mocker, tmp_path, minimal_config_dict):
+    """Tests that a reload only resolves MACs for hosts that aren't known yet."""
+    minimal_config_dict["clients"][0]["mac"] = "auto"
+    minimal_config_dict["clients"].append(
+        {"name": "client-2", "host": "192.168.1.11", "mac": "auto"}
+    )
+    mock_resolve = mocker.patch(
+        "wolnut.config.resolve_macs_from_hosts",
+        return_value={"192.168.1.11": "de:ad:be:ef:00:0b"},
+    )
+
+    cfg = config.load_config(
+        write_config(tmp_path, minimal_config_dict),
+        str(tmp_path / "state.json"),
+        known_macs={"192.168.1.10": "de:ad:be:ef:00:0a"},
+    )
+
+    assert [client.mac for client in cfg.clients] == [
+        "de:ad:be:ef:00:0a",
+        "de:ad:be:ef:00:0b",
+    ]
+    assert mock_resolve.call_args.args[0] == ["192.168.1.11"]
 
 
 def test_load_config_file_not_found(mocker):
@@ -107,7 +245,9 @@ def test_load_config_mac_resolution_fails(mocker, minimal_config_dict):
         "builtins.open", mocker.mock_open(read_data=yaml.dump(minimal_config_dict))
     )
     mocker.patch("wolnut.config.validate_config")
-    mocker.patch("wolnut.config.resolve_mac_from_host", return_value=None)
+    mocker.patch(
+        "wolnut.config.resolve_macs_from_hosts", return_value={"192.168.1.10": None}
+    )
 
     cfg = config.load_config("dummy.yaml", None, False)
 
@@ -135,6 +275,10 @@ def test_load_config_mac_resolution_fails(mocker, minimal_config_dict):
             },  # This test is correct
             "Client 'c1' is missing required field: 'mac'",
         ),
+        (
+            {"nut": {"ups": "ups"}, "clients": [], "log_format": "xml"},
+            "Invalid log format 'xml'",
+        ),
         (
             {
                 "nut": {"ups": "ups"},
@@ -157,6 +301,227 @@ def test_validate_config_failures(invalid_config, error_msg):
         config.validate_config(invalid_config)
 
 
+def test_load_config_multiple_ups(mocker, minimal_config_dict):
+    """Tests loading several UPS units with client bindings."""
+    minimal_config_dict["nut"] = [
+        {"ups": "ups1@nut-a", "name": "rack-a"},
+        {"ups": "ups2@nut-b"},
+    ]
+    minimal_config_dict["clients"][0]["ups"] = "rack-a"
+    mocker.patch(
+        "builtins.open", mocker.mock_open(read_data=yaml.dump(minimal_config_dict))
+    )
+
+    cfg = config.load_config("dummy.yaml", "/tmp/status.json", False)
+
+    assert [nut.label for nut in cfg.nut] == ["rack-a", "ups2@nut-b"]
+    assert cfg.clients[0].ups == ["rack-a"]
+
+
+@pytest.mark.parametrize(
+    "nut, client_ups, error_msg",
+    [
+        ([{"ups": "a"}, {"ups": "a"}], [], "duplicate name"),
+        ([{"ups": "a"}, {"name": "b"}], [], "Missing required field: 'nut.ups'"),
+        ([{"ups": "a", "name": "rack-a"}], ["a"], "bound to unknown UPS: 'a'"),
+    ],
+)
+def test_validate_config_multiple_ups_failures(
+    minimal_config_dict, nut, client_ups, error_msg
+):
+    """Tests validation of UPS lists and client bindings."""
+    minimal_config_dict["nut"] = nut
+    minimal_config_dict["clients"][0]["ups"] = client_ups
+    with pytest.raises(ValueError, match=error_msg):
+        config.validate_config(minimal_config_dict)
+
+
+@pytest.mark.parametrize(
+    "depends_on, error_msg",
+    [
+        ({"client-1": "nas"}, "depends on unknown client: 'nas'"),
+        ({"client-1": "client-1"}, "form a cycle: client-1 -> client-1"),
+        (
+            {"client-1": "client-2", "client-2": ["client-1"]},
+            "form a cycle: client-1 -> client-2 -> client-1",
+        ),
+    ],
+)
+def test_validate_config_dependency_failures(
+    minimal_config_dict, depends_on, error_msg
+):
+    """Tests that unknown and circular client dependencies are rejected."""
+    minimal_config_dict["clients"].append(
+        {"name": "client-2", "host": "192.168.1.11", "mac": "DE:AD:BE:EF:00:02"}
+    )
+    for client in minimal_config_dict["clients"]:
+        if client["name"] in depends_on:
+            client["depends_on"] = depends_on[client["name"]]
+    with pytest.raises(ValueError, match=error_msg):
+        config.validate_config(minimal_config_dict)
+
+
+def test_load_config_retry_policies(tmp_path, minimal_config_dict):
+    """Tests that named retry policies inherit the wake_on retry settings."""
+    minimal_config_dict["wake_on"] = {"reattempt_delay": 45, "max_attempts": 5}
+    minimal_config_dict["retry_policies"] = {"slow": {"backoff": 2, "jitter": 0.1}}
+    minimal_config_dict["clients"][0]["retry_policy"] = "slow"
+
+    cfg = config.load_config(write_config(tmp_path, minimal_config_dict))
+
+    assert cfg.wake_on.retry_policy() == RetryPolicy(reattempt_delay=45, max_attempts=5)
+    assert cfg.retry_policies["slow"] == RetryPolicy(
+        reattempt_delay=45, backoff=2, jitter=0.1, max_attempts=5
+    )
+    assert cfg.clients[0].retry_policy == "slow"
+
+
+@pytest.mark.parametrize(
+    "wake_on, policies, client_policy, error_msg",
+    [
+        ({}, {}, "slow", "uses unknown retry policy: 'slow'"),
+        ({}, {"slow": {"delay": 5}}, None, "unknown option: 'delay'"),
+        ({}, {"slow": {"backoff": 0.5}}, None, "backoff must be at least 1"),
+        ({"retry_jitter": 1}, {}, None, "jitter must be between 0 and 1"),
+        ({"max_attempts": -1}, {}, None, "max_attempts can't be negative"),
+    ],
+)
+def test_validate_config_retry_failures(
+    minimal_config_dict, wake_on, policies, client_policy, error_msg
+):
+    minimal_config_dict["wake_on"] = wake_on
+    minimal_config_dict["retry_policies"] = policies
+    minimal_config_dict["clients"][0]["retry_policy"] = client_policy
+    with pytest.raises(ValueError, match=error_msg):
+        config.validate_config(minimal_config_dict)
+
+
+def test_load_config_readiness_checks(tmp_path, minimal_config_dict):
+    minimal_config_dict["clients"][0]["readiness"] = [
+        {"type": "tcp", "port": 8006},
+        {"type": "http", "url": "https://{host}:8006/", "verify_tls": False},
+    ]
+
+    cfg = config.load_config(write_config(tmp_path, minimal_config_dict))
+
+    assert cfg.clients[0].readiness == [
+        ReadinessCheck("tcp", port=8006),
+        ReadinessCheck("http", url="https://{host}:8006/", verify_tls=False),
+    ]
+
+
+@pytest.mark.parametrize(
+    "check, error_msg",
+    [
+        ({"type": "ssh"}, "readiness check without a valid type"),
+        ({"type": "tcp"}, "tcp readiness check without 'port'"),
+        ({"type": "http", "path": "/"}, "unknown option: 'path'"),
+        ({"type": "command"}, "command readiness check without 'command'"),
+    ],
+)
+def test_validate_config_readiness_failures(minimal_config_dict, check, error_msg):
+    minimal_config_dict["clients"][0]["readiness"] = [check]
+    with pytest.raises(ValueError, match=error_msg):
+        config.validate_config(minimal_config_dict)
+
+
+def test_load_config_wol_targets(mocker, tmp_path, minimal_config_dict):
+    """Tests that WOL targets come from the client's subnet unless configured."""
+    mocker.patch(
+        "wolnut.config.local_subnets",
+        return_value=[
+            Subnet("eth0", ipaddress.IPv4Network("192.168.1.0/24"), "192.168.1.255"),
+            Subnet("eth0.20", ipaddress.IPv4Network("10.20.0.0/16"), "10.20.255.255"),
+        ],
+    )
+    minimal_config_dict["clients"] += [
+        {"name": "client-2", "host": "10.20.0.5", "mac": "DE:AD:BE:EF:00:02"},
+        {"name": "client-3", "host": "172.16.0.5", "mac": "DE:AD:BE:EF:00:03"},
+        {
+            "name": "client-4",
+            "host": "172.16.0.6",
+            "mac": "DE:AD:BE:EF:00:04",
+            "broadcast": "172.16.0.255",
+            "interface": "wg0",
+        },
+    ]
+
+    cfg = config.load_config(write_config(tmp_path, minimal_config_dict))
+
+    assert [client.wol_target for client in cfg.clients] == [
+        WolTarget("192.168.1.255", "eth0"),
+        WolTarget("10.20.255.255", "eth0.20"),
+        WolTarget("255.255.255.255"),  # Not on a local subnet
+        WolTarget("172.16.0.255", "wg0"),
+    ]
+
+
+def test_load_config_fixed_broadcast(mocker, tmp_path, minimal_config_dict):
+    mock_subnets = mocker.patch("wolnut.config.local_subnets")
+    minimal_config_dict["wake_on"] = {"broadcast": "192.168.1.255"}
+
+    cfg = config.load_config(write_config(tmp_path, minimal_config_dict))
+
+    assert cfg.clients[0].wol_target == WolTarget("192.168.1.255")
+    mock_subnets.assert_not_called()
+
+
+def test_load_config_without_subnets(mocker, tmp_path, minimal_config_dict, caplog):
+    mocker.patch("wolnut.config.local_subnets", side_effect=OSError("not Linux"))
+
+    cfg = config.load_config(write_config(tmp_path, minimal_config_dict))
+
+    assert cfg.clients[0].wol_target == WolTarget("255.255.255.255")
+    assert "Could not list the local subnets" in caplog.text
+
+
+def test_load_config_ethernet_transport(mocker, tmp_path, minimal_config_dict, caplog):
+    """Tests that raw frames fall back to UDP for clients without an interface."""
+    mocker.patch(
+        "wolnut.config.local_subnets",
+        return_value=[
+            Subnet("eth0", ipaddress.IPv4Network("192.168.1.0/24"), "192.168.1.255")
+        ],
+    )
+    # A fixed broadcast doesn't stop raw frames from finding their interface
+    minimal_config_dict["wake_on"] = {"broadcast": "192.168.1.255"}
+    minimal_config_dict["clients"][0]["wol_transport"] = "ethernet"
+    minimal_config_dict["clients"].append(
+        {
+            "name": "client-2",
+            "host": "172.16.0.5",
+            "mac": "DE:AD:BE:EF:00:02",
+            "wol_transport": "ethernet",
+        }
+    )
+
+    cfg = config.load_config(write_config(tmp_path, minimal_config_dict))
+
+    assert [client.wol_target for client in cfg.clients] == [
+        WolTarget("192.168.1.255", "eth0", "ethernet"),
+        WolTarget("192.168.1.255"),
+    ]
+    assert "client-2 is on no local subnet" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "wake_on, client, error_msg",
+    [
+        ({"broadcast": "everywhere"}, {}, "wake_on has an invalid broadcast"),
+        ({}, {"broadcast": "auto"}, "'client-1' has an invalid broadcast"),
+        ({}, {"interface": ""}, "'client-1' has an invalid interface"),
+        ({}, {"wol_transport": "raw"}, "'client-1' has an invalid wol_transport"),
+    ],
+)
+def test_validate_config_wol_target_failures(
+    minimal_config_dict, wake_on, client, error_msg
+):
+    minimal_config_dict["wake_on"] = wake_on
+    minimal_config_dict["clients"][0].update(client)
+    with pytest.raises(ValueError, match=error_msg):
+        config.validate_config(minimal_config_dict)
+
+
 def test_validate_config_success(minimal_config_dict):
     """Tests that a valid config passes validation without error."""
     try:
@@ -172,7 +537,7 @@ def test_load_config_status_path_override(mocker, minimal_config_dict):
         "builtins.open", mocker.mock_open(read_data=yaml.dump(minimal_config_dict))
     )
     mocker.patch("wolnut.config.validate_config")
-    mocker.patch("wolnut.config.resolve_mac_from_host")
+    mocker.patch("wolnut.config.resolve_macs_from_hosts")
 
     cfg = config.load_config("dummy.yaml", "/override/status.json", False)
 
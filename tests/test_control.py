@@ -0,0 +1,86 @@
+import json
+import threading
+
+import pytest
+
+from wolnut import control
+
+
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        (b"not json", "Expecting value"),
+        (b"[]", "Expected a JSON object"),
+        (b'{"command": "shutdown"}', "Unknown command: shutdown"),
+        (b'{"command": "wake", "args": []}', "Expected args to be a JSON object"),
+    ],
+)
+def test_parse_request_rejects(data, error):
+    with pytest.raises(ValueError, match=error):
+        control.parse_request(data)
+
+
+def test_parse_request():
+    request = control.parse_request(
+        b'{"command": "wake", "args": {"targets": ["nas"]}}\n'
+    )
+    assert (request.command, request.args) == ("wake", {"targets": ["nas"]})
+
+
+def test_send_request_without_server(tmp_path):
+    with pytest.raises(OSError):
+        control.send_request(str(tmp_path / "control.sock"), "status")
+
+
+@pytest.fixture
+def server(tmp_path):
+    """A control server whose requests are answered by a stand-in control loop."""
+    server = control.ControlServer(str(tmp_path / "run" / "control.sock"), timeout=2)
+    received = threading.Event()
+    server.on_request = received.set
+    stopping = threading.Event()
+
+    def answer():
+        while not stopping.is_set():
+            if not received.wait(timeout=0.1):
+                continue
+            received.clear()
+            for request in server.drain():
+                if request.command == "wake":
+                    request.reply(request.args["targets"])
+                else:
+                    request.fail("Not supported here")
+
+    thread = threading.Thread(target=answer, daemon=True)
+    server.start()
+    thread.start()
+    yield server
+    stopping.set()
+    thread.join(timeout=2)
+    server.stop()
+
+
+def test_round_trip(server):
+    assert control.send_request(server.socket_path, "wake", targets=["nas"]) == ["nas"]
+
+
+def test_error_response(server):
+    with pytest.raises(control.ControlError, match="Not supported here"):
+        control.send_request(server.socket_path, "reset")
+
+
+def test_invalid_request_gets_an_answer(server):
+    with pytest.raises(control.ControlError, match="Unknown command: nope"):
+        control.send_request(server.socket_path, "nope")
+
+
+def test_unanswered_request_times_out(tmp_path):
+    server = control.ControlServer(str(tmp_path / "control.sock"), timeout=0.1)
+    server.start()
+    try:
+        with pytest.raises(control.ControlError, match="did not answer in time"):
+            control.send_request(server.socket_path, "status")
+    finally:
+        server.stop()
+
+    assert not (tmp_path / "control.sock").exists()
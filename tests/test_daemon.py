@@ -0,0 +1,904 @@
+import pytest
+
+from wolnut import daemon, events, metrics
+from wolnut.clock import VirtualClock
+from wolnut.config import ClientConfig, NutConfig, WakeOnConfig, WolnutConfig
+from wolnut.control import ControlRequest, ControlServer
+from wolnut.neighbors import (
+    NUD_REACHABLE,
+    NUD_STALE,
+    RTM_NEWNEIGH,
+    Neighbor,
+    NeighborTable,
+)
+from wolnut.readiness import ReadinessCheck
+from wolnut.retry_policy import RetryPolicy
+from wolnut.wol import WolTarget, build_magic_packet
+
+
+@pytest.fixture
+def clock():
+    """Simulated time for the daemon, its scheduler and its state tracker."""
+    return VirtualClock(1000.0)
+
+
+@pytest.fixture
+def config(tmp_path):
+    return WolnutConfig(
+        nut=[NutConfig(ups="ups")],
+        status_file=str(tmp_path / "state.json"),
+        poll_interval=10,
+        wake_on=WakeOnConfig(
+            restore_delay_sec=30,
+            min_battery_percent=20,
+            client_timeout_sec=300,
+            reattempt_delay=30,
+        ),
+        clients=[
+            ClientConfig(name="nas", host="10.0.0.1", mac="DE:AD:BE:EF:00:01"),
+            ClientConfig(name="desktop", host="10.0.0.2", mac="DE:AD:BE:EF:00:02"),
+        ],
+    )
+
+
+@pytest.fixture
+def backends(mocker):
+    ups = mocker.patch(
+        "wolnut.daemon.get_ups_status",
+        return_value={"ups.status": "OL", "battery.charge": "100"},
+    )
+    probe = mocker.patch(
+        "wolnut.daemon.probe_rtts",
+        return_value={"10.0.0.1": 0.001, "10.0.0.2": 0.001},
+    )
+    wol = mocker.patch(
+        "wolnut.daemon.send_wol_packets",
+        side_effect=lambda packets, **kwargs: {name: True for name in packets},
+    )
+    return ups, probe, wol
+
+
+def set_ups(backends, status, charge=100):
+    backends[0].return_value = {"ups.status": status, "battery.charge": str(charge)}
+
+
+def set_online(backends, **hosts):
+    backends[1].return_value = {
+        host: 0.001 if online else None for host, online in hosts.items()
+    }
+
+
+def test_get_battery_percent():
+    assert daemon.get_battery_percent({"battery.charge": "95.5"}) == 96
+    assert daemon.get_battery_percent({}) == 100
+
+
+def test_steady_state_sleeps_poll_interval(config, backends, clock):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    wolnut.step()
+
+    assert wolnut.scheduler.next_deadline() == (daemon.POLL, 1010.0)
+    backends[2].assert_not_called()
+
+
+def test_on_battery_polls_faster(config, backends, clock):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    unit = wolnut.units[0]
+    set_ups(backends, "OB DISCHRG", 80)
+    wolnut.step()
+
+    assert unit.on_battery
+    assert wolnut.state_tracker.was_online_before_shutdown("nas")
+    assert wolnut.scheduler.next_deadline() == (
+        daemon.POLL,
+        1000.0 + daemon.ON_BATTERY_POLL_INTERVAL,
+    )
+
+
+def test_full_outage_and_restore(config, backends, clock):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    unit = wolnut.units[0]
+    wolnut.step()
+
+    # Power fails with both clients online
+    set_ups(backends, "OB DISCHRG", 80)
+    wolnut.step()
+
+    # Clients shut down, then power comes back
+    clock.now += 60
+    set_online(backends, **{"10.0.0.1": False, "10.0.0.2": False})
+    wolnut.step()
+    clock.now += 2
+    set_ups(backends, "OL CHRG", 80)
+    wolnut.step()
+
+    # The restore delay expiry is scheduled exactly
+    assert unit.restoration_event
+    assert wolnut.scheduler.deadline(unit.key(daemon.RESTORE_DELAY)) == 1092.0
+    backends[2].assert_not_called()
+
+    clock.now = 1092.0
+    wolnut.step()
+    packets = backends[2].call_args.args[0]
+    assert set(packets) == {"nas", "desktop"}
+    assert wolnut.scheduler.deadline(daemon.WOL_RETRY_PREFIX + "nas") == 1122.0
+
+    # NAS comes back, desktop needs a retry
+    clock.now = 1122.0
+    set_online(backends, **{"10.0.0.1": True, "10.0.0.2": False})
+    wolnut.step()
+    assert set(backends[2].call_args.args[0]) == {"desktop"}
+    assert daemon.WOL_RETRY_PREFIX + "nas" not in wolnut.scheduler
+
+    clock.now = 1130.0
+    set_online(backends, **{"10.0.0.1": True, "10.0.0.2": True})
+    wolnut.step()
+    assert not unit.restoration_event
+    assert unit.key(daemon.CLIENT_TIMEOUT) not in wolnut.scheduler
+    assert daemon.WOL_RETRY_PREFIX + "desktop" not in wolnut.scheduler
+
+
+def test_low_battery_delays_wol(config, backends, clock):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    unit = wolnut.units[0]
+    set_ups(backends, "OB DISCHRG", 15)
+    wolnut.step()
+    set_online(backends, **{"10.0.0.1": False, "10.0.0.2": False})
+    set_ups(backends, "OL CHRG", 15)
+    clock.now += 100
+    wolnut.step()
+
+    backends[2].assert_not_called()
+    assert unit.restoration_event
+
+
+def test_client_timeout(config, backends, clock, caplog):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    unit = wolnut.units[0]
+    set_ups(backends, "OB DISCHRG", 80)
+    wolnut.step()
+    set_online(backends, **{"10.0.0.1": False, "10.0.0.2": False})
+    set_ups(backends, "OL", 80)
+    wolnut.step()
+    clock.now += 30
+    wolnut.step()
+
+    assert wolnut.scheduler.deadline(unit.key(daemon.CLIENT_TIMEOUT)) == pytest.approx(
+        1300.0
+    )
+
+    clock.now = 1300.001
+    wolnut.step()
+    assert not unit.restoration_event
+    assert "nas failed to come back online" in caplog.text
+
+
+def test_resumes_from_battery_event(config, backends, clock):
+    tracker = daemon.WolnutDaemon(config, clock=clock).state_tracker
+    tracker.set_ups_on_battery(True, 50)
+    tracker.save_state()
+
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    unit = wolnut.units[0]
+    assert unit.restoration_event
+
+
+def test_power_event_triggers_snapshot_before_poll_notices(config, backends, clock):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    unit = wolnut.units[0]
+    wolnut.event_listener = events.PowerEventListener("unused")
+    wolnut.step()
+
+    # upsmon tells us first; our poll still reads the old status
+    wolnut.event_listener.events.put(events.PowerEvent("ONBATT", "ups@localhost"))
+    wolnut.step()
+
+    assert unit.on_battery
+    assert wolnut.state_tracker.was_online_before_shutdown("nas")
+
+
+def test_power_event_for_other_ups_is_ignored(config, backends, clock):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    unit = wolnut.units[0]
+    wolnut.event_listener = events.PowerEventListener("unused")
+    wolnut.event_listener.events.put(events.PowerEvent("ONBATT", "other"))
+    wolnut.step()
+
+    assert not unit.on_battery
+
+
+@pytest.fixture
+def multi_ups_config(config):
+    config.nut = [
+        NutConfig(ups="ups1@nut-a", name="rack-a"),
+        NutConfig(ups="ups2@nut-a", name="rack-b"),
+        NutConfig(ups="ups3@nut-b", name="rack-c"),
+    ]
+    config.clients[0].ups = ["rack-a"]
+    config.clients[1].ups = ["rack-b", "rack-c"]
+    return config
+
+
+def test_units_bind_clients_and_share_connections(multi_ups_config, backends):
+    wolnut = daemon.WolnutDaemon(multi_ups_config)
+    rack_a, rack_b, rack_c = wolnut.units
+
+    assert rack_a.client_names == ["nas"]
+    assert rack_b.client_names == ["desktop"]
+    assert rack_c.client_names == ["desktop"]
+    assert rack_a.nut_client is rack_b.nut_client
+    assert rack_a.nut_client is not rack_c.nut_client
+
+
+def test_one_probe_sweep_for_all_units(multi_ups_config, backends, clock):
+    wolnut = daemon.WolnutDaemon(multi_ups_config, clock=clock)
+    wolnut.step()
+
+    assert backends[0].call_count == 3
+    backends[1].assert_called_once()
+
+
+def test_outage_on_one_ups(multi_ups_config, backends, clock):
+    ups_status = {
+        "ups1": {"ups.status": "OB", "battery.charge": "90"},
+        "ups2": {"ups.status": "OL", "battery.charge": "100"},
+        "ups3": {"ups.status": "OL", "battery.charge": "100"},
+    }
+    backends[0].side_effect = lambda client, ups, variables: ups_status[ups]
+    wolnut = daemon.WolnutDaemon(multi_ups_config, clock=clock)
+    rack_a, rack_b, _ = wolnut.units
+    tracker = wolnut.state_tracker
+
+    wolnut.step()
+    assert rack_a.on_battery and not rack_b.on_battery
+    assert tracker.was_ups_on_battery("rack-a")
+    assert not tracker.was_ups_on_battery("rack-b")
+    assert tracker.was_online_before_shutdown("nas")
+    assert not tracker.was_online_before_shutdown("desktop")
+
+    # Only the NAS lost power, so only the NAS gets woken
+    set_online(backends, **{"10.0.0.1": False, "10.0.0.2": True})
+    ups_status["ups1"] = {"ups.status": "OL", "battery.charge": "90"}
+    wolnut.step()
+    clock.now += 30
+    wolnut.step()
+
+    assert set(backends[2].call_args.args[0]) == {"nas"}
+    assert rack_a.restoration_event
+    assert not rack_b.restoration_event
+
+
+def test_idle_ups_keeps_shared_clients_state(config, backends, clock):
+    """Tests that an idle UPS doesn't reset clients another UPS is restoring."""
+    config.nut = [NutConfig(ups="ups1", name="rack-a"), NutConfig(ups="ups2")]
+    ups_status = {
+        "ups1": {"ups.status": "OB", "battery.charge": "90"},
+        "ups2": {"ups.status": "OL", "battery.charge": "100"},
+    }
+    backends[0].side_effect = lambda client, ups, variables: ups_status[ups]
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    rack_a, idle = wolnut.units
+    tracker = wolnut.state_tracker
+    assert rack_a.client_names == idle.client_names == ["nas", "desktop"]
+
+    wolnut.step()
+    set_online(backends, **{"10.0.0.1": False, "10.0.0.2": False})
+    clock.now += 10
+    wolnut.step()
+    assert tracker.was_online_before_shutdown("nas")
+
+    ups_status["ups1"] = {"ups.status": "OL", "battery.charge": "90"}
+    wolnut.step()
+    clock.now += 30
+    wolnut.step()
+    assert set(backends[2].call_args.args[0]) == {
+        "nas",
+        "desktop",
+    }
+    clock.now += 5
+    wolnut.step()
+    assert tracker.wol_attempts("nas") == 1
+    assert tracker.was_online_before_shutdown("desktop")
+
+    # Once the outage is over, the idle UPS may reset them again
+    set_online(backends, **{"10.0.0.1": True, "10.0.0.2": True})
+    clock.now += 30
+    wolnut.step()
+    wolnut.step()
+    assert not rack_a.restoration_event
+    assert not tracker.was_online_before_shutdown("nas")
+
+
+def test_power_event_only_for_matching_unit(multi_ups_config, backends, clock):
+    wolnut = daemon.WolnutDaemon(multi_ups_config, clock=clock)
+    wolnut.event_listener = events.PowerEventListener("unused")
+    wolnut.event_listener.events.put(events.PowerEvent("ONBATT", "ups2@nut-a"))
+    wolnut.step()
+
+    assert [unit.on_battery for unit in wolnut.units] == [False, True, False]
+
+
+def test_metrics_are_recorded(config, backends, clock):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    loops = metrics.LOOP_SECONDS.count()
+    rtts = metrics.PROBE_RTT_SECONDS.count(client="nas")
+
+    set_ups(backends, "OB DISCHRG", 64)
+    wolnut.step()
+
+    assert metrics.LOOP_SECONDS.count() == loops + 1
+    assert metrics.PROBE_RTT_SECONDS.count(client="nas") == rtts + 1
+    assert metrics.UPS_POLL_SECONDS.count(ups="ups") >= 1
+    assert metrics.BATTERY_PERCENT.value(ups="ups") == 64
+
+
+def test_wol_metrics(config, backends, clock):
+    backends[2].side_effect = lambda packets, **kwargs: {
+        name: name == "nas" for name in packets
+    }
+    sent = metrics.WOL_PACKETS.value(result="sent")
+    failed = metrics.WOL_PACKETS.value(result="failed")
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    set_ups(backends, "OB DISCHRG", 80)
+    wolnut.step()
+    set_online(backends, **{"10.0.0.1": False, "10.0.0.2": False})
+    set_ups(backends, "OL", 80)
+    wolnut.step()
+    clock.now += 30
+    wolnut.step()
+
+    assert metrics.WOL_PACKETS.value(result="sent") == sent + 1
+    assert metrics.WOL_PACKETS.value(result="failed") == failed + 1
+    assert metrics.CLIENTS_DOWN.value() == 2
+
+
+def start_restoration(wolnut, backends, clock):
+    """Runs an outage up to the end of the restore delay with every client down."""
+    wolnut.step()
+    set_ups(backends, "OB DISCHRG", 80)
+    wolnut.step()
+    set_online(backends, **{"10.0.0.1": False, "10.0.0.2": False})
+    set_ups(backends, "OL CHRG", 80)
+    wolnut.step()
+    clock.now += 30
+
+
+def test_wol_targets_are_passed_on(config, backends, clock):
+    config.clients[1].wol_target = WolTarget("10.20.255.255", "eth0.20")
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    start_restoration(wolnut, backends, clock)
+    wolnut.step()
+
+    assert backends[2].call_args.kwargs["targets"] == {
+        "nas": WolTarget("255.255.255.255"),
+        "desktop": WolTarget("10.20.255.255", "eth0.20"),
+    }
+
+
+def test_wake_waves_respect_budget(config, backends, clock):
+    config.nut[0].wake_budget = 1
+    config.wake_on.wave_timeout_sec = 100
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    unit = wolnut.units[0]
+    start_restoration(wolnut, backends, clock)
+
+    wolnut.step()
+    assert set(backends[2].call_args.args[0]) == {"nas"}
+    assert wolnut.scheduler.deadline(unit.key(daemon.WAVE_TIMEOUT)) == clock.now + 100
+
+    # The first wave is still booting, only the NAS gets a retry
+    clock.now += 30
+    wolnut.step()
+    assert set(backends[2].call_args.args[0]) == {"nas"}
+
+    # Once the NAS is online the next wave starts straight away
+    clock.now += 10
+    set_online(backends, **{"10.0.0.1": True, "10.0.0.2": False})
+    wolnut.step()
+    assert set(backends[2].call_args.args[0]) == {"desktop"}
+    assert unit.key(daemon.WAVE_TIMEOUT) not in wolnut.scheduler
+
+
+def test_wake_wave_timeout(config, backends, clock):
+    config.nut[0].wake_budget = 1
+    config.wake_on.wave_timeout_sec = 45
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    start_restoration(wolnut, backends, clock)
+
+    wolnut.step()
+    clock.now += 45
+    wolnut.step()
+
+    # The NAS never came up, so the desktop is woken alongside its retry
+    assert set(backends[2].call_args.args[0]) == {
+        "nas",
+        "desktop",
+    }
+
+
+def test_heavy_client_gets_its_own_wave(config, backends, clock):
+    config.nut[0].wake_budget = 2
+    config.clients[0].power_weight = 3
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    start_restoration(wolnut, backends, clock)
+
+    wolnut.step()
+
+    assert set(backends[2].call_args.args[0]) == {"nas"}
+
+
+def test_wake_wave_waits_for_load(config, backends, clock):
+    config.nut[0].max_load_percent = 50
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    start_restoration(wolnut, backends, clock)
+
+    backends[0].return_value = {"ups.status": "OL", "ups.load": "65"}
+    wolnut.step()
+    backends[2].assert_not_called()
+    assert backends[0].call_args.args[2] == ("ups.status", "battery.charge", "ups.load")
+
+    clock.now += 10
+    backends[0].return_value = {"ups.status": "OL", "ups.load": "40"}
+    wolnut.step()
+    assert set(backends[2].call_args.args[0]) == {
+        "nas",
+        "desktop",
+    }
+
+
+def test_dependencies_are_woken_first(config, backends, clock):
+    config.clients[1].depends_on = ["nas"]
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    start_restoration(wolnut, backends, clock)
+
+    wolnut.step()
+    assert set(backends[2].call_args.args[0]) == {"nas"}
+
+    # The desktop is woken as soon as the NAS answers probes
+    clock.now += 10
+    set_online(backends, **{"10.0.0.1": True, "10.0.0.2": False})
+    wolnut.step()
+    assert set(backends[2].call_args.args[0]) == {"desktop"}
+
+
+def test_dependencies_without_budget_ignore_other_clients(config, backends, clock):
+    config.clients.append(
+        ClientConfig(name="printer", host="10.0.0.3", mac="DE:AD:BE:EF:00:03")
+    )
+    config.clients[1].depends_on = ["nas"]
+    set_online(backends, **{"10.0.0.1": True, "10.0.0.2": True, "10.0.0.3": True})
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    wolnut.step()
+    set_ups(backends, "OB DISCHRG", 80)
+    wolnut.step()
+    set_online(backends, **{"10.0.0.1": False, "10.0.0.2": False, "10.0.0.3": False})
+    set_ups(backends, "OL CHRG", 80)
+    wolnut.step()
+    clock.now += 30
+
+    wolnut.step()
+    assert set(backends[2].call_args.args[0]) == {
+        "nas",
+        "printer",
+    }
+
+    # The printer never comes up, but without a wake budget it holds nothing back
+    clock.now += 10
+    set_online(backends, **{"10.0.0.1": True, "10.0.0.2": False, "10.0.0.3": False})
+    wolnut.step()
+    assert set(backends[2].call_args.args[0]) == {"desktop"}
+    assert wolnut.units[0].key(daemon.WAVE_TIMEOUT) not in wolnut.scheduler
+
+
+def test_dependencies_wait_for_readiness(config, backends, clock, mocker):
+    config.clients[0].readiness = [ReadinessCheck("tcp", port=443)]
+    config.clients[1].depends_on = ["nas"]
+    check = mocker.patch("wolnut.daemon.check_readiness", return_value={"nas": False})
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    start_restoration(wolnut, backends, clock)
+    wolnut.step()
+
+    # The NAS answers pings, but neither gets a retry nor lets the desktop go
+    clock.now += 30
+    set_online(backends, **{"10.0.0.1": True, "10.0.0.2": False})
+    wolnut.step()
+    assert backends[2].call_count == 1
+    assert wolnut.state_tracker.is_online("nas")
+    assert not wolnut.state_tracker.is_ready("nas")
+    assert "nas" in wolnut.units[0].recorded_down_clients
+    assert check.call_args.args[0] == {"nas": ("10.0.0.1", config.clients[0].readiness)}
+
+    clock.now += 10
+    check.return_value = {"nas": True}
+    wolnut.step()
+    assert set(backends[2].call_args.args[0]) == {"desktop"}
+    assert "nas" not in wolnut.units[0].recorded_down_clients
+
+
+def test_readiness_timeout_is_reported(config, backends, clock, mocker, caplog):
+    config.clients[0].readiness = [ReadinessCheck("tcp", port=443)]
+    mocker.patch("wolnut.daemon.check_readiness", return_value={"nas": False})
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    start_restoration(wolnut, backends, clock)
+    set_online(backends, **{"10.0.0.1": True, "10.0.0.2": True})
+
+    clock.now += config.wake_on.client_timeout_sec
+    wolnut.step()
+
+    assert not wolnut.units[0].restoration_event
+    assert "nas answers probes but failed its readiness checks" in caplog.text
+
+
+def probed_hosts(backends):
+    return backends[1].call_args.args[0] if backends[1].called else None
+
+
+def test_idle_probes_are_spaced(config, backends, clock):
+    config.probe.idle_interval_sec = 60
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    wolnut.step()
+    assert wolnut.scheduler.deadline(daemon.PROBE) == 1060.0
+
+    clock.now += 10
+    wolnut.step()
+    backends[1].assert_called_once()
+
+    clock.now = 1060.0
+    wolnut.step()
+    assert backends[1].call_count == 2
+
+
+def test_power_loss_sweeps_immediately(config, backends, clock):
+    config.probe.idle_interval_sec = 60
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    wolnut.step()
+
+    # The desktop shut down after the last idle sweep
+    clock.now += 10
+    set_online(backends, **{"10.0.0.1": True, "10.0.0.2": False})
+    set_ups(backends, "OB DISCHRG", 80)
+    wolnut.step()
+
+    assert backends[1].call_count == 2
+    assert not wolnut.state_tracker.was_online_before_shutdown("desktop")
+
+
+def test_skipped_clients_are_not_probed(config, backends, clock):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    set_online(backends, **{"10.0.0.1": True, "10.0.0.2": False})
+    set_ups(backends, "OB DISCHRG", 80)
+    wolnut.step()
+    set_online(backends, **{"10.0.0.1": False, "10.0.0.2": False})
+    set_ups(backends, "OL CHRG", 80)
+    wolnut.step()
+    clock.now += 30
+    wolnut.step()
+    assert wolnut.state_tracker.should_skip("desktop")
+
+    clock.now += 10
+    wolnut.step()
+    assert probed_hosts(backends) == ["10.0.0.1"]
+
+
+def test_probes_back_off_while_booting(config, backends, clock):
+    config.probe.wol_backoff_sec = 5
+    config.clients[0].boot_time_sec = 40
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    start_restoration(wolnut, backends, clock)
+
+    wolnut.step()
+    woken_at = clock.now
+    assert wolnut.scheduler.deadline(daemon.PROBE) == woken_at + 5
+
+    # Only the desktop, which has no boot time, is probed on the next poll
+    clock.now = woken_at + 2
+    wolnut.step()
+    assert probed_hosts(backends) == ["10.0.0.2"]
+
+    clock.now = woken_at + 5
+    wolnut.step()
+    assert "10.0.0.1" in probed_hosts(backends)
+    assert wolnut.scheduler.deadline(daemon.PROBE) == woken_at + 15
+
+
+def sent_names(backends):
+    return [set(call.args[0]) for call in backends[2].call_args_list]
+
+
+def test_retry_policy_backs_off_and_gives_up(config, backends, clock):
+    config.retry_policies = {"flaky": RetryPolicy(30, backoff=2, max_attempts=3)}
+    config.clients[0].retry_policy = "flaky"
+    config.wake_on.client_timeout_sec = 1000
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    start_restoration(wolnut, backends, clock)
+    wolnut.step()
+    woken_at = clock.now
+    retry = daemon.WOL_RETRY_PREFIX + "nas"
+    assert wolnut.scheduler.deadline(retry) == woken_at + 30
+
+    clock.now = woken_at + 30
+    wolnut.step()
+    assert wolnut.scheduler.deadline(retry) == woken_at + 90
+
+    # The desktop keeps the fixed wake_on delay
+    clock.now = woken_at + 60
+    wolnut.step()
+    assert sent_names(backends)[-1] == {"desktop"}
+
+    clock.now = woken_at + 90
+    wolnut.step()
+    assert wolnut.state_tracker.wol_attempts("nas") == 3
+    assert retry not in wolnut.scheduler
+
+    clock.now = woken_at + 400
+    wolnut.step()
+    assert wolnut.state_tracker.wol_attempts("nas") == 3
+
+
+def test_no_retries_within_boot_time(config, backends, clock):
+    config.clients[0].boot_time_sec = 100
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    start_restoration(wolnut, backends, clock)
+    wolnut.step()
+    woken_at = clock.now
+
+    assert wolnut.scheduler.deadline(daemon.WOL_RETRY_PREFIX + "nas") == woken_at + 100
+    clock.now = woken_at + 30
+    wolnut.step()
+    assert sent_names(backends)[-1] == {"desktop"}
+
+
+def neighbor(table, ip, state):
+    table.apply([(RTM_NEWNEIGH, Neighbor(ip, state))])
+
+
+def test_passive_liveness_skips_probes(config, backends, clock):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    wolnut.neighbors = NeighborTable(clock=clock)
+    neighbor(wolnut.neighbors, "10.0.0.1", NUD_REACHABLE)
+    neighbor(wolnut.neighbors, "10.0.0.2", NUD_STALE)
+    passive = metrics.PROBES.value(source="passive")
+
+    wolnut.step()
+
+    # Only the desktop's stale entry needs a ping
+    assert probed_hosts(backends) == ["10.0.0.2"]
+    assert wolnut.state_tracker.is_online("nas")
+    assert metrics.PROBES.value(source="passive") == passive + 1
+
+
+def test_neighbor_change_probes_booting_client(config, backends, clock):
+    config.probe.wol_backoff_sec = 5
+    config.clients[0].boot_time_sec = 40
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    wolnut.neighbors = NeighborTable(clock=clock)
+    start_restoration(wolnut, backends, clock)
+    wolnut.step()
+    woken_at = clock.now
+
+    # The nas answers ARP while its probes are backed off
+    clock.now = woken_at + 2
+    neighbor(wolnut.neighbors, "10.0.0.1", NUD_REACHABLE)
+    wolnut.step()
+
+    assert wolnut.state_tracker.is_online("nas")
+    assert probed_hosts(backends) == ["10.0.0.2"]
+
+
+def reloaded(config, *clients):
+    return WolnutConfig(
+        nut=[NutConfig(ups=nut.ups, name=nut.name) for nut in config.nut],
+        status_file=config.status_file,
+        poll_interval=config.poll_interval,
+        wake_on=config.wake_on,
+        clients=list(clients),
+    )
+
+
+def test_reload_keeps_restoration_state(config, backends, clock, caplog):
+    caplog.set_level("INFO", logger="wolnut")
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    start_restoration(wolnut, backends, clock)
+    wolnut.step()
+    nas = wolnut.config.clients[0]
+    tracker = wolnut.state_tracker
+
+    # The desktop is dropped and a printer is added mid-restoration
+    printer = ClientConfig(name="printer", host="10.0.0.3", mac="DE:AD:BE:EF:00:03")
+    new_config = reloaded(
+        config,
+        ClientConfig(name="nas", host="10.0.0.1", mac="DE:AD:BE:EF:00:01"),
+        printer,
+    )
+    wolnut.apply_config(new_config)
+
+    unit = wolnut.units[0]
+    assert wolnut.config.clients[0] is nas
+    assert unit.restoration_event and unit.wol_being_sent
+    assert unit.recorded_down_clients == {"nas"}
+    assert tracker.has_been_wol_sent("nas")
+    assert not tracker.was_online_before_shutdown("printer")
+    assert "Added: printer. Removed: desktop. Changed: none." in caplog.text
+
+    # The restoration finishes with the new client list
+    clock.now += 10
+    set_online(backends, **{"10.0.0.1": True, "10.0.0.3": False})
+    wolnut.step()
+    assert not unit.restoration_event
+
+
+def test_reload_keeps_restart_only_options(config, backends, clock, caplog):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    new_config = reloaded(config, *config.clients)
+    new_config.status_file = "/elsewhere/state.json"
+
+    wolnut.apply_config(new_config)
+
+    assert wolnut.config.status_file == config.status_file
+    assert "Changing status_file requires a restart" in caplog.text
+
+
+def test_request_reload_applies_on_next_step(config, backends, clock, mocker):
+    new_config = reloaded(config, config.clients[0])
+    load = mocker.patch("wolnut.daemon.load_config", return_value=new_config)
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+
+    wolnut.request_reload("config.yaml")
+    wolnut._reload_thread.join(timeout=2)
+    assert load.call_args.kwargs["known_macs"] == {
+        "10.0.0.1": "DE:AD:BE:EF:00:01",
+        "10.0.0.2": "DE:AD:BE:EF:00:02",
+    }
+    assert wolnut.config is config
+
+    wolnut.step()
+    assert wolnut.config is new_config
+    assert wolnut.units[0].client_names == ["nas"]
+
+
+def test_refreshed_macs_apply_on_next_step(config, backends, clock):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    set_ups(backends, "OL", 100)
+    config.mac_updates.put(("nas", "DE:AD:BE:EF:00:0A"))
+    config.mac_updates.put(("removed", "DE:AD:BE:EF:00:0B"))
+    assert config.clients[0].mac == "DE:AD:BE:EF:00:01"
+
+    wolnut.step()
+    assert config.clients[0].mac == "DE:AD:BE:EF:00:0A"
+    assert config.clients[0].magic_packet == build_magic_packet("DE:AD:BE:EF:00:0A")
+    assert config.mac_updates.empty()
+
+
+def test_refreshed_macs_apply_before_reload(config, backends, clock, mocker):
+    new_config = reloaded(config, *config.clients)
+    mocker.patch("wolnut.daemon.load_config", return_value=new_config)
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    set_ups(backends, "OL", 100)
+    nas = config.clients[0]
+
+    wolnut.request_reload("config.yaml")
+    wolnut._reload_thread.join(timeout=2)
+    config.mac_updates.put(("nas", "DE:AD:BE:EF:00:0A"))
+    wolnut.step()
+
+    assert wolnut.config is new_config
+    assert wolnut.config.clients[0].mac == "DE:AD:BE:EF:00:0A"
+    assert nas.mac == "DE:AD:BE:EF:00:0A"
+
+
+def test_countdown_logs_share_a_key(config, backends, clock, caplog):
+    caplog.set_level("INFO", logger="wolnut")
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    set_ups(backends, "OB DISCHRG", 80)
+    wolnut.step()
+    set_ups(backends, "OL CHRG", 80)
+    wolnut.step()
+    clock.now += 2
+    wolnut.step()
+
+    countdown = [r for r in caplog.records if "before waking" in r.getMessage()]
+    assert [r.log_key for r in countdown] == ["restore_delay:ups"] * 2
+    assert countdown[0].phase == "restoring"
+
+
+def control_request(wolnut, command, **args):
+    request = ControlRequest(command, args)
+    wolnut.control_server.requests.put(request)
+    assert wolnut.handle_control_requests()
+    return request.response
+
+
+@pytest.fixture
+def controlled(config, backends, clock):
+    wolnut = daemon.WolnutDaemon(config, clock=clock)
+    wolnut.control_server = ControlServer("unused")
+    return wolnut
+
+
+def test_control_status(controlled, backends, clock):
+    set_ups(backends, "OB DISCHRG", 80)
+    controlled.step()
+
+    response = control_request(controlled, "status")
+
+    assert response["ok"]
+    assert response["result"]["ups"] == [
+        {
+            "name": "ups",
+            "phase": "on_battery",
+            "status": "OB DISCHRG",
+            "battery_percent": 80,
+            "load_percent": None,
+            "waiting_for": [],
+        }
+    ]
+    assert response["result"]["clients"][0] == {
+        "name": "nas",
+        "host": "10.0.0.1",
+        "mac": "DE:AD:BE:EF:00:01",
+        "ups": ["ups"],
+        "was_online_before_battery": True,
+        "is_online": True,
+        "is_ready": True,
+        "wol_sent": False,
+        "wol_sent_at": 0,
+        "wol_attempts": 0,
+        "wol_retry_at": 0,
+        "skip": False,
+    }
+
+
+def test_control_wake(controlled, backends, clock):
+    response = control_request(controlled, "wake", targets=["ups"])
+
+    assert response == {
+        "ok": True,
+        "result": {"sent": ["nas", "desktop"], "failed": []},
+    }
+    assert set(backends[2].call_args.args[0]) == {
+        "nas",
+        "desktop",
+    }
+    # A manual wake is not a retry attempt, so nothing is scheduled after it
+    assert not controlled.state_tracker.has_been_wol_sent("desktop")
+    assert controlled.state_tracker.wol_attempts("desktop") == 0
+    assert daemon.WOL_RETRY_PREFIX + "desktop" not in controlled.scheduler
+
+
+def test_control_wake_reports_failed_sends(controlled, backends):
+    backends[2].side_effect = lambda packets, **kwargs: {
+        name: name == "nas" for name in packets
+    }
+
+    response = control_request(controlled, "wake", targets=["all"])
+
+    assert response == {"ok": True, "result": {"sent": ["nas"], "failed": ["desktop"]}}
+
+
+def test_control_rejects_unknown_targets(controlled, backends):
+    response = control_request(controlled, "wake", targets=["printer"])
+
+    assert response == {"ok": False, "error": "Unknown client or UPS: printer"}
+    backends[2].assert_not_called()
+
+
+def test_control_probe(controlled, backends):
+    set_online(backends, **{"10.0.0.2": False})
+
+    response = control_request(controlled, "probe", targets=["desktop"])
+
+    assert response == {"ok": True, "result": {"desktop": False}}
+    assert backends[1].call_args.args[0] == ["10.0.0.2"]
+
+
+def test_control_reset(controlled, backends, clock):
+    unit = controlled.units[0]
+    start_restoration(controlled, backends, clock)
+    assert unit.restoration_event
+
+    response = control_request(controlled, "reset")
+
+    assert response == {"ok": True, "result": ["ups"]}
+    assert not unit.restoration_event
+    assert not controlled.state_tracker.was_ups_on_battery("ups")
+    assert unit.key(daemon.RESTORE_DELAY) not in controlled.scheduler
@@ -0,0 +1,77 @@
+import grp
+import os
+import stat
+import threading
+
+import pytest
+
+from wolnut import events
+
+
+@pytest.mark.parametrize(
+    "message, expected",
+    [
+        ("ONBATT", events.PowerEvent("ONBATT")),
+        ("onbatt ups@localhost", events.PowerEvent("ONBATT", "ups@localhost")),
+        ("LOWBATT ups", events.PowerEvent("LOWBATT", "ups")),
+        ("COMMOK ups", None),
+        ("", None),
+    ],
+)
+def test_parse_event(message, expected):
+    assert events.parse_event(message) == expected
+
+
+def test_send_event_rejects_unknown_type(tmp_path):
+    with pytest.raises(ValueError, match="Unsupported event type"):
+        events.send_event(str(tmp_path / "events.sock"), "COMMBAD")
+
+
+def test_send_event_without_listener(tmp_path):
+    with pytest.raises(OSError):
+        events.send_event(str(tmp_path / "events.sock"), "ONBATT")
+
+
+def test_listener_receives_events(tmp_path):
+    socket_path = str(tmp_path / "run" / "events.sock")
+    received = threading.Event()
+    listener = events.PowerEventListener(socket_path, on_event=received.set)
+    listener.start()
+    try:
+        events.send_event(socket_path, "ONBATT", "ups")
+        assert received.wait(timeout=2)
+        assert listener.drain() == [events.PowerEvent("ONBATT", "ups")]
+        assert listener.drain() == []
+    finally:
+        listener.stop()
+
+    assert not (tmp_path / "run" / "events.sock").exists()
+
+
+def test_listener_replaces_stale_socket(tmp_path):
+    socket_path = tmp_path / "events.sock"
+    socket_path.write_text("left over from a crash")
+    listener = events.PowerEventListener(str(socket_path))
+    listener.start()
+    listener.stop()
+
+
+def test_listener_socket_permissions(tmp_path):
+    """Tests that the socket is writable by its group, which can be chosen."""
+    group = grp.getgrgid(os.getgid()).gr_name
+    listener = events.PowerEventListener(str(tmp_path / "events.sock"), group=group)
+    listener.start()
+    try:
+        info = os.stat(tmp_path / "events.sock")
+        assert stat.S_IMODE(info.st_mode) == 0o660
+        assert info.st_gid == os.getgid()
+    finally:
+        listener.stop()
+
+
+def test_listener_unknown_group(tmp_path):
+    listener = events.PowerEventListener(
+        str(tmp_path / "events.sock"), group="no-such-group-wolnut"
+    )
+    with pytest.raises(OSError, match="Unknown group"):
+        listener.start()
@@ -0,0 +1,128 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from wolnut import icmp
+
+
+def test_checksum():
+    # Example from RFC 1071 section 3.
+    data = bytes([0x00, 0x01, 0xF2, 0x03, 0xF4, 0xF5, 0xF6, 0xF7])
+    assert icmp.checksum(data) == ~0xDDF2 & 0xFFFF
+
+
+def test_build_echo_request_checksums_to_zero():
+    packet = icmp.build_echo_request(0x1234, 7)
+    assert packet[0] == icmp.ICMP_ECHO_REQUEST
+    assert icmp.checksum(packet) == 0
+    assert struct.unpack_from("!HH", packet, 4) == (0x1234, 7)
+
+
+def test_parse_echo_reply():
+    reply = bytearray(icmp.build_echo_request(0x1234, 7))
+    reply[0] = icmp.ICMP_ECHO_REPLY
+    ip_header = bytes([0x45]) + bytes(19)
+
+    assert icmp.parse_echo_reply(bytes(reply), raw=False) == (0x1234, 7)
+    assert icmp.parse_echo_reply(ip_header + bytes(reply), raw=True) == (0x1234, 7)
+    assert icmp.parse_echo_reply(icmp.build_echo_request(1, 1), raw=False) is None
+    assert icmp.parse_echo_reply(b"\x00", raw=False) is None
+
+
+@pytest.fixture
+def pinger():
+    try:
+        pinger = icmp.IcmpPinger()
+    except OSError:
+        pytest.skip("ICMP sockets are not permitted here")
+    yield pinger
+    pinger.close()
+
+
+def test_ping_many_loopback(pinger):
+    rtts = pinger.ping_many(["127.0.0.1", "127.0.0.2"], timeout=1)
+    assert set(rtts) == {"127.0.0.1", "127.0.0.2"}
+    assert all(rtt is not None and rtt < 1 for rtt in rtts.values())
+
+
+def test_ping_many_unresolvable(pinger, mocker):
+    mocker.patch("wolnut.icmp.socket.gethostbyname", side_effect=socket.gaierror)
+    assert pinger.ping_many(["no-such-host.invalid"], timeout=0.1) == {
+        "no-such-host.invalid": None
+    }
+
+
+def test_ping_many_resolves_within_the_deadline(pinger, mocker):
+    """Tests that a hung DNS lookup can't stretch the sweep past its deadline."""
+    lookup_done = threading.Event()
+
+    def slow_lookup(host):
+        lookup_done.wait(5)
+        return "127.0.0.1"
+
+    mocker.patch("wolnut.icmp.socket.gethostbyname", side_effect=slow_lookup)
+    started = time.monotonic()
+    rtts = pinger.ping_many(["127.0.0.1", "nas.lan"], timeout=0.3)
+    lookup_done.set()
+
+    assert time.monotonic() - started < 1
+    assert rtts["127.0.0.1"] is not None
+    assert rtts["nas.lan"] is None
+
+
+def test_ping_many_caches_addresses(pinger, mocker):
+    lookup = mocker.patch("wolnut.icmp.socket.gethostbyname", return_value="127.0.0.1")
+    assert pinger.ping_many(["nas.lan"], timeout=1)["nas.lan"] is not None
+    assert pinger.ping_many(["nas.lan"], timeout=1)["nas.lan"] is not None
+    lookup.assert_called_once_with("nas.lan")
+
+    # A host that stops answering is looked up again, and keeps its last
+    # known address if that fails
+    mocker.patch("wolnut.icmp.select.select", return_value=([], [], []))
+    assert pinger.ping_many(["nas.lan"], timeout=0.1)["nas.lan"] is None
+    mocker.stopall()
+    lookup = mocker.patch(
+        "wolnut.icmp.socket.gethostbyname", side_effect=socket.gaierror("down")
+    )
+    assert pinger.ping_many(["nas.lan"], timeout=1)["nas.lan"] is not None
+    lookup.assert_called_once_with("nas.lan")
+
+
+def test_ping_many_timeout(pinger, mocker):
+    mocker.patch("wolnut.icmp.select.select", return_value=([], [], []))
+    rtts = pinger.ping_many(["127.0.0.1"], timeout=0.2)
+    assert rtts == {"127.0.0.1": None}
+
+
+def test_ping_many_from_several_threads(pinger, mocker):
+    """Tests that concurrent sweeps take turns instead of taking each other's replies."""
+    active, overlaps = [], []
+    sweep = pinger._ping_many
+
+    def tracked_sweep(hosts, timeout):
+        active.append(hosts)
+        overlaps.append(len(active))
+        time.sleep(0.05)
+        try:
+            return sweep(hosts, timeout)
+        finally:
+            active.remove(hosts)
+
+    mocker.patch.object(pinger, "_ping_many", side_effect=tracked_sweep)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda host=host: results.append(pinger.ping_many([host], 1))
+        )
+        for host in ("127.0.0.1", "127.0.0.2")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlaps == [1, 1]
+    assert all(rtt is not None for rtts in results for rtt in rtts.values())
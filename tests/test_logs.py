@@ -0,0 +1,71 @@
+import json
+import logging
+import sys
+
+from wolnut.logs import JsonFormatter, RateLimitFilter
+
+
+def make_record(msg, *args, created=1000.0, level=logging.INFO, **extra):
+    record = logging.LogRecord("wolnut", level, __file__, 1, msg, args, None)
+    record.created = created
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter():
+    record = make_record(
+        "%s is online.", "nas", client="nas", ups="ups", phase="restoring"
+    )
+
+    line = json.loads(JsonFormatter().format(record))
+
+    assert line == {
+        "time": "1970-01-01T00:16:40.000+00:00",
+        "level": "INFO",
+        "message": "nas is online.",
+        "client": "nas",
+        "ups": "ups",
+        "phase": "restoring",
+    }
+
+
+def test_json_formatter_exception():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord(
+            "wolnut", logging.ERROR, __file__, 1, "failed", None, sys.exc_info()
+        )
+
+    line = json.loads(JsonFormatter().format(record))
+
+    assert "ValueError: boom" in line["exception"]
+
+
+def test_rate_limit_drops_repeats():
+    rate_limit = RateLimitFilter(interval=60)
+
+    assert rate_limit.filter(make_record("Polling %s", "ups", created=0))
+    assert not rate_limit.filter(make_record("Polling %s", "ups", created=2))
+    assert not rate_limit.filter(make_record("Polling %s", "ups", created=4))
+    assert rate_limit.filter(make_record("Polling %s", "other", created=4))
+
+    record = make_record("Polling %s", "ups", created=60)
+    assert rate_limit.filter(record)
+    assert record.getMessage() == "Polling ups (2 similar messages suppressed)"
+    assert record.suppressed == 2
+
+
+def test_rate_limit_by_key():
+    rate_limit = RateLimitFilter(interval=60)
+
+    assert rate_limit.filter(make_record("Waiting %s seconds", 30, log_key="delay"))
+    assert not rate_limit.filter(
+        make_record("Waiting %s seconds", 28, created=1002, log_key="delay")
+    )
+
+
+def test_rate_limit_passes_broken_messages():
+    rate_limit = RateLimitFilter(interval=60)
+
+    assert rate_limit.filter(make_record("%s and %s", "one"))
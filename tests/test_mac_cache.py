@@ -0,0 +1,59 @@
+from wolnut import mac_cache
+
+
+def test_mac_cache_path():
+    assert str(mac_cache.mac_cache_path("/config/wolnut_state.json")) == (
+        "/config/wolnut_state.macs.json"
+    )
+
+
+def test_update_and_persist(tmp_path):
+    path = tmp_path / "state.macs.json"
+    cache = mac_cache.MacCache(path)
+
+    assert cache.update({"nas": "de:ad:be:ef:00:01", "ghost": None})
+    assert not cache.update({"nas": "de:ad:be:ef:00:01"})
+    cache.save()
+
+    reloaded = mac_cache.MacCache(path)
+    assert reloaded.get("nas") == "de:ad:be:ef:00:01"
+    assert reloaded.get("ghost") is None
+
+
+def test_is_stale(tmp_path, mocker):
+    mock_time = mocker.patch("wolnut.mac_cache.time.time", return_value=1000)
+    cache = mac_cache.MacCache(tmp_path / "macs.json", ttl=60)
+    cache.update({"nas": "de:ad:be:ef:00:01"})
+
+    assert cache.is_stale("unknown")
+    assert not cache.is_stale("nas")
+    mock_time.return_value = 1060
+    assert cache.is_stale("nas")
+
+
+def test_corrupted_cache(tmp_path, caplog):
+    path = tmp_path / "macs.json"
+    path.write_text("not json")
+
+    cache = mac_cache.MacCache(path)
+
+    assert cache.get("nas") is None
+    assert "Failed to load MAC cache" in caplog.text
+
+
+def test_refresh_in_background(tmp_path):
+    path = tmp_path / "macs.json"
+    cache = mac_cache.MacCache(path)
+    cache.update({"nas": "de:ad:be:ef:00:01", "desktop": "de:ad:be:ef:00:02"})
+    changes = []
+
+    thread = cache.refresh_in_background(
+        ["nas", "desktop"],
+        lambda hosts: {"nas": "de:ad:be:ef:00:03", "desktop": None},
+        lambda host, mac: changes.append((host, mac)),
+    )
+    thread.join(timeout=2)
+
+    assert changes == [("nas", "de:ad:be:ef:00:03")]
+    assert cache.get("desktop") == "de:ad:be:ef:00:02"
+    assert mac_cache.MacCache(path).get("nas") == "de:ad:be:ef:00:03"
@@ -0,0 +1,83 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from wolnut import metrics
+
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+
+def test_counter(registry):
+    counter = metrics.Counter("test_total", "A counter.", registry=registry)
+    counter.inc(result="sent")
+    counter.inc(2, result="sent")
+    counter.inc(result="failed")
+
+    assert counter.value(result="sent") == 3
+    assert registry.render() == (
+        "# HELP test_total A counter.\n"
+        "# TYPE test_total counter\n"
+        'test_total{result="sent"} 3\n'
+        'test_total{result="failed"} 1\n'
+    )
+
+
+def test_gauge(registry):
+    gauge = metrics.Gauge("test_gauge", "A gauge.", registry=registry)
+    gauge.set(42.5, ups='a"b')
+    gauge.set(7)
+
+    assert gauge.value(ups='a"b') == 42.5
+    rendered = registry.render()
+    assert 'test_gauge{ups="a\\"b"} 42.5\n' in rendered
+    assert "test_gauge 7\n" in rendered
+
+
+def test_histogram(registry):
+    histogram = metrics.Histogram(
+        "test_seconds", "A histogram.", buckets=(0.1, 1), registry=registry
+    )
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(3)
+
+    assert histogram.count() == 4
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{le="1"} 3' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 4' in lines
+    assert "test_seconds_sum 3.65" in lines
+    assert "test_seconds_count 4" in lines
+
+
+def test_histogram_time(registry, mocker):
+    mocker.patch("wolnut.metrics.time.perf_counter", side_effect=[10.0, 10.25])
+    histogram = metrics.Histogram("test_seconds", "A histogram.", registry=registry)
+
+    with histogram.time(ups="ups"):
+        pass
+
+    assert histogram.count(ups="ups") == 1
+    assert 'test_seconds_sum{ups="ups"} 0.25' in registry.render()
+
+
+def test_metrics_server(registry):
+    metrics.Counter("test_total", "A counter.", registry=registry).inc()
+    server = metrics.start_metrics_server("127.0.0.1", 0, registry=registry)
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        with urllib.request.urlopen(f"{base}/metrics") as response:
+            assert response.headers["Content-Type"] == metrics.CONTENT_TYPE
+            assert b"test_total 1" in response.read()
+
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(f"{base}/other")
+        assert e.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,99 @@
+import subprocess
+import threading
+import time
+
+from wolnut import monitor
+
+
+def test_is_client_online(mocker):
+    mocker.patch("wolnut.monitor.platform.system", return_value="Linux")
+    mock_run = mocker.patch("wolnut.monitor.subprocess.run")
+    mock_run.return_value.returncode = 0
+
+    assert monitor.is_client_online("10.0.0.1", timeout=1.5)
+    mock_run.assert_called_once_with(
+        ["ping", "-c", "1", "-W", "2", "10.0.0.1"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        timeout=2.5,
+        check=False,
+    )
+
+
+def test_is_client_online_timeout(mocker):
+    mocker.patch(
+        "wolnut.monitor.subprocess.run",
+        side_effect=subprocess.TimeoutExpired("ping", 2),
+    )
+    assert not monitor.is_client_online("10.0.0.1")
+
+
+def test_probe_rtts_ping_runs_in_parallel(mocker):
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def fake_probe(host, timeout):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.05)
+        with lock:
+            in_flight -= 1
+        return host.endswith("1")
+
+    mocker.patch("wolnut.monitor.is_client_online", side_effect=fake_probe)
+    hosts = [f"10.0.0.{i}" for i in range(1, 9)]
+
+    rtts = monitor.probe_rtts(hosts, max_concurrency=4, timeout=1, method="ping")
+
+    assert {host: rtt is not None for host, rtt in rtts.items()} == {
+        host: host.endswith("1") for host in hosts
+    }
+    assert peak == 4
+
+
+def test_probe_rtts_dedupes_hosts(mocker):
+    mock_probe = mocker.patch("wolnut.monitor.is_client_online", return_value=True)
+
+    rtts = monitor.probe_rtts(["a", "b", "a"], timeout=0.5, method="ping")
+
+    assert list(rtts) == ["a", "b"]
+    assert mock_probe.call_count == 2
+    mock_probe.assert_any_call("a", 0.5)
+
+
+def test_probe_rtts_empty():
+    assert monitor.probe_rtts([]) == {}
+
+
+def test_probe_rtts_uses_icmp_engine(mocker):
+    pinger = mocker.Mock()
+    pinger.ping_many.return_value = {"a": 0.002, "b": None}
+    mocker.patch("wolnut.monitor._get_icmp_pinger", return_value=pinger)
+    mock_probe = mocker.patch("wolnut.monitor.is_client_online")
+
+    assert monitor.probe_rtts(["a", "b"], timeout=0.5) == {"a": 0.002, "b": None}
+    pinger.ping_many.assert_called_with(["a", "b"], 0.5)
+    mock_probe.assert_not_called()
+
+
+def test_probe_rtts_falls_back_to_ping(mocker):
+    mocker.patch("wolnut.monitor._get_icmp_pinger", return_value=None)
+    mocker.patch("wolnut.monitor.is_client_online", side_effect=[True, False])
+
+    rtts = monitor.probe_rtts(["a", "b"], method="auto")
+
+    assert rtts["a"] is not None
+    assert rtts["b"] is None
+
+
+def test_get_icmp_pinger_unavailable(mocker, caplog):
+    mocker.patch("wolnut.monitor._icmp_pinger", None)
+    mocker.patch("wolnut.monitor._icmp_unavailable", False)
+    mocker.patch("wolnut.monitor.IcmpPinger", side_effect=PermissionError("nope"))
+
+    assert monitor._get_icmp_pinger() is None
+    assert monitor._get_icmp_pinger() is None
+    assert caplog.text.count("ICMP sockets are not permitted") == 1
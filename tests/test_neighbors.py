@@ -0,0 +1,117 @@
+import socket
+import struct
+
+import pytest
+
+from wolnut import neighbors, netlink
+from wolnut.clock import VirtualClock
+from wolnut.neighbors import (
+    NUD_FAILED,
+    NUD_REACHABLE,
+    NUD_STALE,
+    RTM_DELNEIGH,
+    RTM_NEWNEIGH,
+    Neighbor,
+    NeighborTable,
+)
+
+
+def rtattr(attr_type, value):
+    attr = struct.pack("=HH", 4 + len(value), attr_type) + value
+    return attr + b"\0" * (-len(attr) % 4)
+
+
+def neigh_message(msg_type, ip, state, mac=None, family=socket.AF_INET):
+    body = struct.pack("=BxxxiHBB", family, 2, state, 0, 1)
+    address_family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+    body += rtattr(neighbors.NDA_DST, socket.inet_pton(address_family, ip))
+    if mac is not None:
+        body += rtattr(neighbors.NDA_LLADDR, bytes.fromhex(mac.replace(":", "")))
+    return struct.pack("=IHHII", 16 + len(body), msg_type, 0, 0, 0) + body
+
+
+def test_parse_messages():
+    data = (
+        neigh_message(RTM_NEWNEIGH, "10.0.0.1", NUD_REACHABLE, "DE:AD:BE:EF:00:01")
+        + neigh_message(RTM_NEWNEIGH, "fe80::1", NUD_STALE, family=socket.AF_INET6)
+        + neigh_message(RTM_DELNEIGH, "10.0.0.2", NUD_FAILED)
+        + neigh_message(RTM_NEWNEIGH, "10.0.0.3", NUD_REACHABLE, family=7)  # Bridge
+        + struct.pack("=IHHII", 20, netlink.NLMSG_DONE, 0, 0, 0)
+        + b"\0" * 4
+    )
+
+    assert list(neighbors.parse_messages(data)) == [
+        (RTM_NEWNEIGH, Neighbor("10.0.0.1", NUD_REACHABLE, "de:ad:be:ef:00:01")),
+        (RTM_NEWNEIGH, Neighbor("fe80::1", NUD_STALE)),
+        (RTM_DELNEIGH, Neighbor("10.0.0.2", NUD_FAILED)),
+        (netlink.NLMSG_DONE, None),
+    ]
+
+
+def test_parse_messages_ignores_truncated_data():
+    data = neigh_message(RTM_NEWNEIGH, "10.0.0.1", NUD_REACHABLE)
+    assert list(neighbors.parse_messages(data[:-3])) == []
+
+
+def test_dump_request():
+    request = neighbors.dump_request(seq=7)
+    length, msg_type, flags, seq, _ = struct.unpack_from("=IHHII", request)
+    assert (length, msg_type, seq) == (len(request), neighbors.RTM_GETNEIGH, 7)
+    assert flags & netlink.NLM_F_DUMP
+
+
+def update(table, msg_type, ip, state, mac=None):
+    return table.apply([(msg_type, Neighbor(ip, state, mac))])
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock(1000.0)
+
+
+def test_liveness(clock):
+    table = NeighborTable(failed_ttl=30, clock=clock)
+    update(table, RTM_NEWNEIGH, "10.0.0.1", NUD_REACHABLE, "de:ad:be:ef:00:01")
+    update(table, RTM_NEWNEIGH, "10.0.0.2", NUD_STALE, "de:ad:be:ef:00:02")
+    update(table, RTM_NEWNEIGH, "10.0.0.3", NUD_FAILED)
+
+    assert table.liveness("10.0.0.1") is True
+    # Hostnames are matched by MAC address
+    assert table.liveness("nas.lan", "DE-AD-BE-EF-00-01") is True
+    assert table.liveness("10.0.0.2") is None
+    assert table.liveness("10.0.0.3") is False
+    assert table.liveness("10.0.0.4", "DE:AD:BE:EF:00:04") is None
+
+    # An old failure needs a probe to be believed
+    clock.now += 30
+    assert table.liveness("10.0.0.3") is None
+
+
+def test_failed_entry_keeps_its_mac(clock):
+    table = NeighborTable(clock=clock)
+    update(table, RTM_NEWNEIGH, "10.0.0.1", NUD_REACHABLE, "de:ad:be:ef:00:01")
+    update(table, RTM_NEWNEIGH, "10.0.0.1", NUD_FAILED)
+    assert table.liveness("nas.lan", "DE:AD:BE:EF:00:01") is False
+
+    update(table, RTM_DELNEIGH, "10.0.0.1", NUD_FAILED)
+    assert table.liveness("nas.lan", "DE:AD:BE:EF:00:01") is None
+
+
+def test_only_watched_changes_are_collected(clock):
+    table = NeighborTable(clock=clock)
+    table.watch([("10.0.0.1", "DE:AD:BE:EF:00:01")])
+
+    assert not update(table, RTM_NEWNEIGH, "10.0.0.9", NUD_REACHABLE)
+    assert update(table, RTM_NEWNEIGH, "10.0.0.1", NUD_STALE, "de:ad:be:ef:00:01")
+    # The same state again is not a change
+    assert not update(table, RTM_NEWNEIGH, "10.0.0.1", NUD_STALE, "de:ad:be:ef:00:01")
+
+    assert table.drain_changes() == {"10.0.0.1", "de:ad:be:ef:00:01"}
+    assert table.drain_changes() == set()
+
+
+def test_start_without_netlink(monkeypatch):
+    monkeypatch.delattr(neighbors.socket, "AF_NETLINK", raising=False)
+
+    with pytest.raises(OSError, match="only available on Linux"):
+        NeighborTable().start()
@@ -0,0 +1,49 @@
+import errno
+import struct
+
+import pytest
+
+from wolnut import netlink
+
+
+def message(msg_type, body=b""):
+    data = struct.pack("=IHHII", 16 + len(body), msg_type, 0, 0, 0) + body
+    return data + b"\0" * (-len(data) % 4)
+
+
+def test_iter_messages_and_attributes():
+    body = struct.pack("=HH", 7, 1) + b"abc\0" + struct.pack("=HH", 8, 2) + b"defg"
+    data = message(20, body) + message(netlink.NLMSG_DONE, b"\0" * 4)
+
+    messages = list(netlink.iter_messages(data))
+
+    assert [msg_type for msg_type, _ in messages] == [20, netlink.NLMSG_DONE]
+    assert netlink.parse_attributes(messages[0][1]) == {1: b"abc", 2: b"defg"}
+    # A truncated message ends the datagram
+    assert list(netlink.iter_messages(data[:-6])) == [(20, body)]
+
+
+def test_dump(mocker):
+    sock = mocker.patch("wolnut.netlink.open_socket").return_value.__enter__()
+    sock.recv.side_effect = [
+        message(20, b"one") + message(20, b"two"),
+        message(netlink.NLMSG_DONE, b"\0" * 4),
+    ]
+
+    assert netlink.dump(22, b"") == [(20, b"one"), (20, b"two")]
+    request = sock.sendto.call_args.args[0]
+    assert struct.unpack_from("=IHH", request) == (
+        16,
+        22,
+        netlink.NLM_F_REQUEST | netlink.NLM_F_DUMP,
+    )
+
+
+def test_dump_error(mocker):
+    sock = mocker.patch("wolnut.netlink.open_socket").return_value.__enter__()
+    sock.recv.return_value = message(
+        netlink.NLMSG_ERROR, struct.pack("=i", -errno.EPERM) + b"\0" * 16
+    )
+
+    with pytest.raises(PermissionError):
+        netlink.dump(22, b"")
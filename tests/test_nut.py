@@ -0,0 +1,174 @@
+import socket
+import threading
+
+import pytest
+
+from wolnut import nut
+from wolnut.monitor import get_ups_status
+
+
+class FakeUpsd:
+    """A tiny upsd stand-in that speaks enough of the NUT protocol for tests."""
+
+    def __init__(self, variables, users=None):
+        self.variables = variables
+        self.users = users or {}
+        self.commands = []
+        self.connections = 0
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        username = password = None
+        with conn, conn.makefile("r") as reader:
+            for line in reader:
+                line = line.strip()
+                self.commands.append(line)
+                parts = line.split()
+                if parts[0] == "USERNAME":
+                    username = parts[1]
+                    reply = "OK"
+                elif parts[0] == "PASSWORD":
+                    password = parts[1]
+                    reply = "OK"
+                elif parts[0] == "LOGIN":
+                    ok = self.users.get(username) == password
+                    reply = "OK" if ok else "ERR ACCESS-DENIED"
+                elif parts[0] == "LOGOUT":
+                    conn.sendall(b"OK Goodbye\n")
+                    return
+                elif parts[:2] == ["GET", "VAR"]:
+                    ups, var = parts[2], parts[3]
+                    if ups not in self.variables:
+                        reply = "ERR UNKNOWN-UPS"
+                    elif var not in self.variables[ups]:
+                        reply = "ERR VAR-NOT-SUPPORTED"
+                    else:
+                        reply = f'VAR {ups} {var} "{self.variables[ups][var]}"'
+                elif parts[:2] == ["LIST", "VAR"]:
+                    ups = parts[2]
+                    lines = [f"BEGIN LIST VAR {ups}"]
+                    for var, value in self.variables[ups].items():
+                        lines.append(f'VAR {ups} {var} "{value}"')
+                    lines.append(f"END LIST VAR {ups}")
+                    reply = "\n".join(lines)
+                else:
+                    reply = "ERR UNKNOWN-COMMAND"
+                conn.sendall(reply.encode() + b"\n")
+
+    def close(self):
+        self._server.close()
+
+
+@pytest.fixture
+def upsd():
+    server = FakeUpsd(
+        {"ups": {"ups.status": "OB DISCHRG", "battery.charge": "87", "ups.load": "12"}},
+        users={"monuser": "secret"},
+    )
+    yield server
+    server.close()
+
+
+@pytest.mark.parametrize(
+    "ups, hostname, port, expected",
+    [
+        ("ups", None, None, ("ups", "localhost", 3493)),
+        ("ups@nut-server", None, None, ("ups", "nut-server", 3493)),
+        ("ups@nut-server:1234", None, None, ("ups", "nut-server", 1234)),
+        ("ups@nut-server:1234", "other", 4321, ("ups", "other", 4321)),
+        ("ups", "10.0.0.2", None, ("ups", "10.0.0.2", 3493)),
+    ],
+)
+def test_parse_ups_name(ups, hostname, port, expected):
+    assert nut.parse_ups_name(ups, hostname, port) == expected
+
+
+def test_get_vars_fetches_only_requested(upsd):
+    with nut.NutClient("127.0.0.1", upsd.port) as client:
+        status = client.get_vars("ups")
+
+    assert status == {"ups.status": "OB DISCHRG", "battery.charge": "87"}
+    assert "LIST VAR ups" not in upsd.commands
+
+
+def test_get_vars_skips_unsupported(upsd):
+    with nut.NutClient("127.0.0.1", upsd.port) as client:
+        status = client.get_vars("ups", ["ups.status", "input.voltage"])
+
+    assert status == {"ups.status": "OB DISCHRG"}
+
+
+def test_list_vars(upsd):
+    with nut.NutClient("127.0.0.1", upsd.port) as client:
+        variables = client.list_vars("ups")
+
+    assert variables["ups.load"] == "12"
+    assert len(variables) == 3
+
+
+def test_connection_is_reused(upsd):
+    with nut.NutClient("127.0.0.1", upsd.port) as client:
+        for _ in range(5):
+            client.get_vars("ups")
+
+    assert upsd.connections == 1
+
+
+def test_reconnects_after_drop(upsd):
+    client = nut.NutClient("127.0.0.1", upsd.port)
+    client.get_var("ups", "ups.status")
+    # Simulate upsd dropping us behind our back.
+    client._sock.shutdown(socket.SHUT_RDWR)
+
+    assert client.get_var("ups", "battery.charge") == "87"
+    assert upsd.connections == 2
+    client.close()
+
+
+def test_login(upsd):
+    client = nut.NutClient(
+        "127.0.0.1", upsd.port, username="monuser", password="secret", login_ups="ups"
+    )
+    client.connect()
+    client.close()
+
+    assert upsd.commands[:3] == ["USERNAME monuser", "PASSWORD secret", "LOGIN ups"]
+
+
+def test_login_denied(upsd):
+    client = nut.NutClient(
+        "127.0.0.1", upsd.port, username="monuser", password="wrong", login_ups="ups"
+    )
+    with pytest.raises(nut.NutError, match="ACCESS-DENIED"):
+        client.connect()
+    assert not client.connected
+
+
+def test_get_ups_status(upsd):
+    client = nut.NutClient("127.0.0.1", upsd.port)
+    assert get_ups_status(client, "ups")["battery.charge"] == "87"
+    client.close()
+
+
+def test_get_ups_status_unknown_ups(upsd):
+    client = nut.NutClient("127.0.0.1", upsd.port)
+    assert get_ups_status(client, "missing") == {}
+    client.close()
+
+
+def test_get_ups_status_connection_refused(caplog):
+    client = nut.NutClient("127.0.0.1", 1, timeout=0.5)
+    assert get_ups_status(client, "ups") == {}
+    assert "Failed to get UPS status" in caplog.text
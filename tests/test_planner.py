@@ -0,0 +1,61 @@
+import pytest
+
+from wolnut import planner
+from wolnut.config import ClientConfig
+
+
+def client(name, *depends_on):
+    return ClientConfig(
+        name=name, host=name, mac="DE:AD:BE:EF:00:01", depends_on=list(depends_on)
+    )
+
+
+def test_find_cycle():
+    assert planner.find_cycle({"a": ["b"], "b": ["c"], "c": []}) is None
+    assert planner.find_cycle({"a": ["b"], "b": ["c"], "c": ["a"]}) == [
+        "a",
+        "b",
+        "c",
+        "a",
+    ]
+    assert planner.find_cycle({"a": ["a"]}) == ["a", "a"]
+    assert planner.find_cycle({"x": ["a"], "a": ["b"], "b": ["a"]}) == ["a", "b", "a"]
+
+
+def test_topological_order_keeps_config_order():
+    dependencies = {"vm-host": ["nas"], "desktop": [], "nas": [], "vm": ["vm-host"]}
+    assert planner.topological_order(dependencies) == [
+        "desktop",
+        "nas",
+        "vm-host",
+        "vm",
+    ]
+
+
+def test_topological_order_rejects_cycle():
+    with pytest.raises(ValueError, match="Dependency cycle: a -> b -> a"):
+        planner.topological_order({"a": ["b"], "b": ["a"]})
+
+
+def test_ready_waits_for_dependencies():
+    wake_planner = planner.WakePlanner(
+        [client("hypervisor", "nas", "switch"), client("nas"), client("switch")]
+    )
+    down = [client("hypervisor", "nas", "switch"), client("nas")]
+
+    ready = wake_planner.ready(down, is_satisfied=lambda name: name == "switch")
+    assert [c.name for c in ready] == ["nas"]
+
+    ready = wake_planner.ready(down, is_satisfied=lambda name: True)
+    assert [c.name for c in ready] == ["nas", "hypervisor"]
+
+
+def test_unknown_dependencies_are_ignored(caplog):
+    wake_planner = planner.WakePlanner([client("hypervisor", "nas")])
+
+    ready = wake_planner.ready(
+        [client("hypervisor", "nas")], is_satisfied=lambda name: False
+    )
+
+    assert [c.name for c in ready] == ["hypervisor"]
+    assert "hypervisor depends on unknown clients, ignoring: nas" in caplog.text
@@ -0,0 +1,59 @@
+from wolnut.probe_policy import ProbePolicy
+
+
+def test_idle_sweeps():
+    policy = ProbePolicy(idle_interval=60)
+    assert policy.idle_sweep_due(0)
+
+    policy.idle_swept(0)
+    assert not policy.idle_sweep_due(59)
+    assert policy.idle_sweep_due(60)
+    assert policy.next_probe_at(10) == 60
+
+
+def test_backoff_until_boot_time():
+    policy = ProbePolicy(idle_interval=60, backoff=2)
+    policy.idle_swept(0)
+    policy.wol_sent("nas", boot_time=20, at=100)
+
+    probes = []
+    for now in range(100, 130):
+        if policy.due("nas", now):
+            probes.append(now)
+            policy.probed({"nas": False}, now)
+
+    # Gaps double until the expected boot time, then every step
+    assert probes[:4] == [102, 106, 114, 120]
+    assert probes[4:] == list(range(121, 130))
+
+
+def test_retries_keep_the_backoff():
+    policy = ProbePolicy(backoff=2)
+    policy.wol_sent("nas", boot_time=60, at=100)
+    policy.wol_sent("nas", boot_time=60, at=130)
+
+    assert policy.next_probe_at(100) == 102
+
+
+def test_no_backoff_without_boot_time():
+    policy = ProbePolicy(backoff=2)
+    policy.wol_sent("nas", boot_time=0, at=100)
+
+    assert policy.due("nas", 100)
+
+
+def test_online_clients_stop_backing_off():
+    policy = ProbePolicy(backoff=2)
+    policy.wol_sent("nas", boot_time=60, at=100)
+    policy.probed({"nas": True}, 102)
+
+    assert policy.due("nas", 103)
+
+
+def test_forget():
+    policy = ProbePolicy(backoff=2)
+    policy.wol_sent("nas", boot_time=60, at=100)
+    policy.forget(["nas"])
+
+    assert policy.due("nas", 100)
+    assert policy.next_probe_at(100) is None
@@ -0,0 +1,111 @@
+import socket
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from wolnut.readiness import ReadinessCheck, check_readiness, run_check
+
+
+@pytest.fixture
+def listening_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen()
+        yield sock.getsockname()[1]
+
+
+@pytest.fixture
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_tcp_check(listening_port, closed_port):
+    assert run_check("127.0.0.1", ReadinessCheck("tcp", port=listening_port))
+    assert not run_check("127.0.0.1", ReadinessCheck("tcp", port=closed_port))
+
+
+@pytest.fixture
+def http_port():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200 if self.path == "/health" else 503)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_check(http_port):
+    url = f"http://{{host}}:{http_port}"
+    assert run_check("127.0.0.1", ReadinessCheck("http", url=url + "/health"))
+    assert not run_check("127.0.0.1", ReadinessCheck("http", url=url + "/api"))
+    assert run_check(
+        "127.0.0.1", ReadinessCheck("http", url=url + "/api", expect_status=503)
+    )
+
+
+@pytest.fixture
+def non_http_port():
+    """A port that answers with something other than HTTP, e.g. SSH."""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    def serve():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn:
+                conn.sendall(b"SSH-2.0-OpenSSH_9.6\r\n")
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+
+
+def test_http_check_against_non_http_service(non_http_port):
+    check = ReadinessCheck("http", url=f"http://{{host}}:{non_http_port}/")
+    assert not run_check("127.0.0.1", check)
+    assert check_readiness({"nas": ("127.0.0.1", [check])}, 2) == {"nas": False}
+
+
+def test_command_check():
+    python = f'"{sys.executable}" -c'
+    passing = ReadinessCheck(
+        "command",
+        command=python + " \"import sys; sys.exit(sys.argv[1] != 'nas')\" {host}",
+    )
+    assert run_check("nas", passing)
+    assert not run_check("desktop", passing)
+
+    slow = ReadinessCheck(
+        "command", command=python + ' "import time; time.sleep(5)"', timeout_sec=0.2
+    )
+    assert not run_check("nas", slow)
+
+
+def test_check_readiness_needs_every_check(mocker):
+    mocker.patch(
+        "wolnut.readiness.run_check", side_effect=lambda host, check: check.port != 2
+    )
+    tcp = [ReadinessCheck("tcp", port=port) for port in (1, 2, 3)]
+
+    ready = check_readiness(
+        {"nas": ("10.0.0.1", tcp[:1]), "vm-host": ("10.0.0.2", tcp)},
+        max_concurrency=2,
+    )
+
+    assert ready == {"nas": True, "vm-host": False}
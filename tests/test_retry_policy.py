@@ -0,0 +1,40 @@
+import random
+
+from wolnut.retry_policy import RetryPolicy
+
+
+def test_fixed_delay_by_default():
+    policy = RetryPolicy(reattempt_delay=30)
+    assert [policy.delay(attempt) for attempt in (1, 2, 10)] == [30, 30, 30]
+    assert not policy.exhausted(100)
+
+
+def test_exponential_backoff_is_capped():
+    policy = RetryPolicy(reattempt_delay=30, backoff=2, max_delay_sec=200)
+    assert [policy.delay(attempt) for attempt in range(1, 6)] == [30, 60, 120, 200, 200]
+    # Huge attempt counts don't overflow
+    assert policy.delay(10_000) == 200
+
+
+def test_max_delay_below_first_delay():
+    policy = RetryPolicy(reattempt_delay=600, max_delay_sec=300)
+    assert policy.delay(1) == 600
+
+
+def test_boot_time_is_the_minimum():
+    policy = RetryPolicy(reattempt_delay=30, backoff=2)
+    assert policy.delay(1, boot_time=180) == 180
+    assert policy.delay(4, boot_time=180) == 240
+
+
+def test_jitter_spreads_delays():
+    policy = RetryPolicy(reattempt_delay=100, jitter=0.2)
+    delays = {policy.delay(1, rng=random.Random(seed)) for seed in range(20)}
+    assert len(delays) > 1
+    assert all(80 <= delay <= 120 for delay in delays)
+
+
+def test_max_attempts():
+    policy = RetryPolicy(max_attempts=3)
+    assert not policy.exhausted(2)
+    assert policy.exhausted(3)
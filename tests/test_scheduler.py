@@ -0,0 +1,96 @@
+import threading
+import time
+
+from wolnut.clock import VirtualClock
+from wolnut.scheduler import DeadlineScheduler
+
+
+def test_next_deadline_is_earliest():
+    scheduler = DeadlineScheduler()
+    assert scheduler.next_deadline() is None
+
+    scheduler.schedule("poll", 110)
+    scheduler.schedule("restore_delay", 105)
+    scheduler.schedule("client_timeout", 400)
+
+    assert scheduler.next_deadline() == ("restore_delay", 105)
+    assert len(scheduler) == 3
+
+
+def test_reschedule_replaces_deadline():
+    scheduler = DeadlineScheduler()
+    scheduler.schedule("poll", 100)
+    scheduler.schedule("poll", 200)
+    scheduler.schedule("other", 150)
+
+    assert scheduler.next_deadline() == ("other", 150)
+    assert scheduler.deadline("poll") == 200
+    assert len(scheduler) == 2
+
+
+def test_cancel():
+    scheduler = DeadlineScheduler()
+    scheduler.schedule("poll", 100)
+    scheduler.schedule("retry", 50)
+    scheduler.cancel("retry")
+    scheduler.cancel("missing")
+
+    assert "retry" not in scheduler
+    assert scheduler.next_deadline() == ("poll", 100)
+
+
+def test_pop_due():
+    scheduler = DeadlineScheduler()
+    scheduler.schedule("b", 20)
+    scheduler.schedule("a", 10)
+    scheduler.schedule("c", 30)
+
+    assert scheduler.pop_due(now=25) == ["a", "b"]
+    assert scheduler.pop_due(now=25) == []
+    assert scheduler.next_deadline() == ("c", 30)
+
+
+def test_wait_sleeps_until_earliest_deadline(mocker):
+    clock = VirtualClock(100.0)
+    scheduler = DeadlineScheduler(clock)
+    mock_wait = mocker.patch.object(clock, "wait")
+    scheduler.schedule("poll", 110)
+    scheduler.schedule("restore_delay", 103.5)
+
+    scheduler.wait()
+    mock_wait.assert_called_once_with(scheduler._wakeup, 3.5)
+
+    mock_wait.reset_mock()
+    scheduler.wait(max_wait=1)
+    mock_wait.assert_called_once_with(scheduler._wakeup, 1)
+
+
+def test_wait_returns_due_keys():
+    scheduler = DeadlineScheduler(VirtualClock(100.0))
+    scheduler.schedule("poll", 99)
+    scheduler.schedule("later", 200)
+
+    assert scheduler.wait() == ["poll"]
+
+
+def test_wake_interrupts_wait():
+    scheduler = DeadlineScheduler()
+    scheduler.schedule("far", time.time() + 60)
+    timer = threading.Timer(0.05, scheduler.wake)
+    timer.start()
+
+    assert scheduler.wait() == []
+    timer.join()
+
+
+def test_wait_in_virtual_time():
+    clock = VirtualClock(100.0)
+    scheduler = DeadlineScheduler(clock)
+    scheduler.schedule("restore_delay", 130)
+    scheduler.schedule("poll", 110)
+
+    assert scheduler.wait() == ["poll"]
+    assert clock.time() == 110
+    assert scheduler.wait(max_wait=5) == []
+    assert scheduler.wait() == ["restore_delay"]
+    assert clock.time() == 130
@@ -1,9 +1,11 @@
+import json
 import os
 import pytest
 import time
 
 from pathlib import Path
-from wolnut import state
+from wolnut import metrics, state
+from wolnut.clock import VirtualClock
 
 
 # A simple mock client class for testing, as ClientStateTracker expects objects
@@ -98,6 +100,14 @@ def test_update_and_is_online(tracker):
     assert not tracker.is_online("client-1")
 
 
+def test_update_many(tracker):
+    """Tests applying a batch of probe results."""
+    tracker.update_many({"client-1": True, "client-2": False, "unknown": True})
+    assert tracker.is_online("client-1")
+    assert not tracker.is_online("client-2")
+    assert not tracker.is_online("unknown")
+
+
 def test_mark_all_online_clients(tracker):
     """Tests marking all currently online clients for future WOL."""
     tracker.update("client-1", True)
@@ -109,29 +119,72 @@ def test_mark_all_online_clients(tracker):
     assert not tracker.was_online_before_shutdown("client-2")
 
 
-def test_should_attempt_wol(tracker, mocker):
+def test_should_attempt_wol(clients, tmp_path):
     """Tests the logic for WOL re-attempt delays based on time."""
+    clock = VirtualClock(1000.0)
+    tracker = state.ClientStateTracker(
+        clients, status_file=str(tmp_path / "wolnut_state.json"), clock=clock
+    )
     reattempt_delay = 30
     # Initially, we should always be able to attempt.
     assert tracker.should_attempt_wol("client-1", reattempt_delay)
 
     # Mark WOL as sent.
-    mock_time = mocker.patch("wolnut.state.time.time")
-    mock_time.return_value = 1000.0
     tracker.mark_wol_sent("client-1")
 
     # Immediately after, we should not attempt.
     assert not tracker.should_attempt_wol("client-1", reattempt_delay)
 
     # After some time, but less than the delay, we should not attempt.
-    mock_time.return_value = 1000.0 + reattempt_delay - 5
+    clock.advance(reattempt_delay - 5)
     assert not tracker.should_attempt_wol("client-1", reattempt_delay)
 
     # After the delay has passed, we should attempt.
-    mock_time.return_value = 1000.0 + reattempt_delay
+    clock.advance(5)
     assert tracker.should_attempt_wol("client-1", reattempt_delay)
 
 
+def test_retry_delay_is_persisted(clients, tmp_path):
+    """Tests that the retry policy's next attempt survives a restart."""
+    clock = VirtualClock(1000.0)
+    status_file = str(tmp_path / "wolnut_state.json")
+    tracker = state.ClientStateTracker(clients, status_file=status_file, clock=clock)
+
+    tracker.mark_wol_sent_many(["client-1", "client-2"], {"client-1": 120})
+    tracker.mark_wol_sent("client-1", retry_delay=240)
+    tracker.save_state()
+
+    restarted = state.ClientStateTracker(clients, status_file=status_file, clock=clock)
+    assert restarted.wol_attempts("client-1") == 2
+    assert restarted.next_wol_attempt_at("client-1") == 1240
+    assert restarted.should_attempt_wol("client-2")
+    clock.advance(239)
+    assert not restarted.should_attempt_wol("client-1")
+    clock.advance(1)
+    assert restarted.should_attempt_wol("client-1")
+
+    restarted.reset()
+    assert restarted.wol_attempts("client-1") == 0
+
+
+def test_mark_wol_sent_many(tracker):
+    """Tests marking a batch of clients as sent a WOL packet."""
+    tracker.mark_wol_sent_many(["client-1", "client-2"])
+    assert tracker.has_been_wol_sent("client-1")
+    assert tracker.has_been_wol_sent("client-2")
+    assert not tracker.should_attempt_wol("client-1", 30)
+
+
+def test_next_wol_attempt_at(clients, tmp_path):
+    """Tests that the next attempt time matches should_attempt_wol."""
+    tracker = state.ClientStateTracker(
+        clients, str(tmp_path / "wolnut_state.json"), clock=VirtualClock(1000.0)
+    )
+    assert tracker.next_wol_attempt_at("client-1", 30) == 30
+    tracker.mark_wol_sent("client-1")
+    assert tracker.next_wol_attempt_at("client-1", 30) == 1030
+
+
 def test_reset(tracker):
     """Tests that the reset method clears the correct state fields."""
     # Set some state to non-default values
@@ -174,6 +227,57 @@ def test_set_and_was_ups_on_battery(tracker):
     assert tracker._meta_state["battery_percent_at_shutdown"] == 100
 
 
+def test_per_ups_battery_state(tracker):
+    """Tests that each UPS's battery state is tracked separately."""
+    tracker.set_ups_on_battery(True, 80, ups="rack-a")
+    tracker.set_ups_on_battery(False, ups="rack-b")
+
+    assert tracker.was_ups_on_battery("rack-a")
+    assert not tracker.was_ups_on_battery("rack-b")
+    assert tracker.was_ups_on_battery()
+
+    tracker.reset(["client-1"], ups="rack-a")
+    assert not tracker.was_ups_on_battery("rack-a")
+    assert not tracker.was_ups_on_battery()
+
+
+def test_per_ups_state_persists(clients, tmp_path):
+    """Tests that per-UPS state survives a restart."""
+    state_file = tmp_path / "wolnut_state.json"
+    tracker1 = state.ClientStateTracker(clients, status_file=str(state_file))
+    tracker1.set_ups_on_battery(True, 80, ups="rack-a")
+    tracker1.set_ups_on_battery(False, ups="rack-b")
+    tracker1.save_state()
+
+    tracker2 = state.ClientStateTracker(clients, status_file=str(state_file))
+    assert tracker2.was_ups_on_battery("rack-a")
+    assert not tracker2.was_ups_on_battery("rack-b")
+
+
+def test_legacy_state_applies_to_every_ups(clients, tmp_path):
+    """Tests that a state file without per-UPS data resumes every UPS."""
+    state_file = tmp_path / "wolnut_state.json"
+    state_file.write_text(
+        '{"meta": {"ups_on_battery": true, "battery_percent_at_shutdown": 40}, '
+        '"clients": {}}'
+    )
+    tracker = state.ClientStateTracker(clients, status_file=str(state_file))
+    assert tracker.was_ups_on_battery("any-ups")
+
+
+def test_partial_snapshot_and_reset(tracker):
+    """Tests snapshotting and resetting only some clients."""
+    tracker.update_many({"client-1": True, "client-2": True})
+    tracker.mark_all_online_clients(["client-1"])
+    assert tracker.was_online_before_shutdown("client-1")
+    assert not tracker.was_online_before_shutdown("client-2")
+
+    tracker.mark_all_online_clients()
+    tracker.reset(["client-2"])
+    assert tracker.was_online_before_shutdown("client-1")
+    assert not tracker.was_online_before_shutdown("client-2")
+
+
 def test_state_not_saved_if_unchanged(tracker, mocker):
     """Tests that _save_state is skipped if the state hash hasn't changed."""
     # Initial save on update
@@ -194,6 +298,20 @@ def test_state_not_saved_if_unchanged(tracker, mocker):
     assert mock_open.call_count == 2
 
 
+def test_state_save_metrics(tracker):
+    """Tests that written and skipped saves are counted."""
+    written = metrics.STATE_SAVES.value(result="written")
+    skipped = metrics.STATE_SAVES.value(result="skipped")
+
+    tracker.update("client-1", True)
+    tracker.save_state()
+    tracker.reset()  # Marks the state dirty without changing it
+    tracker.save_state()
+
+    assert metrics.STATE_SAVES.value(result="written") == written + 1
+    assert metrics.STATE_SAVES.value(result="skipped") == skipped + 1
+
+
 def test_atomic_save_mechanism(tracker, tmp_path, mocker):
     """Tests that a temporary file is used for saving state."""
     state_file = tmp_path / "wolnut_state.json"
@@ -247,3 +365,223 @@ def test_save_state_rename_error(tracker, mocker, caplog):
     tracker.update("client-1", True)  # Make the state dirty
     tracker.save_state()
     assert "Failed to move temporary state to permanent" in caplog.text
+
+
+@pytest.fixture
+def journal_tracker(clients, tmp_path):
+    """Provides a ClientStateTracker that journals its changes."""
+    state_file = tmp_path / "wolnut_state.json"
+    return state.ClientStateTracker(clients, status_file=str(state_file), journal=True)
+
+
+def test_journal_appends_only_changes(journal_tracker, tmp_path):
+    """Tests that a journaled save appends a record with just the changed fields."""
+    journal_file = tmp_path / "wolnut_state.journal"
+
+    journal_tracker.update("client-1", True)
+    journal_tracker.save_state()
+    journal_tracker.mark_skip("client-2")
+    journal_tracker.save_state()
+
+    assert not (tmp_path / "wolnut_state.json").exists()
+    records = [json.loads(line) for line in journal_file.read_text().splitlines()]
+    assert records == [
+        {"generation": 0, "clients": {"client-1": {"is_online": True}}},
+        {"generation": 0, "clients": {"client-2": {"skip": True}}},
+    ]
+
+
+def test_journal_skips_unchanged_save(journal_tracker, tmp_path):
+    """Tests that nothing is appended when the state did not change."""
+    journal_tracker.reset()
+    journal_tracker.save_state()
+    assert not (tmp_path / "wolnut_state.journal").exists()
+
+
+def test_journal_replayed_on_load(clients, tmp_path):
+    """Tests that journaled changes survive a restart."""
+    state_file = tmp_path / "wolnut_state.json"
+    tracker1 = state.ClientStateTracker(clients, str(state_file), journal=True)
+    tracker1.update("client-1", True)
+    tracker1.mark_all_online_clients()
+    tracker1.save_state()
+    tracker1.mark_wol_sent("client-2")
+    tracker1.set_ups_on_battery(True, 50, ups="rack-a")
+    tracker1.save_state()
+
+    tracker2 = state.ClientStateTracker(clients, str(state_file), journal=True)
+
+    assert tracker2.was_online_before_shutdown("client-1")
+    assert tracker2.has_been_wol_sent("client-2")
+    assert tracker2.was_ups_on_battery("rack-a")
+    assert tracker2._meta_state["battery_percent_at_shutdown"] == 50
+
+
+def test_journal_compaction(clients, tmp_path):
+    """Tests that the journal is folded into the status file periodically."""
+    state_file = tmp_path / "wolnut_state.json"
+    journal_file = tmp_path / "wolnut_state.journal"
+    tracker = state.ClientStateTracker(
+        clients, str(state_file), journal=True, compact_every=2
+    )
+
+    for online in (True, False):
+        tracker.update("client-1", online)
+        tracker.save_state()
+    assert journal_file.exists() and not state_file.exists()
+
+    tracker.update("client-2", True)
+    tracker.save_state()
+    assert state_file.exists() and not journal_file.exists()
+
+    tracker.update("client-1", True)
+    tracker.save_state()
+    reloaded = state.ClientStateTracker(clients, str(state_file))
+    assert reloaded.is_online("client-1")
+    assert reloaded.is_online("client-2")
+
+
+def test_journal_left_by_crash_during_compaction(clients, tmp_path):
+    """Tests that a journal the snapshot already contains is not replayed over it."""
+    state_file = tmp_path / "wolnut_state.json"
+    journal_file = tmp_path / "wolnut_state.journal"
+    tracker = state.ClientStateTracker(
+        clients, str(state_file), journal=True, compact_every=2
+    )
+    tracker.update("client-1", True)
+    tracker.save_state()
+    tracker.update("client-2", True)
+    tracker.save_state()
+    journal = journal_file.read_text()
+
+    # Crash after the snapshot replaced the status file, before the unlink
+    tracker.update("client-1", False)
+    tracker.save_state()
+    journal_file.write_text(journal)
+
+    reloaded = state.ClientStateTracker(clients, str(state_file), journal=True)
+    assert not reloaded.is_online("client-1")
+    assert reloaded.is_online("client-2")
+
+    reloaded.update("client-2", False)
+    reloaded.save_state()
+    assert not journal_file.exists()
+    assert json.loads(state_file.read_text())["generation"] == 2
+
+
+def test_journal_damaged_tail(clients, tmp_path, caplog):
+    """Tests that a record cut short by a crash is ignored and compacted away."""
+    state_file = tmp_path / "wolnut_state.json"
+    journal_file = tmp_path / "wolnut_state.journal"
+    journal_file.write_text(
+        '{"clients":{"client-1":{"wol_sent":true}}}\n{"clients":{"client-2":{"wol'
+    )
+
+    tracker = state.ClientStateTracker(clients, str(state_file), journal=True)
+
+    assert "Ignoring damaged state journal from line 2" in caplog.text
+    assert tracker.has_been_wol_sent("client-1")
+    assert not tracker.has_been_wol_sent("client-2")
+
+    tracker.save_state()
+    assert state_file.exists() and not journal_file.exists()
+
+
+def test_journal_damaged_first_line(clients, tmp_path):
+    """Tests that new records aren't appended to a torn first line and lost."""
+    state_file = tmp_path / "wolnut_state.json"
+    journal_file = tmp_path / "wolnut_state.journal"
+    journal_file.write_text('{"clients":{"client-2":{"wol')
+
+    tracker = state.ClientStateTracker(clients, str(state_file), journal=True)
+    tracker.mark_wol_sent("client-1")
+    tracker.save_state()
+    tracker.update("client-2", True)
+    tracker.save_state()
+
+    reloaded = state.ClientStateTracker(clients, str(state_file), journal=True)
+    assert reloaded.has_been_wol_sent("client-1")
+    assert reloaded.is_online("client-2")
+
+
+def test_journal_folded_when_disabled(clients, tmp_path):
+    """Tests that a leftover journal is applied and removed when journaling is off."""
+    state_file = tmp_path / "wolnut_state.json"
+    journal_file = tmp_path / "wolnut_state.journal"
+    journal_file.write_text('{"meta":{"ups_on_battery":true}}\n')
+
+    tracker = state.ClientStateTracker(clients, str(state_file))
+    assert tracker.was_ups_on_battery()
+
+    tracker.save_state()
+    assert not journal_file.exists()
+    assert json.loads(state_file.read_text())["meta"]["ups_on_battery"]
+
+
+def test_sync_clients(journal_tracker, clients, tmp_path):
+    """Tests that a reload adds and removes clients but keeps the others' state."""
+    state_file = tmp_path / "wolnut_state.json"
+    journal_tracker.update("client-1", True)
+    journal_tracker.save_state()
+
+    journal_tracker.sync_clients(["client-1", "client-3"])
+    assert journal_tracker.is_online("client-1")
+    assert not journal_tracker.is_online("client-3")
+
+    # Removals can't be journaled, so the next save is a snapshot
+    journal_tracker.save_state()
+    assert not (tmp_path / "wolnut_state.journal").exists()
+    saved = json.loads(state_file.read_text())
+    assert set(saved["clients"]) == {"client-1", "client-3"}
+
+    reloaded = state.ClientStateTracker(
+        [MockClient("client-1"), MockClient("client-3")], str(state_file)
+    )
+    assert reloaded.is_online("client-1")
+
+
+def test_client_state_is_slotted():
+    """Tests that client records do not carry a per-instance dict."""
+    assert not hasattr(state.ClientState(), "__dict__")
+
+
+def test_status_file_is_versioned(tracker, tmp_path):
+    """Tests that saved files record the schema version."""
+    tracker.update("client-1", True)
+    tracker.save_state()
+
+    save_data = json.loads((tmp_path / "wolnut_state.json").read_text())
+    assert save_data["version"] == state.STATE_SCHEMA_VERSION
+    assert save_data["clients"]["client-1"] == {
+        "was_online_before_battery": False,
+        "is_online": True,
+        "is_ready": False,
+        "wol_sent": False,
+        "wol_sent_at": 0,
+        "wol_attempts": 0,
+        "wol_retry_at": 0,
+        "skip": False,
+    }
+
+
+def test_load_version_1_client_records(clients, tmp_path):
+    """Tests that unversioned files with partial or extra client fields load."""
+    state_file = tmp_path / "wolnut_state.json"
+    state_file.write_text(
+        '{"meta": {"ups_on_battery": false}, '
+        '"clients": {"client-1": {"wol_sent": true, "legacy": 1}}}'
+    )
+    tracker = state.ClientStateTracker(clients, status_file=str(state_file))
+    assert tracker.has_been_wol_sent("client-1")
+    assert not tracker.should_skip("client-1")
+
+
+def test_load_newer_version(clients, tmp_path, caplog):
+    """Tests that a file from a newer schema is not misread."""
+    state_file = tmp_path / "wolnut_state.json"
+    state_file.write_text(
+        '{"version": 99, "meta": {"ups_on_battery": true}, "clients": {}}'
+    )
+    tracker = state.ClientStateTracker(clients, status_file=str(state_file))
+    assert "Unsupported state file version: 99" in caplog.text
+    assert not tracker.was_ups_on_battery()
@@ -0,0 +1,92 @@
+import ipaddress
+import socket
+import struct
+
+from wolnut import subnets
+from wolnut.subnets import Subnet, find_subnet, parse_addresses, wol_target
+from wolnut.wol import WolTarget
+
+
+def rtattr(attr_type, value):
+    attr = struct.pack("=HH", 4 + len(value), attr_type) + value
+    return attr + b"\0" * (-len(attr) % 4)
+
+
+def addr_message(address, prefix, index=2, broadcast=None, scope=0, family=None):
+    body = struct.pack("=BBBBI", family or socket.AF_INET, prefix, 0, scope, index)
+    body += rtattr(subnets.IFA_LOCAL, socket.inet_aton(address))
+    if broadcast is not None:
+        body += rtattr(subnets.IFA_BROADCAST, socket.inet_aton(broadcast))
+    return subnets.RTM_NEWADDR, body
+
+
+def network(cidr):
+    return ipaddress.IPv4Network(cidr)
+
+
+def test_parse_addresses():
+    names = {1: "lo", 2: "eth0", 3: "eth0.20", 4: "wg0"}
+    messages = [
+        addr_message("127.0.0.1", 8, index=1, scope=subnets.RT_SCOPE_HOST),
+        addr_message("192.168.1.2", 24, broadcast="192.168.1.255"),
+        addr_message("10.20.0.1", 16, index=3),  # No IFA_BROADCAST
+        addr_message("10.99.0.1", 32, index=4),  # No room for a broadcast
+        addr_message("192.168.1.3", 24, family=socket.AF_INET6),
+    ]
+
+    assert parse_addresses(messages, names.__getitem__) == [
+        Subnet("eth0", network("192.168.1.0/24"), "192.168.1.255"),
+        Subnet("eth0.20", network("10.20.0.0/16"), "10.20.255.255"),
+    ]
+
+
+LOCAL_SUBNETS = [
+    Subnet("eth0", network("10.0.0.0/8"), "10.255.255.255"),
+    Subnet("eth0.20", network("10.20.0.0/16"), "10.20.255.255"),
+    Subnet("eth1", network("192.168.1.0/24"), "192.168.1.255"),
+]
+
+
+def test_find_subnet_most_specific():
+    assert find_subnet("10.20.0.5", LOCAL_SUBNETS).interface == "eth0.20"
+    assert find_subnet("10.30.0.5", LOCAL_SUBNETS).interface == "eth0"
+    assert find_subnet("10.20.0.5", LOCAL_SUBNETS, interface="eth0").interface == (
+        "eth0"
+    )
+    assert find_subnet("172.16.0.5", LOCAL_SUBNETS) is None
+
+
+def test_find_subnet_resolves_hostnames(mocker):
+    mocker.patch("wolnut.subnets.socket.gethostbyname", return_value="192.168.1.7")
+    assert find_subnet("nas.lan", LOCAL_SUBNETS).interface == "eth1"
+
+    mocker.patch(
+        "wolnut.subnets.socket.gethostbyname", side_effect=socket.gaierror("unknown")
+    )
+    assert find_subnet("nas.lan", LOCAL_SUBNETS) is None
+
+
+def test_wol_target():
+    assert wol_target("192.168.1.7", LOCAL_SUBNETS) == WolTarget(
+        "192.168.1.255", "eth1"
+    )
+    # Configured addresses win over the subnet
+    assert wol_target(
+        "192.168.1.7", LOCAL_SUBNETS, broadcast="192.168.1.127"
+    ) == WolTarget("192.168.1.127")
+    assert wol_target(
+        "172.16.0.5", LOCAL_SUBNETS, interface="wg0", default_broadcast="172.16.0.255"
+    ) == WolTarget("172.16.0.255", "wg0")
+
+
+def test_wol_target_ethernet():
+    """Tests that raw frames get the interface of the client's subnet."""
+    assert wol_target("192.168.1.7", LOCAL_SUBNETS, transport="ethernet") == (
+        WolTarget("192.168.1.255", "eth1", "ethernet")
+    )
+    assert wol_target(
+        "192.168.1.7", LOCAL_SUBNETS, broadcast="192.168.1.127", transport="ethernet"
+    ) == WolTarget("192.168.1.127", "eth1", "ethernet")
+    assert wol_target("172.16.0.5", LOCAL_SUBNETS, transport="ethernet") == (
+        WolTarget("255.255.255.255", None, "ethernet")
+    )
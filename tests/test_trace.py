@@ -0,0 +1,178 @@
+import json
+import time
+
+import pytest
+
+from wolnut import trace
+from wolnut.clock import VirtualClock
+from wolnut.config import ClientConfig, NutConfig, WakeOnConfig, WolnutConfig
+from wolnut.daemon import WolnutDaemon
+
+START = 1_000_000.0
+OUTAGE_START = START + 60
+OUTAGE_END = OUTAGE_START + 6 * 60 * 60
+
+
+@pytest.fixture
+def config(tmp_path):
+    return WolnutConfig(
+        nut=[NutConfig(ups="ups")],
+        status_file=str(tmp_path / "state.json"),
+        wake_on=WakeOnConfig(restore_delay_sec=30, client_timeout_sec=600),
+        clients=[
+            ClientConfig(name="nas", host="10.0.0.1", mac="DE:AD:BE:EF:00:01"),
+            ClientConfig(name="desktop", host="10.0.0.2", mac="DE:AD:BE:EF:00:02"),
+        ],
+    )
+
+
+def six_hour_outage():
+    """A recorded outage: both clients shut down and boot 2 minutes after power returns."""
+    records = []
+    for t in range(int(START), int(OUTAGE_END) + 600, 10):
+        on_battery = OUTAGE_START <= t < OUTAGE_END
+        charge = 100 - 80 * (t - OUTAGE_START) / (OUTAGE_END - OUTAGE_START)
+        records.append(
+            {
+                "time": t,
+                "ups": "ups",
+                "status": {
+                    "ups.status": "OB" if on_battery else "OL",
+                    "battery.charge": str(round(charge) if on_battery else 100),
+                },
+            }
+        )
+        online = t < OUTAGE_START + 30 or t >= OUTAGE_END + 120
+        rtt = 0.001 if online else None
+        records.append({"time": t, "probe": {"10.0.0.1": rtt, "10.0.0.2": rtt}})
+    return records
+
+
+def test_recorder_writes_json_lines(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    recorder = trace.TraceRecorder(str(path))
+    recorder.record_ups("ups", {"ups.status": "OL"}, 10.0)
+    recorder.record_probe({"10.0.0.1": None}, 11.0)
+    recorder.close()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert lines == [
+        {"time": 10.0, "ups": "ups", "status": {"ups.status": "OL"}},
+        {"time": 11.0, "probe": {"10.0.0.1": None}},
+    ]
+
+
+def test_daemon_records_readings(config, tmp_path, mocker):
+    mocker.patch(
+        "wolnut.daemon.get_ups_status",
+        return_value={"ups.status": "OL", "battery.charge": "100"},
+    )
+    mocker.patch(
+        "wolnut.daemon.probe_rtts",
+        return_value={"10.0.0.1": 0.001, "10.0.0.2": None},
+    )
+    path = tmp_path / "trace.jsonl"
+    recorder = trace.TraceRecorder(str(path))
+    daemon = WolnutDaemon(config, clock=VirtualClock(START), recorder=recorder)
+
+    daemon.step()
+    recorder.close()
+
+    loaded = trace.Trace.load(str(path))
+    assert loaded.start == START
+    assert loaded.ups_status("ups", START)["ups.status"] == "OL"
+    assert loaded.probe_rtts(["10.0.0.2"], START) == {"10.0.0.2": None}
+
+
+def test_trace_uses_latest_reading():
+    recorded = trace.Trace(
+        [
+            {"time": 10, "ups": "ups", "status": {"ups.status": "OL"}},
+            {"time": 20, "ups": "ups", "status": {"ups.status": "OB"}},
+            {"time": 15, "probe": {"10.0.0.1": 0.001}},
+        ]
+    )
+
+    assert recorded.ups_status("ups", 5) == {"ups.status": "OL"}
+    assert recorded.ups_status("ups", 19.9) == {"ups.status": "OL"}
+    assert recorded.ups_status("ups", 20) == {"ups.status": "OB"}
+    assert recorded.ups_status("other", 20) == {}
+    assert recorded.probe_rtts(["10.0.0.1", "10.0.0.9"], 16) == {
+        "10.0.0.1": 0.001,
+        "10.0.0.9": None,
+    }
+    assert (recorded.start, recorded.end) == (10, 20)
+
+
+def test_partial_probe_sweeps_keep_other_hosts():
+    recorded = trace.Trace(
+        [
+            {"time": 10, "probe": {"10.0.0.1": 0.001, "10.0.0.2": 0.001}},
+            {"time": 20, "probe": {"10.0.0.2": None}},
+        ]
+    )
+
+    assert recorded.probe_rtts(["10.0.0.1", "10.0.0.2"], 25) == {
+        "10.0.0.1": 0.001,
+        "10.0.0.2": None,
+    }
+
+
+def test_readiness_defaults_to_ready():
+    recorded = trace.Trace(
+        [
+            {"time": 10, "ready": {"nas": False}},
+            {"time": 20, "ready": {"nas": True}},
+        ]
+    )
+
+    assert recorded.readiness(["nas", "desktop"], 15) == {
+        "nas": False,
+        "desktop": True,
+    }
+    assert recorded.readiness(["nas"], 20) == {"nas": True}
+
+
+def test_load_skips_damaged_line(tmp_path, caplog):
+    path = tmp_path / "trace.jsonl"
+    path.write_text('{"time": 1, "probe": {}}\n{"time": 2, "pro')
+
+    loaded = trace.Trace.load(str(path))
+
+    assert loaded.end == 1
+    assert "Skipping damaged trace line 2" in caplog.text
+
+
+def test_empty_trace():
+    with pytest.raises(ValueError, match="The trace is empty"):
+        trace.Trace([])
+
+
+def test_replay_six_hour_outage(config, mocker):
+    send = mocker.patch("wolnut.daemon.send_wol_packets")
+    daemon = trace.ReplayDaemon(config, trace.Trace(six_hour_outage()))
+
+    started = time.perf_counter()
+    daemon.replay()
+
+    assert time.perf_counter() - started < 5
+    send.assert_not_called()
+    restored = OUTAGE_END - START
+    assert daemon.wol_sent[0] == (
+        pytest.approx(restored + 30, abs=10),
+        ["nas", "desktop"],
+    )
+    # Retried every 30s until they booted, then the restoration ended
+    assert len(daemon.wol_sent) in (3, 4)
+    assert not daemon.units[0].restoration_event
+    assert daemon.clock.time() > daemon.trace.end
+
+
+def test_replay_with_longer_restore_delay(config):
+    config.wake_on.restore_delay_sec = 300
+    daemon = trace.ReplayDaemon(config, trace.Trace(six_hour_outage()))
+
+    daemon.replay()
+
+    # The clients were already back before the delay ended
+    assert daemon.wol_sent == []
@@ -29,3 +29,66 @@ def test_resolve_mac_from_host(mocker):
     mock_subprocess_run.assert_any_call(
         ["arp", "-n", "localhost"], capture_output=True, text=True
     )
+
+
+PROC_NET_ARP = """\
+IP address       HW type     Flags       HW address            Mask     Device
+192.168.1.10     0x1         0x2         de:ad:be:ef:00:01     *        eth0
+192.168.1.11     0x1         0x0         00:00:00:00:00:00     *        eth0
+192.168.1.12     0x1         0x6         DE:AD:BE:EF:00:03     *        eth0
+"""
+
+
+def test_read_arp_table(tmp_path):
+    arp_file = tmp_path / "arp"
+    arp_file.write_text(PROC_NET_ARP)
+
+    assert utils.read_arp_table(str(arp_file)) == {
+        "192.168.1.10": "de:ad:be:ef:00:01",
+        "192.168.1.12": "de:ad:be:ef:00:03",
+    }
+
+
+def test_read_arp_table_falls_back_to_arp_command(tmp_path, mocker):
+    class MockArpResult(object):
+        stdout = (
+            "? (192.168.1.10) at de:ad:be:ef:0:1 on en0 ifscope [ethernet]\n"
+            "? (192.168.1.11) at (incomplete) on en0 ifscope [ethernet]\n"
+        )
+
+    mock_run = mocker.patch("wolnut.utils.subprocess.run", return_value=MockArpResult())
+
+    table = utils.read_arp_table(str(tmp_path / "missing"))
+
+    assert table == {"192.168.1.10": "de:ad:be:ef:00:01"}
+    mock_run.assert_called_once_with(["arp", "-an"], capture_output=True, text=True)
+
+
+def test_resolve_macs_from_hosts(mocker):
+    addresses = {"nas.local": "192.168.1.10", "desktop": "192.168.1.11"}
+    mocker.patch(
+        "wolnut.utils.socket.gethostbyname", side_effect=lambda host: addresses[host]
+    )
+    mock_probe = mocker.patch("wolnut.utils.probe_rtts")
+    mock_table = mocker.patch(
+        "wolnut.utils.read_arp_table",
+        return_value={"192.168.1.10": "de:ad:be:ef:00:01"},
+    )
+
+    result = utils.resolve_macs_from_hosts(["nas.local", "desktop"], timeout=1.5)
+
+    assert result == {"nas.local": "de:ad:be:ef:00:01", "desktop": None}
+    # One sweep to prime the neighbor table and one read of it
+    mock_probe.assert_called_once_with(
+        ["192.168.1.10", "192.168.1.11"], 16, 1.5, "auto"
+    )
+    mock_table.assert_called_once_with()
+
+
+def test_resolve_macs_from_hosts_unresolvable(mocker):
+    mocker.patch("wolnut.utils.socket.gethostbyname", side_effect=OSError("nope"))
+    mock_probe = mocker.patch("wolnut.utils.probe_rtts")
+    mocker.patch("wolnut.utils.read_arp_table", return_value={})
+
+    assert utils.resolve_macs_from_hosts(["ghost"]) == {"ghost": None}
+    mock_probe.assert_not_called()
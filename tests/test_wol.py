@@ -1,3 +1,10 @@
+import os
+import shutil
+import socket
+import subprocess
+
+import pytest
+
 from wolnut import wol
 
 
@@ -10,3 +17,189 @@ def test_send_wol_packet(mocker):
     # Intentionally using invalid values so an exception will be raised if the mock is wrong.
     wol.send_wol_packet("testing", broadcast_ip="555.555")
     mock_send_magic_packet.assert_called_once_with("testing", ip_address="555.555")
+
+
+def test_build_magic_packet():
+    packet = wol.build_magic_packet("DE:AD:BE:EF:00:01")
+    assert len(packet) == 102
+    assert packet[:6] == b"\xff" * 6
+    assert packet[6:] == bytes.fromhex("DEADBEEF0001") * 16
+
+
+def test_build_magic_packet_invalid():
+    with pytest.raises(ValueError):
+        wol.build_magic_packet("not-a-mac")
+
+
+def test_send_wol_packets_single_socket(mocker):
+    mock_socket = mocker.patch("wolnut.wol.socket.socket")
+    sock = mock_socket.return_value
+    packets = {"aa": b"packet-a", "bb": b"packet-b"}
+
+    results = wol.send_wol_packets(packets, broadcast_ip="10.0.0.255", port=7)
+
+    assert results == {"aa": True, "bb": True}
+    mock_socket.assert_called_once()
+    sock.sendto.assert_any_call(b"packet-a", ("10.0.0.255", 7))
+    sock.sendto.assert_any_call(b"packet-b", ("10.0.0.255", 7))
+    assert sock.sendto.call_count == 2
+
+
+def test_send_wol_packets_burst(mocker):
+    mock_socket = mocker.patch("wolnut.wol.socket.socket")
+    sock = mock_socket.return_value
+    mock_sleep = mocker.patch("wolnut.wol.time.sleep")
+
+    wol.send_wol_packets({"aa": b"a", "bb": b"b"}, burst_count=3, burst_interval=0.1)
+
+    assert sock.sendto.call_count == 6
+    assert mock_sleep.call_count == 2
+    mock_sleep.assert_called_with(0.1)
+
+
+def test_send_wol_packets_partial_failure(mocker, caplog):
+    mock_socket = mocker.patch("wolnut.wol.socket.socket")
+    sock = mock_socket.return_value
+    sock.sendto.side_effect = [None, OSError("Network unreachable")]
+
+    results = wol.send_wol_packets({"aa": b"a", "bb": b"b"})
+
+    assert results == {"aa": True, "bb": False}
+    assert "Failed to send WOL packet to bb" in caplog.text
+
+
+def test_send_wol_packets_socket_error(mocker):
+    mocker.patch("wolnut.wol.socket.socket", side_effect=OSError("no sockets"))
+    assert wol.send_wol_packets({"aa": b"a"}) == {"aa": False}
+
+
+def test_send_wol_packets_empty(mocker):
+    mock_socket = mocker.patch("wolnut.wol.socket.socket")
+    assert wol.send_wol_packets({}) == {}
+    mock_socket.assert_not_called()
+
+
+def test_send_wol_packets_per_target(mocker):
+    """Tests that each subnet gets its own socket, bound to its interface."""
+    mock_socket = mocker.patch("wolnut.wol.socket.socket")
+    lan, vlan = mocker.MagicMock(), mocker.MagicMock()
+    mock_socket.side_effect = [lan, vlan]
+    targets = {
+        "aa": wol.WolTarget("192.168.1.255", "eth0"),
+        "bb": wol.WolTarget("10.20.255.255", "eth0.20"),
+        "cc": wol.WolTarget("192.168.1.255", "eth0"),
+    }
+
+    results = wol.send_wol_packets(
+        {"aa": b"a", "bb": b"b", "cc": b"c"}, targets=targets, burst_count=2
+    )
+
+    assert results == {"aa": True, "bb": True, "cc": True}
+    lan.setsockopt.assert_any_call(wol.socket.SOL_SOCKET, wol._SO_BINDTODEVICE, b"eth0")
+    vlan.setsockopt.assert_any_call(
+        wol.socket.SOL_SOCKET, wol._SO_BINDTODEVICE, b"eth0.20"
+    )
+    assert [c.args for c in lan.sendto.call_args_list] == [
+        (b"a", ("192.168.1.255", 9)),
+        (b"c", ("192.168.1.255", 9)),
+    ] * 2
+    assert [c.args for c in vlan.sendto.call_args_list] == [
+        (b"b", ("10.20.255.255", 9))
+    ] * 2
+
+
+def test_send_wol_packets_unbound_fallback(mocker, caplog):
+    """Tests that a socket that can't be bound still sends its packets."""
+    mock_socket = mocker.patch("wolnut.wol.socket.socket")
+    sock = mock_socket.return_value
+    sock.setsockopt.side_effect = [None, PermissionError("Operation not permitted")]
+
+    results = wol.send_wol_packets(
+        {"aa": b"a"}, targets={"aa": wol.WolTarget("192.168.1.255", "eth0")}
+    )
+
+    assert results == {"aa": True}
+    sock.sendto.assert_called_once_with(b"a", ("192.168.1.255", 9))
+    assert "Could not bind the WOL socket to eth0" in caplog.text
+
+
+def test_build_ethernet_frame():
+    packet = wol.build_magic_packet("DE:AD:BE:EF:00:01")
+    frame = wol.build_ethernet_frame(packet, bytes.fromhex("020000000001"))
+    assert frame[:14] == bytes.fromhex("ffffffffffff" "020000000001" "0842")
+    assert frame[14:] == packet
+
+
+def test_send_wol_packets_ethernet(mocker):
+    """Tests that raw frames share one packet socket per interface."""
+    mock_socket = mocker.patch("wolnut.wol.socket.socket")
+    sock = mock_socket.return_value
+    sock.getsockname.return_value = ("eth0", 0x0842, 0, 1, b"\x02\0\0\0\0\x01")
+    ethernet = wol.WolTarget(interface="eth0", transport="ethernet")
+    targets = {"aa": ethernet, "bb": wol.WolTarget("10.0.0.255", "eth0", "ethernet")}
+
+    results = wol.send_wol_packets(
+        {"aa": b"a", "bb": b"b"}, targets=targets, burst_count=2
+    )
+
+    assert results == {"aa": True, "bb": True}
+    mock_socket.assert_called_once_with(
+        socket.AF_PACKET, socket.SOCK_RAW, socket.htons(0x0842)
+    )
+    sock.bind.assert_called_once_with(("eth0", 0x0842))
+    header = bytes.fromhex("ffffffffffff" "020000000001" "0842")
+    assert [c.args for c in sock.sendto.call_args_list] == [
+        (header + b"a", ("eth0", 0x0842)),
+        (header + b"b", ("eth0", 0x0842)),
+    ] * 2
+
+
+def test_send_wol_packets_ethernet_not_permitted(mocker, caplog):
+    mocker.patch(
+        "wolnut.wol.socket.socket",
+        side_effect=PermissionError("Operation not permitted"),
+    )
+    targets = {"aa": wol.WolTarget(interface="eth0", transport="ethernet")}
+
+    assert wol.send_wol_packets({"aa": b"a"}, targets=targets) == {"aa": False}
+    assert "Failed to open a packet socket on eth0" in caplog.text
+
+
+@pytest.fixture
+def veth_pair():
+    """A connected pair of virtual interfaces, which needs root."""
+    if not hasattr(os, "geteuid") or os.geteuid() != 0 or not shutil.which("ip"):
+        pytest.skip("Creating a veth pair needs root and iproute2")
+    names = (f"wolt{os.getpid() % 10000}a", f"wolt{os.getpid() % 10000}b")
+    try:
+        subprocess.run(
+            ["ip", "link", "add", names[0], "type", "veth", "peer", "name", names[1]],
+            check=True,
+            capture_output=True,
+        )
+    except subprocess.CalledProcessError as e:
+        pytest.skip(f"Could not create a veth pair: {e.stderr.decode().strip()}")
+    try:
+        for name in names:
+            subprocess.run(["ip", "link", "set", name, "up"], check=True)
+        yield names
+    finally:
+        subprocess.run(["ip", "link", "del", names[0]], check=False)
+
+
+def test_send_wol_packets_ethernet_on_veth(veth_pair):
+    sender, receiver = veth_pair
+    with socket.socket(
+        socket.AF_PACKET, socket.SOCK_RAW, socket.htons(wol.ETH_P_WOL)
+    ) as sock:
+        sock.bind((receiver, wol.ETH_P_WOL))
+        sock.settimeout(2)
+        packet = wol.build_magic_packet("DE:AD:BE:EF:00:01")
+        targets = {"aa": wol.WolTarget(interface=sender, transport="ethernet")}
+
+        assert wol.send_wol_packets({"aa": packet}, targets=targets) == {"aa": True}
+        frame = sock.recv(2048)
+
+    assert frame[:6] == wol.BROADCAST_MAC
+    assert frame[12:14] == bytes.fromhex("0842")
+    assert frame[14:] == packet
@@ -1,12 +1,18 @@
 import click
+import json
 import logging
 import os
+import signal
+import tempfile
 import time
+from dataclasses import replace
 
 from wolnut.config import load_config, DEFAULT_CONFIG_FILEPATHS
-from wolnut.state import ClientStateTracker
-from wolnut.monitor import get_ups_status, is_client_online
-from wolnut.wol import send_wol_packet
+from wolnut.control import DEFAULT_CONTROL_SOCKET, ControlError, send_request
+from wolnut.daemon import WolnutDaemon, get_battery_percent
+from wolnut.events import DEFAULT_EVENT_SOCKET, POWER_EVENTS, send_event
+from wolnut.logs import JsonFormatter, RateLimitFilter
+from wolnut.trace import ReplayDaemon, Trace, TraceRecorder
 
 logger = logging.getLogger("wolnut")
 
@@ -19,8 +25,20 @@ def configure_logger(level: str):
     logger.setLevel(level)
 
 
-def get_battery_percent(ups_status):
-    return round(float(ups_status.get("battery.charge", 100)))
+def configure_log_output(log_format: str, rate_limit: float):
+    """
+    Sets up the log handlers' format and drops repeated messages.
+
+    Args:
+        log_format (str): "text" or "json".
+        rate_limit (float): Seconds within which a repeated message is
+            dropped, 0 to log every message.
+    """
+    for handler in logging.getLogger().handlers:
+        if log_format == "json":
+            handler.setFormatter(JsonFormatter())
+        if rate_limit:
+            handler.addFilter(RateLimitFilter(rate_limit))
 
 
 def main(config_file: str, status_file: str, verbose: bool = False) -> int:
@@ -30,161 +48,45 @@ def main(config_file: str, status_file: str, verbose: bool = False) -> int:
         return 1
 
     configure_logger(config.log_level)
-    logger.info("WOLNUT started. Monitoring UPS: %s", config.nut.ups)
-
-    on_battery = False
-    recorded_down_clients = set()
-    recorded_up_clients = set()
-    battery_percent = 100
-    restoration_event = False
-    restoration_event_start = None
-    wol_being_sent = False
-
-    state_tracker = ClientStateTracker(config.clients, status_file=config.status_file)
-    if state_tracker.was_ups_on_battery():
-        logger.info("WOLNUT is resuming from a UPS battery event")
-        restoration_event = True
-        state_tracker.reset()
-
-    ups_status = get_ups_status(config.nut.ups)
-    battery_percent = get_battery_percent(ups_status)
-    power_status = ups_status.get("ups.status", "OL")
-    logger.info("UPS power status: %s, Battery: %s%%", power_status, battery_percent)
-
-    while True:
-        ups_status = get_ups_status(config.nut.ups)
-        battery_percent = get_battery_percent(ups_status)
-        power_status = ups_status.get("ups.status", "OL")
-
-        logger.debug(
-            "UPS power status: %s, Battery: %s%%", power_status, battery_percent
-        )
+    configure_log_output(config.log_format, config.log_rate_limit_sec)
+    recorder = TraceRecorder(config.trace_file) if config.trace_file else None
+    daemon = WolnutDaemon(config, recorder=recorder)
+    signal.signal(
+        signal.SIGHUP,
+        lambda signum, frame: daemon.request_reload(config_file, verbose),
+    )
+    daemon.run()
+    return 0
+
 
-        # Check each client
-        for client in config.clients:
-            online = is_client_online(client.host)
-            state_tracker.update(client.name, online)
-
-        # Power Loss Event
-        if "OB" in power_status and not on_battery:
-            state_tracker.mark_all_online_clients()
-            state_tracker.set_ups_on_battery(True, battery_percent)
-            on_battery = True
-            logger.warning("UPS switched to battery power.")
-
-        # Power Restoration Event
-        elif ("OL" in power_status and on_battery) or restoration_event:
-            on_battery = False
-            restoration_event = True
-
-            if not restoration_event_start:
-                restoration_event_start = time.time()
-
-            if battery_percent < config.wake_on.min_battery_percent:
-                logger.info(
-                    """Power restored, but battery still below
-                    minimum percentage (%s%%/%s%%). Waiting...""",
-                    battery_percent,
-                    config.wake_on.min_battery_percent,
-                )
-
-            elif (
-                time.time() - restoration_event_start < config.wake_on.restore_delay_sec
-            ):
-                logger.info(
-                    "Power restored, waiting %s seconds before waking clients...",
-                    int(
-                        config.wake_on.restore_delay_sec
-                        - (time.time() - restoration_event_start)
-                    ),
-                )
-
-            else:
-                if not wol_being_sent:
-                    logger.info(
-                        "Power restored and battery >= %s%%. Preparing to send WOL...",
-                        config.wake_on.min_battery_percent,
-                    )
-                    wol_being_sent = True
-
-                for client in config.clients:
-
-                    if state_tracker.should_skip(client.name):
-                        continue
-
-                    if not state_tracker.was_online_before_shutdown(client.name):
-                        logger.info(
-                            "Skipping WOL for %s: was not online before power loss",
-                            client.name,
-                        )
-                        state_tracker.mark_skip(client.name)
-                        continue
-
-                    if state_tracker.is_online(client.name):
-                        if client.name not in recorded_up_clients:
-                            logger.info("%s is online.", client.name)
-                            recorded_down_clients.discard(client.name)
-                            recorded_up_clients.update({client.name})
-                        continue
-
-                    else:
-                        recorded_down_clients.update({client.name})
-                        if state_tracker.should_attempt_wol(
-                            client.name, config.wake_on.reattempt_delay
-                        ):
-                            logger.info(
-                                "Sending WOL packet to %s at %s",
-                                client.name,
-                                client.mac,
-                            )
-                            if send_wol_packet(client.mac):
-                                state_tracker.mark_wol_sent(client.name)
-                        else:
-                            logger.debug(
-                                "Waiting to retry WOL for %s (delay not reached)",
-                                client.name,
-                            )
-
-                if len(recorded_down_clients) == 0:
-                    logger.info("Power Restored and all clients are back online!")
-                    restoration_event = False
-                    restoration_event_start = None
-                    state_tracker.reset()
-                    wol_being_sent = False
-                else:
-                    if (
-                        time.time() - restoration_event_start
-                        > config.wake_on.client_timeout_sec
-                    ):
-                        logger.warning(
-                            "Some devices failed to come back online within the timeout period."
-                        )
-                        for client in recorded_down_clients:
-                            logger.warning(
-                                "%s failed to come back online within timeout period.",
-                                client,
-                            )
-                        restoration_event = False
-                        restoration_event_start = None
-                        wol_being_sent = False
-                    else:
-                        pass
-
-        elif not on_battery and not restoration_event:
-            state_tracker.reset()
-            state_tracker.set_ups_on_battery(False)
-            recorded_down_clients.clear()
-            recorded_up_clients.clear()
-
-        state_tracker.save_state()
-
-        if not on_battery:
-            time.sleep(config.poll_interval)
-        else:
-            time.sleep(2)
-
-
-@click.command()
+def find_config_file(config_file: str | None) -> str:
+    if config_file is None:
+        for path in DEFAULT_CONFIG_FILEPATHS:
+            if os.path.exists(path):
+                config_file = path
+                break
+        if config_file is None:
+            click.echo(
+                "No config file found. Checked default paths and WOLNUT_CONFIG_FILE env var."
+            )
+            raise click.Abort()
+    return config_file
+
+
+class _VirtualTimeFilter(logging.Filter):
+    """Stamps log records with the replay's virtual time."""
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.created = self.clock.time()
+        record.msecs = (record.created % 1) * 1000
+        return True
+
+
+@click.group(invoke_without_command=True)
 @click.option(
     "--config-file",
     envvar="WOLNUT_CONFIG_FILE",
@@ -196,7 +98,10 @@ def main(config_file: str, status_file: str, verbose: bool = False) -> int:
     help="The status filepath to load. Can also be set with WOLNUT_STATUS_FILE env var.",
 )
 @click.option("--verbose", is_flag=True, help="Enable verbose logging")
-def wolnut(config_file: str | None, status_file: str | None, verbose: bool) -> int:
+@click.pass_context
+def wolnut(
+    ctx: click.Context, config_file: str | None, status_file: str | None, verbose: bool
+) -> int:
     """A service to send Wake-on-LAN packets to clients after a power outage."""
     logging.basicConfig(
         level=logging.INFO,
@@ -206,18 +111,221 @@ def wolnut(config_file: str | None, status_file: str | None, verbose: bool) -> i
     if verbose:
         configure_logger("DEBUG")
 
-    if config_file is None:
-        for path in DEFAULT_CONFIG_FILEPATHS:
-            if os.path.exists(path):
-                config_file = path
-                break
-        if config_file is None:
-            click.echo(
-                "No config file found. Checked default paths and WOLNUT_CONFIG_FILE env var."
-            )
-            raise click.Abort()
+    if ctx.invoked_subcommand is not None:
+        ctx.obj = {
+            "config_file": config_file,
+            "status_file": status_file,
+            "verbose": verbose,
+        }
+        return 0
+
+    config_file = find_config_file(config_file)
 
     exit_code = main(config_file, status_file, verbose)
     if exit_code != 0:
         # main() will log the specific error, so we just abort.
         raise click.Abort()
+
+
+@wolnut.command()
+@click.option(
+    "--type",
+    "event_type",
+    envvar="NOTIFYTYPE",
+    required=True,
+    help="The event type, e.g. ONBATT. Set by upsmon as NOTIFYTYPE.",
+)
+@click.option(
+    "--ups",
+    envvar="UPSNAME",
+    help="The UPS the event is for. Set by upsmon as UPSNAME.",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    envvar="WOLNUT_EVENT_SOCKET",
+    default=DEFAULT_EVENT_SOCKET,
+    show_default=True,
+    help="The daemon's event socket. Can also be set with WOLNUT_EVENT_SOCKET env var.",
+)
+@click.argument("message", nargs=-1)
+def notify(event_type: str, ups: str | None, socket_path: str, message: tuple):
+    """Forward a power event from upsmon's NOTIFYCMD to the running daemon."""
+    if event_type.upper() not in POWER_EVENTS:
+        # upsmon calls NOTIFYCMD for every event with EXEC set, most are not ours
+        return
+
+    try:
+        send_event(socket_path, event_type, ups)
+    except OSError as e:
+        click.echo(f"Failed to notify wolnut at {socket_path}: {e}", err=True)
+        raise click.Abort()
+
+
+control_socket_option = click.option(
+    "--socket",
+    "socket_path",
+    envvar="WOLNUT_CONTROL_SOCKET",
+    default=DEFAULT_CONTROL_SOCKET,
+    show_default=True,
+    help="The daemon's control socket. Can also be set with WOLNUT_CONTROL_SOCKET env var.",
+)
+
+
+def request_daemon(socket_path: str, command: str, **args):
+    try:
+        return send_request(socket_path, command, **args)
+    except ControlError as e:
+        click.echo(f"wolnut refused the request: {e}", err=True)
+        raise click.Abort()
+    except OSError as e:
+        click.echo(f"Failed to reach wolnut at {socket_path}: {e}", err=True)
+        raise click.Abort()
+
+
+def format_client_status(client: dict) -> str:
+    details = []
+    if client["was_online_before_battery"]:
+        details.append("online before the outage")
+    if client["wol_sent"]:
+        sent_at = time.strftime("%H:%M:%S", time.localtime(client["wol_sent_at"]))
+        details.append(f"WOL sent at {sent_at}")
+    if client["skip"]:
+        details.append("not being woken")
+    line = f"  {client['name']} ({client['host']}): "
+    if not client["is_online"]:
+        line += "offline"
+    else:
+        line += "online" if client["is_ready"] else "online, not ready"
+    return line + (f", {', '.join(details)}" if details else "")
+
+
+@wolnut.command()
+@control_socket_option
+@click.option("--json", "as_json", is_flag=True, help="Print the raw JSON status.")
+def status(socket_path: str, as_json: bool):
+    """Show the running daemon's view of every UPS and client."""
+    result = request_daemon(socket_path, "status")
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+        return
+
+    for ups in result["ups"]:
+        click.echo(
+            f"UPS {ups['name']}: {ups['phase']} ({ups['status']}), "
+            f"battery {ups['battery_percent']}%"
+        )
+        if ups["waiting_for"]:
+            click.echo(f"  waiting for: {', '.join(ups['waiting_for'])}")
+    click.echo("Clients:")
+    for client in result["clients"]:
+        click.echo(format_client_status(client))
+
+
+@wolnut.command()
+@control_socket_option
+@click.argument("targets", nargs=-1, required=True)
+def wake(socket_path: str, targets: tuple):
+    """Send WOL packets now to clients, every client of a UPS, or "all"."""
+    result = request_daemon(socket_path, "wake", targets=list(targets))
+    click.echo(f"Sent WOL packets to: {', '.join(result['sent']) or 'nobody'}")
+    if result["failed"]:
+        click.echo(
+            f"Failed to send WOL packets to: {', '.join(result['failed'])}", err=True
+        )
+        raise click.Abort()
+
+
+@wolnut.command()
+@control_socket_option
+@click.argument("targets", nargs=-1)
+def probe(socket_path: str, targets: tuple):
+    """Check now whether clients are online. Defaults to every client."""
+    results = request_daemon(socket_path, "probe", targets=list(targets))
+    for name, online in results.items():
+        click.echo(f"{name}: {'online' if online else 'offline'}")
+
+
+@wolnut.command()
+@control_socket_option
+@click.option("--ups", multiple=True, help="Only reset this UPS. Can be repeated.")
+def reset(socket_path: str, ups: tuple):
+    """Forget the outage in progress and stop waking clients."""
+    labels = request_daemon(socket_path, "reset", ups=list(ups))
+    click.echo(f"Reset: {', '.join(labels)}")
+
+
+@wolnut.command()
+@click.argument("trace_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--restore-delay", type=int, help="Override wake_on.restore_delay_sec.")
+@click.option("--min-battery", type=int, help="Override wake_on.min_battery_percent.")
+@click.option("--client-timeout", type=int, help="Override wake_on.client_timeout_sec.")
+@click.option("--reattempt-delay", type=int, help="Override wake_on.reattempt_delay.")
+@click.option("--max-attempts", type=int, help="Override wake_on.max_attempts.")
+@click.pass_context
+def replay(
+    ctx: click.Context,
+    trace_file: str,
+    restore_delay: int | None,
+    min_battery: int | None,
+    client_timeout: int | None,
+    reattempt_delay: int | None,
+    max_attempts: int | None,
+):
+    """Replay a recorded trace in virtual time to see when clients would be woken."""
+    config_file = find_config_file(ctx.obj["config_file"])
+    try:
+        trace = Trace.load(trace_file)
+    except (OSError, ValueError) as e:
+        click.echo(f"Failed to load trace {trace_file}: {e}", err=True)
+        raise click.Abort()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # MACs come from the live daemon's cache, never from the network
+        config = load_config(
+            config_file,
+            status_path=ctx.obj["status_file"],
+            verbose=ctx.obj["verbose"],
+            offline=True,
+        )
+        if not config:
+            raise click.Abort()
+        # Never resume from or overwrite the live daemon's state
+        config.status_file = os.path.join(tmp_dir, "state.json")
+        if not ctx.obj["verbose"]:
+            configure_logger(config.log_level)
+
+        wake_on = config.wake_on
+        if restore_delay is not None:
+            wake_on.restore_delay_sec = restore_delay
+        if min_battery is not None:
+            wake_on.min_battery_percent = min_battery
+        if client_timeout is not None:
+            wake_on.client_timeout_sec = client_timeout
+        # Retry overrides also apply to the named retry policies
+        retry_overrides = {}
+        if reattempt_delay is not None:
+            wake_on.reattempt_delay = reattempt_delay
+            retry_overrides["reattempt_delay"] = reattempt_delay
+        if max_attempts is not None:
+            wake_on.max_attempts = max_attempts
+            retry_overrides["max_attempts"] = max_attempts
+        config.retry_policies = {
+            name: replace(policy, **retry_overrides)
+            for name, policy in config.retry_policies.items()
+        }
+
+        daemon = ReplayDaemon(config, trace)
+        time_filter = _VirtualTimeFilter(daemon.clock)
+        logger.addFilter(time_filter)
+        try:
+            daemon.replay()
+        finally:
+            logger.removeFilter(time_filter)
+
+    click.echo(
+        f"Replayed {trace.end - trace.start:.0f}s of UPS history, "
+        f"{len(daemon.wol_sent)} WOL rounds sent:"
+    )
+    for offset, names in daemon.wol_sent:
+        click.echo(f"  +{offset:.0f}s: {', '.join(names)}")
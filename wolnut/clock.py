@@ -0,0 +1,54 @@
+import threading
+import time
+from typing import Optional
+
+
+class Clock:
+    """
+    The source of time for the control loop, which is wall-clock time.
+
+    Everything that reads the time or sleeps takes a clock, so the loop can
+    be run in simulated time by passing a `VirtualClock` instead.
+    """
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+    def wait(self, event: threading.Event, timeout: Optional[float]) -> bool:
+        """Waits for `event` for up to `timeout` seconds, like `Event.wait`."""
+        return event.wait(timeout)
+
+
+class VirtualClock(Clock):
+    """
+    Simulated time that jumps ahead instead of sleeping.
+
+    Sleeping or waiting returns immediately after moving the clock forward,
+    so hours of restore delays and retries run in a fraction of a second.
+    """
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += max(0.0, seconds)
+
+    def sleep(self, seconds: float):
+        self.advance(seconds)
+
+    def wait(self, event: threading.Event, timeout: Optional[float]) -> bool:
+        if event.is_set():
+            return True
+        if timeout is None:
+            raise RuntimeError("Cannot wait forever in virtual time")
+        self.advance(timeout)
+        return False
+
+
+SYSTEM_CLOCK = Clock()
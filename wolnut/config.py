@@ -1,12 +1,42 @@
+import ipaddress
 import logging
+import queue
 import yaml
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields, replace
 from pathlib import Path
 from typing import Optional
 
-from wolnut.state import DEFAULT_STATE_FILEPATH
-from wolnut.utils import validate_mac_format, resolve_mac_from_host
+from wolnut.logs import DEFAULT_LOG_FORMAT, DEFAULT_LOG_RATE_LIMIT, LOG_FORMATS
+from wolnut.mac_cache import DEFAULT_MAC_CACHE_TTL, MacCache, mac_cache_path
+from wolnut.monitor import (
+    DEFAULT_PROBE_CONCURRENCY,
+    DEFAULT_PROBE_METHOD,
+    DEFAULT_PROBE_TIMEOUT,
+    PROBE_METHODS,
+)
+from wolnut.neighbors import DEFAULT_FAILED_TTL
+from wolnut.planner import find_cycle
+from wolnut.probe_policy import DEFAULT_IDLE_PROBE_INTERVAL, DEFAULT_WOL_PROBE_BACKOFF
+from wolnut.readiness import CHECK_TYPES, ReadinessCheck
+from wolnut.retry_policy import (
+    DEFAULT_REATTEMPT_DELAY,
+    DEFAULT_RETRY_MAX_DELAY,
+    RetryPolicy,
+)
+from wolnut.state import DEFAULT_JOURNAL_COMPACT_EVERY, DEFAULT_STATE_FILEPATH
+from wolnut.subnets import local_subnets, wol_target
+from wolnut.utils import (
+    DEFAULT_MAC_RESOLVE_TIMEOUT,
+    resolve_macs_from_hosts,
+    validate_mac_format,
+)
+from wolnut.wol import (
+    DEFAULT_BROADCAST_IP,
+    WOL_TRANSPORTS,
+    WolTarget,
+    build_magic_packet,
+)
 
 logger = logging.getLogger("wolnut")
 
@@ -17,10 +47,19 @@ DEFAULT_LOG_LEVEL = "INFO"
 @dataclass
 class NutConfig:
     ups: str
-    port: int = 3493
+    name: str | None = None  # Label that clients use to bind to this UPS
+    hostname: str | None = None
+    port: int | None = None  # 3493 unless set here or in `ups`
     timeout: int = 5
     username: str | None = None
     password: str | None = None
+    login: bool = False  # Register as an attached upsd client (LOGIN)
+    wake_budget: float | None = None  # Total power_weight woken per wave
+    max_load_percent: float | None = None  # Hold back waves above this ups.load
+
+    @property
+    def label(self) -> str:
+        return self.name or self.ups
 
 
 @dataclass
@@ -28,7 +67,51 @@ class WakeOnConfig:
     restore_delay_sec: int = 30
     min_battery_percent: int = 20
     client_timeout_sec: int = 360
-    reattempt_delay: int = 30
+    reattempt_delay: int = DEFAULT_REATTEMPT_DELAY
+    retry_backoff: float = 1.0  # Growth of the delay after each retry
+    retry_max_delay_sec: float = DEFAULT_RETRY_MAX_DELAY
+    retry_jitter: float = 0.0  # Random spread of each delay, as a fraction
+    max_attempts: int = 0  # WOL packets per outage, 0 retries until the timeout
+    burst_count: int = 1  # Times each WOL packet is sent per attempt
+    burst_interval_ms: int = 0  # Spacing between repeated packets
+    wave_timeout_sec: int = 120  # Longest wait for a wave before the next one
+    broadcast: str = "auto"  # "auto" uses each client's subnet, or an address
+
+    def retry_policy(self) -> RetryPolicy:
+        """Returns the retry policy of clients without a `retry_policy`."""
+        return RetryPolicy(
+            reattempt_delay=self.reattempt_delay,
+            backoff=self.retry_backoff,
+            max_delay_sec=self.retry_max_delay_sec,
+            jitter=self.retry_jitter,
+            max_attempts=self.max_attempts,
+        )
+
+
+@dataclass
+class ProbeConfig:
+    max_concurrency: int = DEFAULT_PROBE_CONCURRENCY
+    timeout_sec: float = DEFAULT_PROBE_TIMEOUT
+    method: str = DEFAULT_PROBE_METHOD  # "auto", "icmp" or "ping"
+    mac_resolve_timeout_sec: float = DEFAULT_MAC_RESOLVE_TIMEOUT
+    mac_cache_ttl_sec: int = DEFAULT_MAC_CACHE_TTL
+    idle_interval_sec: float = DEFAULT_IDLE_PROBE_INTERVAL  # Sweep interval on mains
+    wol_backoff_sec: float = DEFAULT_WOL_PROBE_BACKOFF  # First probe after a WOL
+    passive: bool = False  # Read liveness from the kernel neighbor table first
+    passive_failed_ttl_sec: float = DEFAULT_FAILED_TTL
+
+
+@dataclass
+class StateConfig:
+    journal: bool = False  # Append changes instead of rewriting the status file
+    compact_every: int = DEFAULT_JOURNAL_COMPACT_EVERY
+
+
+@dataclass
+class MetricsConfig:
+    enabled: bool = False
+    host: str = "0.0.0.0"
+    port: int = 9797
 
 
 @dataclass
@@ -36,16 +119,83 @@ class ClientConfig:
     name: str
     host: str
     mac: str  # "auto" supported
+    ups: list[str] = field(default_factory=list)  # UPS labels, empty means all
+    power_weight: float = 1.0  # Share of the UPS wake_budget used when booting
+    depends_on: list[str] = field(default_factory=list)  # Clients to wake first
+    boot_time_sec: float = 0  # Expected time from WOL to answering probes
+    retry_policy: Optional[str] = None  # Name of one of the retry_policies
+    readiness: list[ReadinessCheck] = field(default_factory=list)  # Beyond pings
+    broadcast: Optional[str] = None  # Derived from the host's subnet if unset
+    interface: Optional[str] = None  # Interface to send WOL packets from
+    wol_transport: str = "udp"  # Or "ethernet" for raw 0x0842 frames
+    magic_packet: bytes = field(default=b"", init=False, repr=False, compare=False)
+    wol_target: WolTarget = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if isinstance(self.ups, str):
+            self.ups = [self.ups]
+        if isinstance(self.depends_on, str):
+            self.depends_on = [self.depends_on]
+        self.readiness = [
+            check if isinstance(check, ReadinessCheck) else ReadinessCheck(**check)
+            for check in self.readiness
+        ]
+        # Build the WOL payload once instead of on every send
+        if self.mac != "auto":
+            self.magic_packet = build_magic_packet(self.mac)
+        self.wol_target = WolTarget(
+            self.broadcast or DEFAULT_BROADCAST_IP, self.interface, self.wol_transport
+        )
+
+    def set_mac(self, mac: str):
+        self.magic_packet = build_magic_packet(mac)
+        self.mac = mac
 
 
 @dataclass
 class WolnutConfig:
-    nut: NutConfig
+    nut: list[NutConfig]
     status_file: str
     poll_interval: int = 10
     wake_on: WakeOnConfig = field(default_factory=WakeOnConfig)
+    probe: ProbeConfig = field(default_factory=ProbeConfig)
+    metrics: MetricsConfig = field(default_factory=MetricsConfig)
+    state: StateConfig = field(default_factory=StateConfig)
     clients: list[ClientConfig] = field(default_factory=list)
+    retry_policies: dict[str, RetryPolicy] = field(default_factory=dict)
     log_level: str = "INFO"
+    log_format: str = DEFAULT_LOG_FORMAT  # "text" or "json"
+    log_rate_limit_sec: float = DEFAULT_LOG_RATE_LIMIT  # 0 logs every repeat
+    event_socket: str | None = None  # Unix socket for `wolnut notify` events
+    event_socket_group: str | None = None  # Group allowed to send events, e.g. nut
+    control_socket: str | None = None  # Unix socket for `wolnut status` etc.
+    trace_file: str | None = None  # Records UPS and probe readings for replay
+    # MACs re-resolved in the background, waiting to be applied by the loop
+    mac_updates: queue.SimpleQueue = field(
+        default_factory=queue.SimpleQueue, repr=False, compare=False
+    )
+
+    def apply_mac_updates(self) -> int:
+        """
+        Applies MACs that changed during the background refresh.
+
+        The refresh only queues its results, so clients are never modified
+        while the main loop is building WOL packets from them.
+
+        Returns:
+            int: The number of clients whose MAC was updated.
+        """
+        clients = {client.name: client for client in self.clients}
+        applied = 0
+        while True:
+            try:
+                name, mac = self.mac_updates.get_nowait()
+            except queue.Empty:
+                return applied
+            # The client may have been removed by a reload since
+            if name in clients:
+                clients[name].set_mac(mac)
+                applied += 1
 
 
 def find_state_file(state_file: Optional[str] = None) -> str:
@@ -65,8 +215,29 @@ def find_state_file(state_file: Optional[str] = None) -> str:
 
 
 def load_config(
-    config_path: str, status_path: str = None, verbose: bool = False
+    config_path: str,
+    status_path: str = None,
+    verbose: bool = False,
+    known_macs: Optional[dict[str, str]] = None,
+    offline: bool = False,
 ) -> Optional[WolnutConfig]:
+    """
+    Loads and validates the configuration file.
+
+    Args:
+        config_path (str): The YAML configuration file.
+        status_path (str | None): Overrides the configured status file.
+        verbose (bool): Whether verbose logging was requested.
+        known_macs (dict | None): MAC addresses by host that are already in
+            use, e.g. when reloading. Clients with `mac: auto` on these hosts
+            are not resolved again.
+        offline (bool): Only use known and cached MAC addresses, without
+            resolving any over the network or writing the MAC cache, e.g. for
+            a replay. Clients with `mac: auto` that aren't cached keep it.
+
+    Returns:
+        WolnutConfig | None: The configuration, or None if it is invalid.
+    """
     try:
         with open(config_path, "r") as f:
             raw = yaml.safe_load(f)
@@ -79,63 +250,272 @@ def load_config(
         return None
 
     # LOGGING...
-    nut = NutConfig(**raw["nut"])
+    nut = [NutConfig(**raw_nut) for raw_nut in _as_list(raw["nut"])]
 
     # get wake_on or use defaults
     wake_on = WakeOnConfig(**raw.get("wake_on", {}))
+    probe = ProbeConfig(**raw.get("probe", {}))
+    metrics = MetricsConfig(**raw.get("metrics", {}))
+    state = StateConfig(**raw.get("state", {}))
+    # Named policies override the wake_on retry settings they mention
+    retry_policies = {
+        name: replace(wake_on.retry_policy(), **values)
+        for name, values in raw.get("retry_policies", {}).items()
+    }
 
     # Determine status file path: CLI arg > config file > default
     final_status_path = status_path or raw.get("status_file")
     # find_state_file will handle None and also ensure the directory exists
     final_status_path = find_state_file(final_status_path)
 
+    # Cached MACs are used straight away, even when stale, so clients that
+    # are still powered off after an outage can be woken
+    mac_cache = MacCache(mac_cache_path(final_status_path), ttl=probe.mac_cache_ttl_sec)
+    auto_hosts = list(
+        dict.fromkeys(c["host"] for c in raw["clients"] if c.get("mac") == "auto")
+    )
+    known_macs = known_macs or {}
+    resolved_macs = {
+        host: known_macs.get(host) or mac_cache.get(host) for host in auto_hosts
+    }
+    uncached_hosts = [host for host in auto_hosts if not resolved_macs[host]]
+    stale_hosts = [
+        host
+        for host in auto_hosts
+        if host not in known_macs and resolved_macs[host] and mac_cache.is_stale(host)
+    ]
+    if offline:
+        uncached_hosts = stale_hosts = []
+
+    def resolve_macs(hosts):
+        return resolve_macs_from_hosts(
+            hosts,
+            timeout=probe.mac_resolve_timeout_sec,
+            max_concurrency=probe.max_concurrency,
+            method=probe.method,
+        )
+
+    # Resolve every uncached "auto" MAC in one sweep rather than one host at a time
+    if uncached_hosts:
+        logger.info("Resolving MAC addresses for %s clients...", len(uncached_hosts))
+        fresh_macs = resolve_macs(uncached_hosts)
+        resolved_macs.update(fresh_macs)
+        if mac_cache.update(fresh_macs):
+            mac_cache.save()
+
     clients = []
+    auto_clients = []
     for raw_client in raw["clients"]:
         try:
             mac = raw_client["mac"]
             if mac == "auto":
-                logger.info(
-                    "Resolving MAC for %s at %s...",
-                    raw_client["name"],
-                    raw_client["host"],
-                )
-                resolved_mac = resolve_mac_from_host(raw_client["host"])
-                if not resolved_mac:
+                resolved_mac = resolved_macs.get(raw_client["host"])
+                if resolved_mac:
+                    raw_client["mac"] = resolved_mac
+                    logger.info("MAC for %s: %s", raw_client["name"], resolved_mac)
+                elif offline:
+                    logger.info("MAC for %s is not cached", raw_client["name"])
+                else:
                     raise ValueError(
                         f"Could not resolve MAC address for {raw_client['name']} ({raw_client['host']})"
                     )
-                raw_client["mac"] = resolved_mac
-                logger.info("MAC for %s: %s", raw_client["name"], resolved_mac)
 
-            clients.append(ClientConfig(**raw_client))
+            client = ClientConfig(**raw_client)
+            clients.append(client)
+            if mac == "auto":
+                auto_clients.append(client)
         except ValueError as e:
             logger.error("Failed to load client %s: %s", raw_client.get("name", "?"), e)
 
+    _assign_wol_targets(clients, wake_on.broadcast)
+
+    mac_updates = queue.SimpleQueue()
+    if stale_hosts:
+
+        def update_client_mac(host, mac):
+            for client in auto_clients:
+                if client.host == host:
+                    mac_updates.put((client.name, mac))
+
+        logger.info("Refreshing %s cached MAC addresses...", len(stale_hosts))
+        mac_cache.refresh_in_background(stale_hosts, resolve_macs, update_client_mac)
+
     wolnut_config = WolnutConfig(
         nut=nut,
         poll_interval=raw.get("poll_interval", 10),
         wake_on=wake_on,
+        probe=probe,
+        metrics=metrics,
+        state=state,
         clients=clients,
+        retry_policies=retry_policies,
         log_level=raw.get("log_level", DEFAULT_LOG_LEVEL).upper(),
+        log_format=raw.get("log_format", DEFAULT_LOG_FORMAT),
+        log_rate_limit_sec=raw.get("log_rate_limit_sec", DEFAULT_LOG_RATE_LIMIT),
         status_file=final_status_path,
+        event_socket=raw.get("event_socket"),
+        event_socket_group=raw.get("event_socket_group"),
+        control_socket=raw.get("control_socket"),
+        trace_file=raw.get("trace_file"),
+        mac_updates=mac_updates,
     )
     logger.info("Config Imported Successfully")
     for client in wolnut_config.clients:
         logger.info("Client: %s at MAC: %s", client.name, client.mac)
+        logger.debug(
+            "WOL packets for %s go to %s", client.name, client.wol_target.describe()
+        )
 
     return wolnut_config
 
 
+def _assign_wol_targets(clients: list[ClientConfig], broadcast: str):
+    """Works out each client's WOL target, see `subnets.wol_target`."""
+
+    def uses_subnets(client: ClientConfig) -> bool:
+        if client.wol_transport == "ethernet":
+            return client.interface is None
+        return broadcast == "auto" and client.broadcast is None
+
+    subnets = []
+    if any(uses_subnets(client) for client in clients):
+        try:
+            subnets = local_subnets()
+        except OSError as e:
+            logger.warning(
+                "Could not list the local subnets, WOL packets go to %s: %s",
+                DEFAULT_BROADCAST_IP,
+                e,
+            )
+    default_broadcast = DEFAULT_BROADCAST_IP if broadcast == "auto" else broadcast
+    for client in clients:
+        target = wol_target(
+            client.host,
+            subnets if uses_subnets(client) else [],
+            broadcast=client.broadcast,
+            interface=client.interface,
+            default_broadcast=default_broadcast,
+            transport=client.wol_transport,
+        )
+        if target.transport == "ethernet" and target.interface is None:
+            logger.warning(
+                "%s is on no local subnet, set its interface to send it raw "
+                "Ethernet frames. Sending it UDP packets instead.",
+                client.name,
+            )
+            target = replace(target, transport="udp")
+        client.wol_target = target
+
+
+def _as_list(value) -> list:
+    return value if isinstance(value, list) else [value]
+
+
+RETRY_POLICY_OPTIONS = tuple(f.name for f in fields(RetryPolicy))
+
+
+def _wake_on_retry_values(raw_wake_on: dict) -> dict:
+    # wake_on prefixes the retry options that would be ambiguous on their own
+    names = {
+        "reattempt_delay": "reattempt_delay",
+        "retry_backoff": "backoff",
+        "retry_max_delay_sec": "max_delay_sec",
+        "retry_jitter": "jitter",
+        "max_attempts": "max_attempts",
+    }
+    return {names[key]: value for key, value in raw_wake_on.items() if key in names}
+
+
+def _validate_retry_policy(where: str, values: dict):
+    if values.get("backoff", 1) < 1:
+        raise ValueError(f"{where}: the retry backoff must be at least 1")
+    if not 0 <= values.get("jitter", 0) < 1:
+        raise ValueError(f"{where}: the retry jitter must be between 0 and 1")
+    if values.get("max_attempts", 0) < 0:
+        raise ValueError(f"{where}: max_attempts can't be negative")
+
+
+def _validate_broadcast(where: str, broadcast):
+    try:
+        ipaddress.IPv4Address(broadcast)
+    except ValueError:
+        raise ValueError(
+            f"{where} has an invalid broadcast address: {broadcast}"
+        ) from None
+
+
+READINESS_CHECK_OPTIONS = tuple(f.name for f in fields(ReadinessCheck))
+# The option each check type can't do without
+_READINESS_CHECK_REQUIRED = {"tcp": "port", "http": "url", "command": "command"}
+
+
+def _validate_readiness_check(client_name: str, check):
+    if not isinstance(check, dict) or check.get("type") not in CHECK_TYPES:
+        raise ValueError(
+            f"Client '{client_name}' has a readiness check without a valid type, "
+            f"expected one of {', '.join(CHECK_TYPES)}"
+        )
+    for option in check:
+        if option not in READINESS_CHECK_OPTIONS:
+            raise ValueError(
+                f"Client '{client_name}' has a readiness check with unknown option: '{option}'"
+            )
+    required = _READINESS_CHECK_REQUIRED[check["type"]]
+    if not check.get(required):
+        raise ValueError(
+            f"Client '{client_name}' has a {check['type']} readiness check without '{required}'"
+        )
+
+
 def validate_config(raw: dict):
     if "clients" not in raw or not isinstance(raw["clients"], list):
         raise ValueError("Missing or invalid 'clients' list")
 
-    if "nut" not in raw or "ups" not in raw["nut"]:
+    if "nut" not in raw or not raw["nut"]:
         raise ValueError("Missing required field: 'nut.ups'")
 
+    ups_labels = set()
+    for i, raw_nut in enumerate(_as_list(raw["nut"])):
+        if not isinstance(raw_nut, dict) or "ups" not in raw_nut:
+            raise ValueError("Missing required field: 'nut.ups'")
+        label = raw_nut.get("name") or raw_nut["ups"]
+        if label in ups_labels:
+            raise ValueError(f"UPS #{i} has a duplicate name: '{label}'")
+        ups_labels.add(label)
+
+    probe_method = raw.get("probe", {}).get("method", DEFAULT_PROBE_METHOD)
+    if probe_method not in PROBE_METHODS:
+        raise ValueError(
+            f"Invalid probe method '{probe_method}', expected one of {', '.join(PROBE_METHODS)}"
+        )
+
+    log_format = raw.get("log_format", DEFAULT_LOG_FORMAT)
+    if log_format not in LOG_FORMATS:
+        raise ValueError(
+            f"Invalid log format '{log_format}', expected one of {', '.join(LOG_FORMATS)}"
+        )
+
+    _validate_retry_policy("wake_on", _wake_on_retry_values(raw.get("wake_on", {})))
+    broadcast = raw.get("wake_on", {}).get("broadcast", "auto")
+    if broadcast != "auto":
+        _validate_broadcast("wake_on", broadcast)
+    retry_policies = raw.get("retry_policies", {})
+    if not isinstance(retry_policies, dict):
+        raise ValueError("'retry_policies' must map policy names to settings")
+    for name, values in retry_policies.items():
+        if not isinstance(values, dict):
+            raise ValueError(f"Retry policy '{name}' must be a mapping of settings")
+        for option in values:
+            if option not in RETRY_POLICY_OPTIONS:
+                raise ValueError(
+                    f"Retry policy '{name}' has unknown option: '{option}'"
+                )
+        _validate_retry_policy(f"Retry policy '{name}'", values)
+
     if "status_file" not in raw:
         logger.warning("No 'status_file' specified in config, using default.")
 
+    client_names = {client.get("name") for client in raw["clients"]}
     for i, client in enumerate(raw["clients"]):
         if "name" not in client:
             raise ValueError(f"Client #{i} is missing required field: 'name'")
@@ -148,6 +528,38 @@ def validate_config(raw: dict):
                 f"Client '{client['name']}' is missing required field: 'mac'"
             )
 
+        for ups in _as_list(client.get("ups", [])):
+            if ups not in ups_labels:
+                raise ValueError(
+                    f"Client '{client['name']}' is bound to unknown UPS: '{ups}'"
+                )
+
+        retry_policy = client.get("retry_policy")
+        if retry_policy is not None and retry_policy not in retry_policies:
+            raise ValueError(
+                f"Client '{client['name']}' uses unknown retry policy: '{retry_policy}'"
+            )
+
+        if client.get("broadcast") is not None:
+            _validate_broadcast(f"Client '{client['name']}'", client["broadcast"])
+        if client.get("wol_transport", "udp") not in WOL_TRANSPORTS:
+            raise ValueError(
+                f"Client '{client['name']}' has an invalid wol_transport, "
+                f"expected one of {', '.join(WOL_TRANSPORTS)}"
+            )
+        interface = client.get("interface")
+        if interface is not None and (not isinstance(interface, str) or not interface):
+            raise ValueError(f"Client '{client['name']}' has an invalid interface")
+
+        for check in client.get("readiness", []):
+            _validate_readiness_check(client["name"], check)
+
+        for dependency in _as_list(client.get("depends_on", [])):
+            if dependency not in client_names:
+                raise ValueError(
+                    f"Client '{client['name']}' depends on unknown client: '{dependency}'"
+                )
+
         mac = client["mac"]
         if not isinstance(mac, str):
             raise ValueError(
@@ -157,3 +569,12 @@ def validate_config(raw: dict):
             raise ValueError(
                 f"Client '{client['name']}' has invalid MAC address format: {mac}"
             )
+
+    cycle = find_cycle(
+        {
+            client["name"]: _as_list(client.get("depends_on", []))
+            for client in raw["clients"]
+        }
+    )
+    if cycle:
+        raise ValueError(f"Client dependencies form a cycle: {' -> '.join(cycle)}")
@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger("wolnut")
+
+DEFAULT_CONTROL_SOCKET = "/run/wolnut/control.sock"
+CONTROL_COMMANDS = ("status", "wake", "probe", "reset")
+DEFAULT_CONTROL_TIMEOUT = 10
+_MAX_REQUEST_SIZE = 64 * 1024
+
+
+class ControlError(Exception):
+    """The daemon rejected a control request."""
+
+
+@dataclass
+class ControlRequest:
+    command: str
+    args: dict = field(default_factory=dict)
+    response: Optional[dict] = None
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def reply(self, result: Any):
+        self.response = {"ok": True, "result": result}
+        self._done.set()
+
+    def fail(self, error: str):
+        self.response = {"ok": False, "error": error}
+        self._done.set()
+
+    def wait(self, timeout: float) -> bool:
+        return self._done.wait(timeout)
+
+
+def parse_request(data: bytes) -> ControlRequest:
+    """
+    Parses a `{"command": ..., "args": {...}}` request.
+
+    Raises:
+        ValueError: If the request is malformed or the command is unknown.
+    """
+    request = json.loads(data.decode("utf-8"))
+    if not isinstance(request, dict):
+        raise ValueError("Expected a JSON object")
+    command = request.get("command")
+    if command not in CONTROL_COMMANDS:
+        raise ValueError(f"Unknown command: {command}")
+    args = request.get("args")
+    if args is None:
+        args = {}
+    if not isinstance(args, dict):
+        raise ValueError("Expected args to be a JSON object")
+    return ControlRequest(command, args)
+
+
+def send_request(
+    socket_path: str,
+    command: str,
+    timeout: float = 2 * DEFAULT_CONTROL_TIMEOUT,  # Outlasts the server's timeout
+    **args,
+) -> Any:
+    """
+    Sends a command to a running WOLNUT daemon and waits for its answer.
+
+    Returns:
+        Any: The command's result.
+
+    Raises:
+        ControlError: If the daemon rejected the request.
+        OSError: If the daemon's socket cannot be reached or doesn't answer.
+    """
+    request = json.dumps({"command": command, "args": args}) + "\n"
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(request.encode("utf-8"))
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise OSError("The daemon closed the connection without answering")
+    response = json.loads(line)
+    if not response.get("ok"):
+        raise ControlError(response.get("error", "Unknown error"))
+    return response.get("result")
+
+
+class ControlServer:
+    """
+    Serves control requests, such as `wolnut status`, on a Unix socket.
+
+    Each connection carries one JSON request line and gets one JSON
+    response line. Requests are queued for the control loop, which owns
+    the daemon's state, and `on_request` is called so the loop can be
+    woken up to answer them straight away.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        on_request: Callable[[], None] = None,
+        timeout: float = DEFAULT_CONTROL_TIMEOUT,
+    ):
+        self.socket_path = socket_path
+        self.on_request = on_request
+        self.timeout = timeout
+        self.requests: "queue.Queue[ControlRequest]" = queue.Queue()
+        self._sock: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+
+        self._stopping.clear()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.socket_path)
+        # Anyone who can connect can send WOL packets
+        os.chmod(self.socket_path, 0o660)
+        self._sock.listen()
+        self._thread = threading.Thread(
+            target=self._serve, name="control-server", daemon=True
+        )
+        self._thread.start()
+        logger.info("Listening for control requests on %s", self.socket_path)
+
+    def stop(self):
+        if self._sock is None:
+            return
+        self._stopping.set()
+        # Unblock the server thread's accept
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self._sock = None
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+    def _serve(self):
+        while not self._stopping.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    self._handle(conn)
+                except OSError as e:
+                    logger.debug("Control connection failed: %s", e)
+
+    def _handle(self, conn: socket.socket):
+        conn.settimeout(self.timeout)
+        with conn.makefile("rb") as f:
+            data = f.readline(_MAX_REQUEST_SIZE)
+        try:
+            request = parse_request(data)
+        except ValueError as e:
+            request = ControlRequest("invalid")
+            request.fail(f"Invalid request: {e}")
+        else:
+            logger.debug("Received control request: %s", request.command)
+            self.requests.put(request)
+            if self.on_request is not None:
+                self.on_request()
+            if not request.wait(self.timeout):
+                request.fail("The daemon did not answer in time")
+        conn.sendall((json.dumps(request.response) + "\n").encode("utf-8"))
+
+    def drain(self) -> list[ControlRequest]:
+        """Returns and removes every request received since the last call."""
+        requests = []
+        while True:
+            try:
+                requests.append(self.requests.get_nowait())
+            except queue.Empty:
+                return requests
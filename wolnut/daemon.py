@@ -0,0 +1,1158 @@
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from wolnut.clock import SYSTEM_CLOCK, Clock
+from wolnut.config import ClientConfig, NutConfig, WolnutConfig, load_config
+from wolnut.control import ControlRequest, ControlServer
+from wolnut.events import PowerEvent, PowerEventListener
+from wolnut.metrics import (
+    BATTERY_PERCENT,
+    CLIENTS_DOWN,
+    LOOP_SECONDS,
+    PROBE_RTT_SECONDS,
+    PROBES,
+    UPS_POLL_SECONDS,
+    WOL_PACKETS,
+    start_metrics_server,
+)
+from wolnut.monitor import get_ups_status, probe_rtts
+from wolnut.neighbors import NeighborTable, normalize_mac
+from wolnut.nut import UPS_LOAD_VAR, UPS_STATUS_VARS, NutClient, parse_ups_name
+from wolnut.planner import WakePlanner
+from wolnut.probe_policy import ProbePolicy
+from wolnut.readiness import check_readiness
+from wolnut.scheduler import DeadlineScheduler
+from wolnut.state import ClientStateTracker
+from wolnut.wol import WolTarget, send_wol_packets
+
+logger = logging.getLogger("wolnut")
+
+ON_BATTERY_POLL_INTERVAL = 2
+
+# Scheduler keys, the per-UPS ones are suffixed with ":<ups label>"
+POLL = "poll"
+PROBE = "probe"
+RESTORE_DELAY = "restore_delay"
+CLIENT_TIMEOUT = "client_timeout"
+WAVE_TIMEOUT = "wave_timeout"
+WOL_RETRY_PREFIX = "wol_retry:"
+UNIT_KEYS = (RESTORE_DELAY, CLIENT_TIMEOUT, WAVE_TIMEOUT)
+
+# Options that are only read at startup, a reload keeps their current values
+RESTART_ONLY_OPTIONS = (
+    "status_file",
+    "event_socket",
+    "event_socket_group",
+    "control_socket",
+    "trace_file",
+    "metrics",
+    "state",
+    "log_format",
+    "log_rate_limit_sec",
+)
+
+
+def get_battery_percent(ups_status):
+    return round(float(ups_status.get("battery.charge", 100)))
+
+
+class UpsUnit:
+    """
+    Power-loss / restoration state for one UPS and the clients it powers.
+    """
+
+    def __init__(
+        self, nut: NutConfig, clients: list[ClientConfig], nut_client: NutClient
+    ):
+        self.label = nut.label
+        self.ups_name, _, _ = parse_ups_name(nut.ups, nut.hostname, nut.port)
+        self.nut_client = nut_client
+        self.clients = clients
+        self.client_names = [client.name for client in clients]
+        self.wake_budget = nut.wake_budget
+        self.max_load_percent = nut.max_load_percent
+        self.status_vars = UPS_STATUS_VARS
+        if self.max_load_percent is not None:
+            self.status_vars += (UPS_LOAD_VAR,)
+
+        self.on_battery = False
+        self.recorded_down_clients = set()
+        self.recorded_up_clients = set()
+        self.battery_percent = 100
+        self.power_status = "OL"
+        self.load_percent = None
+        self.poll_latency = None  # Seconds the last poll took
+        self.restoration_event = False
+        self.restoration_event_start = None
+        self.wol_being_sent = False
+        self.woken_clients = set()  # Clients released in a wake wave
+        self.wave = set()
+        self.wave_started_at = None
+
+    def key(self, name: str) -> str:
+        return f"{name}:{self.label}"
+
+    @property
+    def phase(self) -> str:
+        """The state machine's phase, as reported in structured logs."""
+        if self.restoration_event:
+            return "restoring"
+        return "on_battery" if self.on_battery else "online"
+
+    def log_extra(self, **fields) -> dict:
+        return {"ups": self.label, "phase": self.phase, **fields}
+
+    def update_status(self, ups_status: dict):
+        self.battery_percent = get_battery_percent(ups_status)
+        self.power_status = ups_status.get("ups.status", "OL")
+        load = ups_status.get(UPS_LOAD_VAR)
+        self.load_percent = float(load) if load is not None else None
+        BATTERY_PERCENT.set(self.battery_percent, ups=self.label)
+
+    def apply_event(self, event: PowerEvent):
+        """
+        Applies an event pushed by upsmon.
+
+        upsmon only notifies after upsd has changed state, so an event is
+        at least as fresh as our last poll. It takes precedence for this
+        step; the poll remains a fallback and a consistency check.
+        """
+        if event.status_flag in self.power_status.split():
+            return
+
+        logger.debug(
+            "upsmon reported %s for %s while upsd reports %s",
+            event.type,
+            self.label,
+            self.power_status,
+        )
+        if event.status_flag == "OL":
+            self.power_status = "OL"
+        elif event.status_flag == "LB":
+            self.power_status = "OB LB"
+        else:
+            self.power_status = "OB"
+
+    def adopt(self, previous: "UpsUnit"):
+        """Carries the power state of a UPS over a configuration reload."""
+        names = set(self.client_names)
+        self.on_battery = previous.on_battery
+        self.battery_percent = previous.battery_percent
+        self.power_status = previous.power_status
+        self.load_percent = previous.load_percent
+        self.restoration_event = previous.restoration_event
+        self.restoration_event_start = previous.restoration_event_start
+        self.wol_being_sent = previous.wol_being_sent
+        self.recorded_down_clients = previous.recorded_down_clients & names
+        self.recorded_up_clients = previous.recorded_up_clients & names
+        self.woken_clients = previous.woken_clients & names
+        self.wave = previous.wave & names
+        self.wave_started_at = previous.wave_started_at
+
+    def end_restoration(self):
+        self.restoration_event = False
+        self.restoration_event_start = None
+        self.wol_being_sent = False
+        self.woken_clients.clear()
+        self.wave.clear()
+        self.wave_started_at = None
+
+
+class WolnutDaemon:
+    """
+    The WOLNUT control loop.
+
+    Each `step` polls every UPS, probes the clients that are due and
+    advances each UPS's power-loss / restoration state machine, then
+    schedules the next moment anything can change: the next UPS poll or
+    probe, the end of each restore delay, each client's WOL retry and each
+    client timeout. `run` sleeps until the earliest of those instead of a
+    fixed interval.
+    """
+
+    def __init__(
+        self,
+        config: WolnutConfig,
+        scheduler: DeadlineScheduler = None,
+        clock: Clock = None,
+        recorder=None,
+    ):
+        self.config = config
+        if clock is None:
+            clock = scheduler.clock if scheduler is not None else SYSTEM_CLOCK
+        self.clock = clock
+        self.scheduler = scheduler or DeadlineScheduler(clock)
+        self.recorder = recorder  # Records UPS and probe readings, see wolnut.trace
+        self.planner = WakePlanner(config.clients)
+        self.retry_policies = self._build_retry_policies(config)
+        self.probe_policy = ProbePolicy(
+            config.probe.idle_interval_sec, config.probe.wol_backoff_sec
+        )
+        self.event_listener = None
+        self.control_server = None
+        self.neighbors = None  # The kernel neighbor table, with probe.passive
+        self._nut_clients = {}
+        self._reload_lock = threading.Lock()
+        self._reload_thread = None
+        self._reloaded_config = None
+        self.units = self._build_units(config)
+
+        self.state_tracker = ClientStateTracker(
+            config.clients,
+            status_file=config.status_file,
+            journal=config.state.journal,
+            compact_every=config.state.compact_every,
+            clock=clock,
+        )
+        for unit in self.units:
+            if self.state_tracker.was_ups_on_battery(unit.label):
+                logger.info(
+                    "WOLNUT is resuming from a UPS battery event on %s", unit.label
+                )
+                unit.restoration_event = True
+                self.state_tracker.reset(unit.client_names, ups=unit.label)
+
+    @staticmethod
+    def _build_retry_policies(config: WolnutConfig) -> dict:
+        # Clients without a named policy use the wake_on settings, under None
+        return {None: config.wake_on.retry_policy(), **config.retry_policies}
+
+    def _build_units(self, config: WolnutConfig) -> list[UpsUnit]:
+        """Builds the UPS units, reusing the current upsd connections."""
+        # UPS units on the same upsd share one connection
+        nut_clients = {}
+        units = []
+        for nut in config.nut:
+            ups_name, host, port = parse_ups_name(nut.ups, nut.hostname, nut.port)
+            connection = (host, port, nut.username, nut.password)
+            if nut.login:
+                # upsd accepts a single LOGIN per connection
+                connection += (ups_name,)
+            if connection not in nut_clients:
+                nut_clients[connection] = self._nut_clients.get(
+                    connection
+                ) or NutClient(
+                    host,
+                    port,
+                    timeout=nut.timeout,
+                    username=nut.username,
+                    password=nut.password,
+                    login_ups=ups_name if nut.login else None,
+                )
+            clients = [
+                client
+                for client in config.clients
+                if not client.ups or nut.label in client.ups
+            ]
+            units.append(UpsUnit(nut, clients, nut_clients[connection]))
+
+        for connection, nut_client in self._nut_clients.items():
+            if connection not in nut_clients:
+                nut_client.close()
+        self._nut_clients = nut_clients
+        return units
+
+    def request_reload(self, config_file: str, verbose: bool = False):
+        """
+        Reloads the configuration file in the background, e.g. on SIGHUP.
+
+        Loading may have to resolve MAC addresses, so it runs off the loop
+        thread and the new configuration is applied by the next step.
+        """
+        if self._reload_thread is not None and self._reload_thread.is_alive():
+            logger.info("A configuration reload is already in progress")
+            return
+        self._reload_thread = threading.Thread(
+            target=self._load_config,
+            args=(config_file, verbose),
+            name="config-reload",
+            daemon=True,
+        )
+        self._reload_thread.start()
+
+    def _load_config(self, config_file: str, verbose: bool):
+        logger.info("Reloading configuration from %s", config_file)
+        config = load_config(
+            config_file,
+            status_path=self.config.status_file,
+            verbose=verbose,
+            known_macs={client.host: client.mac for client in self.config.clients},
+        )
+        if config is None:
+            logger.error("Keeping the current configuration")
+            return
+        with self._reload_lock:
+            self._reloaded_config = config
+        self.scheduler.wake()
+
+    def apply_config(self, config: WolnutConfig):
+        """
+        Switches to a reloaded configuration without interrupting an outage.
+
+        Clients and UPS units are matched by name. Unchanged clients keep
+        their current settings and every client that is still configured
+        keeps its tracked state, so a restoration in progress carries on
+        with the new client list.
+        """
+        old = self.config
+        for option in RESTART_ONLY_OPTIONS:
+            if getattr(config, option) != getattr(old, option):
+                logger.warning(
+                    "Changing %s requires a restart, keeping the current value",
+                    option,
+                )
+                setattr(config, option, getattr(old, option))
+
+        current = {client.name: client for client in old.clients}
+        clients = []
+        added, changed = [], []
+        for client in config.clients:
+            previous = current.pop(client.name, None)
+            if previous is None:
+                added.append(client.name)
+            elif previous != client:
+                changed.append(client.name)
+            else:
+                # The local subnets may have changed since the last load
+                previous.wol_target = client.wol_target
+                client = previous
+            clients.append(client)
+        removed = list(current)
+        config.clients = clients
+        logger.info(
+            "Configuration reloaded. Added: %s. Removed: %s. Changed: %s.",
+            ", ".join(added) or "none",
+            ", ".join(removed) or "none",
+            ", ".join(changed) or "none",
+        )
+
+        self.config = config
+        self.planner = WakePlanner(clients)
+        self.retry_policies = self._build_retry_policies(config)
+        self.probe_policy.idle_interval = config.probe.idle_interval_sec
+        self.probe_policy.backoff = config.probe.wol_backoff_sec
+        self.probe_policy.forget(removed)
+        for name in removed:
+            self.scheduler.cancel(WOL_RETRY_PREFIX + name)
+        if config.probe.passive != old.probe.passive:
+            self.stop_neighbor_table()
+            self.start_neighbor_table()
+        elif self.neighbors is not None:
+            self.neighbors.failed_ttl = config.probe.passive_failed_ttl_sec
+        self.state_tracker.sync_clients([client.name for client in clients])
+
+        previous_units = {unit.label: unit for unit in self.units}
+        self.units = self._build_units(config)
+        for unit in self.units:
+            if unit.label in previous_units:
+                unit.adopt(previous_units.pop(unit.label))
+        for unit in previous_units.values():
+            for name in UNIT_KEYS:
+                self.scheduler.cancel(unit.key(name))
+            self.state_tracker.set_ups_on_battery(False, ups=unit.label)
+
+        if config.log_level != old.log_level:
+            logger.setLevel(config.log_level)
+
+    def poll_ups(self):
+        """Polls every UPS, one thread per upsd connection."""
+        by_connection = {}
+        for unit in self.units:
+            by_connection.setdefault(id(unit.nut_client), []).append(unit)
+        groups = list(by_connection.values())
+
+        def poll_group(units):
+            for unit in units:
+                self.poll_unit(unit)
+
+        if len(groups) == 1:
+            poll_group(groups[0])
+            return
+
+        with ThreadPoolExecutor(
+            max_workers=len(groups), thread_name_prefix="ups-poll"
+        ) as pool:
+            list(pool.map(poll_group, groups))
+
+    def poll_unit(self, unit: UpsUnit):
+        started = time.perf_counter()
+        with UPS_POLL_SECONDS.time(ups=unit.label):
+            ups_status = self.read_ups_status(unit)
+        unit.poll_latency = time.perf_counter() - started
+        if self.recorder is not None:
+            self.recorder.record_ups(unit.label, ups_status, self.clock.time())
+        unit.update_status(ups_status)
+
+    def read_ups_status(self, unit: UpsUnit) -> dict:
+        return get_ups_status(unit.nut_client, unit.ups_name, unit.status_vars)
+
+    def read_probe_rtts(self, hosts: list[str]) -> dict:
+        return probe_rtts(
+            hosts,
+            max_concurrency=self.config.probe.max_concurrency,
+            timeout=self.config.probe.timeout_sec,
+            method=self.config.probe.method,
+        )
+
+    def check_readiness(self, clients: list[ClientConfig]) -> dict[str, bool]:
+        return check_readiness(
+            {client.name: (client.host, client.readiness) for client in clients},
+            max_concurrency=self.config.probe.max_concurrency,
+        )
+
+    def transmit_wol(
+        self, packets: dict[str, bytes], targets: dict[str, WolTarget]
+    ) -> dict[str, bool]:
+        return send_wol_packets(
+            packets,
+            targets=targets,
+            burst_count=self.config.wake_on.burst_count,
+            burst_interval=self.config.wake_on.burst_interval_ms / 1000,
+        )
+
+    def apply_power_events(self):
+        """Applies events pushed by upsmon since the last step."""
+        if self.event_listener is None:
+            return
+
+        for event in self.event_listener.drain():
+            event_ups = event.ups.partition("@")[0] if event.ups else None
+            matched = False
+            for unit in self.units:
+                if event_ups is None or event_ups in (unit.ups_name, unit.label):
+                    unit.apply_event(event)
+                    matched = True
+            if not matched:
+                logger.debug("Ignoring %s event for UPS %s", event.type, event.ups)
+
+    def probe(self, clients: list[ClientConfig] = None):
+        """
+        Probes clients in one parallel sweep that serves every UPS.
+
+        Args:
+            clients (list | None): The clients to probe, defaults to all of them.
+        """
+        if clients is None:
+            clients = self.config.clients
+        if not clients:
+            return
+        now = self.clock.time()
+        passive = {}
+        if self.neighbors is not None:
+            for client in clients:
+                online = self.neighbors.liveness(client.host, client.mac)
+                if online is not None:
+                    passive[client.host] = online
+        hosts = [c.host for c in clients if c.host not in passive]
+        hosts = list(dict.fromkeys(hosts))
+        rtts = self.read_probe_rtts(hosts) if hosts else {}
+        PROBES.inc(len(hosts), source="active")
+        PROBES.inc(len(passive), source="passive")
+        if self.recorder is not None:
+            # Passively seen hosts are replayed as instant answers
+            seen = {host: 0.0 if online else None for host, online in passive.items()}
+            self.recorder.record_probe({**rtts, **seen}, now)
+        results = {}
+        for client in clients:
+            if client.host in passive:
+                results[client.name] = passive[client.host]
+                continue
+            rtt = rtts[client.host]
+            results[client.name] = rtt is not None
+            if rtt is not None:
+                PROBE_RTT_SECONDS.observe(rtt, client=client.name)
+        self.probe_policy.probed(results, now)
+        self.state_tracker.update_many(results)
+
+        # Clients without readiness checks are ready as soon as they answer
+        ready = {c.name: results[c.name] for c in clients if not c.readiness}
+        to_check = []
+        for client in clients:
+            if client.readiness:
+                if results[client.name]:
+                    to_check.append(client)
+                else:
+                    ready[client.name] = False
+        if to_check:
+            ready.update(self.check_readiness(to_check))
+            if self.recorder is not None:
+                self.recorder.record_ready(
+                    {client.name: ready[client.name] for client in to_check}, now
+                )
+        self.state_tracker.update_ready_many(ready)
+
+    def _clients_to_probe(self) -> list[ClientConfig]:
+        """
+        Picks the clients worth probing this step from each UPS's phase.
+
+        A UPS switching to battery gets an immediate sweep of all its clients
+        for the pre-outage snapshot. While a UPS is being restored its
+        clients are probed every step, except those that are skipped or
+        still booting after a WOL packet, unless their neighbor entry just
+        changed. Everything else is only swept every
+        `probe.idle_interval_sec`.
+        """
+        now = self.clock.time()
+        tracker = self.state_tracker
+        changed = self.neighbors.drain_changes() if self.neighbors else set()
+        snapshot, restoring = set(), set()
+        for unit in self.units:
+            if "OB" in unit.power_status and not unit.on_battery:
+                snapshot.update(unit.client_names)
+            elif unit.restoration_event or (
+                "OL" in unit.power_status and unit.on_battery
+            ):
+                restoring.update(unit.client_names)
+
+        idle_sweep = self.probe_policy.idle_sweep_due(now)
+        if idle_sweep:
+            self.probe_policy.idle_swept(now)
+
+        clients = []
+        for client in self.config.clients:
+            name = client.name
+            if name in snapshot:
+                clients.append(client)
+            elif name in restoring:
+                if tracker.should_skip(name):
+                    continue
+                # Always check a client before sending it another WOL packet
+                if (
+                    self.probe_policy.due(name, now)
+                    or tracker.should_attempt_wol(name)
+                    or (changed and self._neighbor_changed(client, changed))
+                ):
+                    clients.append(client)
+            elif idle_sweep:
+                clients.append(client)
+        return clients
+
+    @staticmethod
+    def _neighbor_changed(client: ClientConfig, changed: set[str]) -> bool:
+        return client.host in changed or normalize_mac(client.mac) in changed
+
+    def step(self):
+        """Runs one iteration of the control loop and schedules the next one."""
+        with self._reload_lock:
+            config, self._reloaded_config = self._reloaded_config, None
+        # Apply refreshed MACs before a reload swaps out the queue they're in
+        self.config.apply_mac_updates()
+        if config is not None:
+            self.apply_config(config)
+        with LOOP_SECONDS.time():
+            self._step()
+        self._schedule_next()
+
+    def _step(self):
+        self.poll_ups()
+        self.apply_power_events()
+        if logger.isEnabledFor(logging.DEBUG):
+            for unit in self.units:
+                logger.debug(
+                    "UPS %s power status: %s, Battery: %s%%",
+                    unit.label,
+                    unit.power_status,
+                    unit.battery_percent,
+                    extra=unit.log_extra(
+                        latency_ms=round((unit.poll_latency or 0) * 1000, 1)
+                    ),
+                )
+        self.probe(self._clients_to_probe())
+
+        clients_to_wake = {}
+        for unit in self.units:
+            self._advance(unit, clients_to_wake)
+        self._send_wol(list(clients_to_wake.values()))
+
+        CLIENTS_DOWN.set(
+            len(set().union(*(unit.recorded_down_clients for unit in self.units)))
+        )
+        self.state_tracker.save_state()
+
+    def _advance(self, unit: UpsUnit, clients_to_wake: dict):
+        tracker = self.state_tracker
+
+        # Power Loss Event
+        if "OB" in unit.power_status and not unit.on_battery:
+            tracker.mark_all_online_clients(unit.client_names)
+            tracker.set_ups_on_battery(True, unit.battery_percent, ups=unit.label)
+            unit.on_battery = True
+            logger.warning(
+                "UPS %s switched to battery power.", unit.label, extra=unit.log_extra()
+            )
+
+        # Power Restoration Event
+        elif ("OL" in unit.power_status and unit.on_battery) or unit.restoration_event:
+            unit.on_battery = False
+            unit.restoration_event = True
+
+            if not unit.restoration_event_start:
+                unit.restoration_event_start = self.clock.time()
+
+            self._handle_restoration(unit, clients_to_wake)
+
+        elif not unit.on_battery and not unit.restoration_event:
+            self._reset_clients(unit)
+            tracker.set_ups_on_battery(False, ups=unit.label)
+            unit.recorded_down_clients.clear()
+            unit.recorded_up_clients.clear()
+
+    def _reset_clients(self, unit: UpsUnit):
+        """
+        Clears the outage state of a unit and of its clients.
+
+        Clients are often powered by several UPS units, so the ones that
+        another unit on battery or restoring still needs are left alone.
+        """
+        in_outage = {
+            name
+            for other in self.units
+            if other is not unit and (other.on_battery or other.restoration_event)
+            for name in other.client_names
+        }
+        self.state_tracker.reset(
+            [name for name in unit.client_names if name not in in_outage],
+            ups=unit.label,
+        )
+
+    def _handle_restoration(self, unit: UpsUnit, clients_to_wake: dict):
+        config = self.config
+        elapsed = self.clock.time() - unit.restoration_event_start
+
+        if unit.battery_percent < config.wake_on.min_battery_percent:
+            logger.info(
+                "Power restored on %s, but battery still below minimum percentage (%s%%/%s%%). Waiting...",
+                unit.label,
+                unit.battery_percent,
+                config.wake_on.min_battery_percent,
+                extra=unit.log_extra(log_key=unit.key("low_battery")),
+            )
+            return
+
+        if elapsed < config.wake_on.restore_delay_sec:
+            logger.info(
+                "Power restored on %s, waiting %s seconds before waking clients...",
+                unit.label,
+                int(config.wake_on.restore_delay_sec - elapsed),
+                extra=unit.log_extra(log_key=unit.key(RESTORE_DELAY)),
+            )
+            return
+
+        if not unit.wol_being_sent:
+            logger.info(
+                "Power restored on %s and battery >= %s%%. Preparing to send WOL...",
+                unit.label,
+                config.wake_on.min_battery_percent,
+                extra=unit.log_extra(),
+            )
+            unit.wol_being_sent = True
+
+        self._collect_clients_to_wake(unit, clients_to_wake)
+
+        if len(unit.recorded_down_clients) == 0:
+            logger.info(
+                "Power Restored on %s and all clients are back online!",
+                unit.label,
+                extra=unit.log_extra(),
+            )
+            self._end_restoration(unit)
+            self._reset_clients(unit)
+        elif self.clock.time() - unit.restoration_event_start > (
+            config.wake_on.client_timeout_sec
+        ):
+            logger.warning(
+                "Some devices on %s failed to come back online within the timeout period.",
+                unit.label,
+                extra=unit.log_extra(),
+            )
+            for client in unit.recorded_down_clients:
+                logger.warning(
+                    (
+                        "%s answers probes but failed its readiness checks within timeout period."
+                        if self.state_tracker.is_online(client)
+                        else "%s failed to come back online within timeout period."
+                    ),
+                    client,
+                    extra=unit.log_extra(client=client),
+                )
+            self._end_restoration(unit)
+
+    def _end_restoration(self, unit: UpsUnit):
+        unit.end_restoration()
+        self.probe_policy.forget(unit.client_names)
+        for name in unit.client_names:
+            self.scheduler.cancel(WOL_RETRY_PREFIX + name)
+
+    def _collect_clients_to_wake(self, unit: UpsUnit, clients_to_wake: dict):
+        tracker = self.state_tracker
+        debug = logger.isEnabledFor(logging.DEBUG)
+        down_clients = []
+        for client in unit.clients:
+
+            if tracker.should_skip(client.name):
+                continue
+
+            if not tracker.was_online_before_shutdown(client.name):
+                logger.info(
+                    "Skipping WOL for %s: was not online before power loss",
+                    client.name,
+                    extra=unit.log_extra(client=client.name),
+                )
+                tracker.mark_skip(client.name)
+                continue
+
+            if tracker.is_ready(client.name):
+                if client.name not in unit.recorded_up_clients:
+                    logger.info(
+                        (
+                            "%s is online and ready."
+                            if client.readiness
+                            else "%s is online."
+                        ),
+                        client.name,
+                        extra=unit.log_extra(client=client.name),
+                    )
+                    unit.recorded_down_clients.discard(client.name)
+                    unit.recorded_up_clients.add(client.name)
+                    self.scheduler.cancel(WOL_RETRY_PREFIX + client.name)
+                continue
+
+            unit.recorded_down_clients.add(client.name)
+            down_clients.append(client)
+
+        ready_clients = self.planner.ready(down_clients, self._dependency_satisfied)
+        self._release_wave(unit, ready_clients, down_clients)
+
+        for client in down_clients:
+            if client.name in clients_to_wake or client.name not in unit.woken_clients:
+                continue
+            if tracker.is_online(client.name):
+                # It has booted, WOL can't make its services start any sooner
+                if debug:
+                    logger.debug(
+                        "%s answers probes but is not ready yet",
+                        client.name,
+                        extra=unit.log_extra(client=client.name),
+                    )
+                continue
+            policy = self.retry_policies[client.retry_policy]
+            if policy.exhausted(tracker.wol_attempts(client.name)):
+                continue
+            if tracker.should_attempt_wol(client.name):
+                logger.info(
+                    "Sending WOL packet to %s at %s",
+                    client.name,
+                    client.mac,
+                    extra=unit.log_extra(client=client.name),
+                )
+                clients_to_wake[client.name] = client
+            elif debug:
+                logger.debug(
+                    "Waiting to retry WOL for %s (delay not reached)",
+                    client.name,
+                    extra=unit.log_extra(client=client.name),
+                )
+
+    def _dependency_satisfied(self, name: str) -> bool:
+        # Only wait for dependencies that are expected to come back
+        tracker = self.state_tracker
+        return (
+            tracker.is_ready(name)
+            or tracker.should_skip(name)
+            or not tracker.was_online_before_shutdown(name)
+        )
+
+    def _release_wave(
+        self,
+        unit: UpsUnit,
+        ready_clients: list[ClientConfig],
+        down_clients: list[ClientConfig],
+    ):
+        """
+        Releases the next wave of down clients whose dependencies are online.
+
+        A wave holds as many clients, in wake order, as fit in the UPS's
+        wake budget. The next wave starts once every client of the previous
+        one is online or the wave timeout expires, and only while the UPS
+        load is below `max_load_percent`, so booting clients do not overload
+        the recovering UPS. Without a wake budget there are no waves, and
+        each client is released as soon as its dependencies are online.
+        """
+        waiting = [c for c in ready_clients if c.name not in unit.woken_clients]
+        if not waiting:
+            return
+
+        now = self.clock.time()
+        down_names = {client.name for client in down_clients}
+        if (
+            unit.wake_budget is not None
+            and unit.wave & down_names
+            and now - unit.wave_started_at < self.config.wake_on.wave_timeout_sec
+        ):
+            return
+
+        if (
+            unit.max_load_percent is not None
+            and unit.load_percent is not None
+            and unit.load_percent > unit.max_load_percent
+        ):
+            logger.info(
+                "Holding back the next wake wave on %s: load %s%% is above %s%%",
+                unit.label,
+                unit.load_percent,
+                unit.max_load_percent,
+                extra=unit.log_extra(log_key=unit.key("wave_load")),
+            )
+            return
+
+        wave = []
+        weight = 0.0
+        for client in waiting:
+            if (
+                unit.wake_budget is not None
+                and wave
+                and weight + client.power_weight > unit.wake_budget
+            ):
+                break
+            wave.append(client.name)
+            weight += client.power_weight
+
+        if unit.wake_budget is not None:
+            logger.info(
+                "Waking %s of %s clients on %s (power %s/%s)",
+                len(wave),
+                len(waiting),
+                unit.label,
+                weight,
+                unit.wake_budget,
+                extra=unit.log_extra(),
+            )
+        unit.wave = set(wave)
+        unit.woken_clients.update(wave)
+        unit.wave_started_at = now
+
+    def _transmit(self, clients: list[ClientConfig]) -> list[ClientConfig]:
+        """Sends WOL packets without counting them as retry attempts."""
+        if not clients:
+            return []
+        # Keyed by name, as clients with an unresolved MAC share "auto"
+        sent = self.transmit_wol(
+            {client.name: client.magic_packet for client in clients},
+            {client.name: client.wol_target for client in clients},
+        )
+        sent_clients = [client for client in clients if sent[client.name]]
+        now = self.clock.time()
+        for client in sent_clients:
+            self.probe_policy.wol_sent(client.name, client.boot_time_sec, now)
+        WOL_PACKETS.inc(len(sent_clients), result="sent")
+        WOL_PACKETS.inc(len(clients) - len(sent_clients), result="failed")
+        return sent_clients
+
+    def _send_wol(self, clients: list[ClientConfig]):
+        sent_clients = self._transmit(clients)
+        if not sent_clients:
+            return
+        now = self.clock.time()
+        retry_delays = {}
+        for client in sent_clients:
+            policy = self.retry_policies[client.retry_policy]
+            attempt = self.state_tracker.wol_attempts(client.name) + 1
+            if policy.exhausted(attempt):
+                logger.warning(
+                    "Sent %s the last of its %s WOL packets",
+                    client.name,
+                    policy.max_attempts,
+                    extra={"client": client.name},
+                )
+                self.scheduler.cancel(WOL_RETRY_PREFIX + client.name)
+                continue
+            retry_delays[client.name] = policy.delay(attempt, client.boot_time_sec)
+            # Retries are due at a known time, no need to look for them every step
+            self.scheduler.schedule(
+                WOL_RETRY_PREFIX + client.name, now + retry_delays[client.name]
+            )
+        self.state_tracker.mark_wol_sent_many(
+            [client.name for client in sent_clients], retry_delays
+        )
+
+    def _schedule_next(self):
+        """Schedules every deadline that could change what the next step does."""
+        now = self.clock.time()
+        scheduler = self.scheduler
+
+        on_battery = any(unit.on_battery for unit in self.units)
+        interval = ON_BATTERY_POLL_INTERVAL if on_battery else self.config.poll_interval
+        scheduler.schedule(POLL, now + interval)
+        probe_at = self.probe_policy.next_probe_at(now)
+        if probe_at is not None:
+            scheduler.schedule(PROBE, probe_at)
+        else:
+            scheduler.cancel(PROBE)
+
+        for unit in self.units:
+            if unit.restoration_event:
+                self._schedule_restoration(unit, now)
+            else:
+                for name in UNIT_KEYS:
+                    scheduler.cancel(unit.key(name))
+
+        if self.neighbors is not None:
+            # Only wake up early for the clients being waited for
+            waiting = set().union(*(unit.recorded_down_clients for unit in self.units))
+            self.neighbors.watch(
+                (client.host, client.mac)
+                for client in self.config.clients
+                if client.name in waiting
+            )
+
+    def _schedule_restoration(self, unit: UpsUnit, now: float):
+        wake_on = self.config.wake_on
+        scheduler = self.scheduler
+
+        restore_at = unit.restoration_event_start + wake_on.restore_delay_sec
+        if restore_at > now:
+            scheduler.schedule(unit.key(RESTORE_DELAY), restore_at)
+        else:
+            scheduler.cancel(unit.key(RESTORE_DELAY))
+
+        if unit.wol_being_sent:
+            # Wake exactly at the timeout boundary (checked with ">")
+            scheduler.schedule(
+                unit.key(CLIENT_TIMEOUT),
+                unit.restoration_event_start + wake_on.client_timeout_sec + 0.001,
+            )
+            if (
+                unit.wake_budget is not None
+                and unit.wave_started_at
+                and unit.recorded_down_clients - unit.woken_clients
+            ):
+                scheduler.schedule(
+                    unit.key(WAVE_TIMEOUT),
+                    unit.wave_started_at + wake_on.wave_timeout_sec,
+                )
+            else:
+                scheduler.cancel(unit.key(WAVE_TIMEOUT))
+
+    def start_event_listener(self):
+        if not self.config.event_socket:
+            return
+        self.event_listener = PowerEventListener(
+            self.config.event_socket,
+            on_event=self.scheduler.wake,
+            group=self.config.event_socket_group,
+        )
+        try:
+            self.event_listener.start()
+        except OSError as e:
+            logger.error(
+                "Failed to listen for power events on %s, relying on polling: %s",
+                self.config.event_socket,
+                e,
+            )
+            self.event_listener = None
+
+    def start_neighbor_table(self):
+        if not self.config.probe.passive:
+            return
+        self.neighbors = NeighborTable(
+            on_change=self.scheduler.wake,
+            failed_ttl=self.config.probe.passive_failed_ttl_sec,
+            clock=self.clock,
+        )
+        try:
+            self.neighbors.start()
+        except OSError as e:
+            logger.error(
+                "Failed to follow the kernel neighbor table, probing actively: %s", e
+            )
+            self.neighbors = None
+
+    def stop_neighbor_table(self):
+        if self.neighbors is not None:
+            self.neighbors.stop()
+            self.neighbors = None
+
+    def start_control_server(self):
+        if not self.config.control_socket:
+            return
+        self.control_server = ControlServer(
+            self.config.control_socket, on_request=self.scheduler.wake
+        )
+        try:
+            self.control_server.start()
+        except OSError as e:
+            logger.error(
+                "Failed to listen for control requests on %s: %s",
+                self.config.control_socket,
+                e,
+            )
+            self.control_server = None
+
+    def handle_control_requests(self) -> bool:
+        """
+        Answers the control requests received since the last call.
+
+        Requests are answered between steps, so they see and change the
+        same state as the control loop without any locking.
+
+        Returns:
+            bool: Whether there were any requests.
+        """
+        if self.control_server is None:
+            return False
+        requests = self.control_server.drain()
+        for request in requests:
+            self._answer(request)
+        if requests:
+            self.state_tracker.save_state()
+            self._schedule_next()
+        return bool(requests)
+
+    def _answer(self, request: ControlRequest):
+        handlers = {
+            "status": self.control_status,
+            "wake": self.control_wake,
+            "probe": self.control_probe,
+            "reset": self.control_reset,
+        }
+        try:
+            result = handlers[request.command](**request.args)
+        except (TypeError, ValueError) as e:
+            request.fail(str(e))
+        except Exception:
+            logger.exception("Failed to answer control request: %s", request.command)
+            request.fail("Internal error, see the daemon's log")
+        else:
+            request.reply(result)
+
+    def _find_clients(self, targets: list[str]) -> list[ClientConfig]:
+        """Resolves client names, UPS labels and "all" to clients."""
+        units = {unit.label: unit for unit in self.units}
+        clients = {client.name: client for client in self.config.clients}
+        found = {}
+        for target in targets:
+            if target == "all":
+                found.update(clients)
+            elif target in clients:
+                found[target] = clients[target]
+            elif target in units:
+                found.update((client.name, client) for client in units[target].clients)
+            else:
+                raise ValueError(f"Unknown client or UPS: {target}")
+        return list(found.values())
+
+    def control_status(self) -> dict:
+        """Describes every UPS and client, as shown by `wolnut status`."""
+        ups_labels = {client.name: [] for client in self.config.clients}
+        ups = []
+        for unit in self.units:
+            for name in unit.client_names:
+                ups_labels[name].append(unit.label)
+            ups.append(
+                {
+                    "name": unit.label,
+                    "phase": unit.phase,
+                    "status": unit.power_status,
+                    "battery_percent": unit.battery_percent,
+                    "load_percent": unit.load_percent,
+                    "waiting_for": sorted(unit.recorded_down_clients),
+                }
+            )
+        clients = [
+            {
+                "name": client.name,
+                "host": client.host,
+                "mac": client.mac,
+                "ups": ups_labels[client.name],
+                **self.state_tracker.get_client_state(client.name),
+            }
+            for client in self.config.clients
+        ]
+        return {"ups": ups, "clients": clients}
+
+    def control_wake(self, targets: list[str]) -> dict[str, list[str]]:
+        """
+        Sends WOL packets now, whatever the power state.
+
+        These don't count towards a client's retry attempts during an outage.
+
+        Returns:
+            dict: The names of the clients whose packets were "sent" and of
+            those whose packets could not be sent ("failed").
+        """
+        clients = self._find_clients(targets)
+        for client in clients:
+            logger.info("Sending WOL packet to %s on request", client.name)
+        sent = {client.name for client in self._transmit(clients)}
+        return {
+            "sent": [client.name for client in clients if client.name in sent],
+            "failed": [client.name for client in clients if client.name not in sent],
+        }
+
+    def control_probe(self, targets: list[str] = None) -> dict[str, bool]:
+        """Probes clients now and returns which of them are online."""
+        clients = self._find_clients(targets or ["all"])
+        self.probe(clients)
+        return {
+            client.name: self.state_tracker.is_online(client.name) for client in clients
+        }
+
+    def control_reset(self, ups: list[str] = None) -> list[str]:
+        """
+        Forgets any outage in progress, as if power had never been lost.
+
+        If a UPS is still on battery, the next step notices and starts over.
+        """
+        labels = ups or [unit.label for unit in self.units]
+        units = {unit.label: unit for unit in self.units}
+        for label in labels:
+            if label not in units:
+                raise ValueError(f"Unknown UPS: {label}")
+        for label in labels:
+            unit = units[label]
+            logger.warning("Resetting the outage state of %s on request", label)
+            self._end_restoration(unit)
+            unit.on_battery = False
+            unit.recorded_down_clients.clear()
+            unit.recorded_up_clients.clear()
+            self._reset_clients(unit)
+        return labels
+
+    def run(self):
+        logger.info(
+            "WOLNUT started. Monitoring UPS: %s",
+            ", ".join(unit.label for unit in self.units),
+        )
+        self.start_event_listener()
+        self.start_control_server()
+        self.start_neighbor_table()
+        if self.config.metrics.enabled:
+            start_metrics_server(self.config.metrics.host, self.config.metrics.port)
+        self.poll_ups()
+        for unit in self.units:
+            logger.info(
+                "UPS %s power status: %s, Battery: %s%%",
+                unit.label,
+                unit.power_status,
+                unit.battery_percent,
+            )
+
+        while True:
+            self.step()
+            while True:
+                due = self.scheduler.wait()
+                # Control requests are answered without running a step
+                if self.handle_control_requests() and not (
+                    due or self._has_pending_events()
+                ):
+                    continue
+                break
+            logger.debug("Woke up for: %s", ", ".join(due) or "external event")
+
+    def _has_pending_events(self) -> bool:
+        return self._reloaded_config is not None or (
+            self.event_listener is not None and not self.event_listener.events.empty()
+        )
@@ -0,0 +1,162 @@
+import grp
+import logging
+import os
+import queue
+import socket
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+logger = logging.getLogger("wolnut")
+
+DEFAULT_EVENT_SOCKET = "/run/wolnut/events.sock"
+
+# upsmon NOTIFYTYPE -> the ups.status flag it implies
+POWER_EVENTS = {
+    "ONBATT": "OB",
+    "ONLINE": "OL",
+    "LOWBATT": "LB",
+}
+
+
+@dataclass
+class PowerEvent:
+    type: str
+    ups: Optional[str] = None
+
+    @property
+    def status_flag(self) -> str:
+        return POWER_EVENTS[self.type]
+
+
+def parse_event(message: str) -> Optional[PowerEvent]:
+    """
+    Parses a `<NOTIFYTYPE> [<UPSNAME>]` message.
+
+    Args:
+        message (str): The raw message sent by `wolnut notify`.
+
+    Returns:
+        PowerEvent | None: The event, or None if it is not a power event.
+    """
+    parts = message.split()
+    if not parts or parts[0].upper() not in POWER_EVENTS:
+        return None
+    ups = parts[1] if len(parts) > 1 else None
+    return PowerEvent(parts[0].upper(), ups)
+
+
+def send_event(socket_path: str, event_type: str, ups: Optional[str] = None):
+    """
+    Sends a power event to a running WOLNUT daemon.
+
+    Raises:
+        ValueError: If the event type is not a known power event.
+        OSError: If the daemon's socket cannot be reached.
+    """
+    event_type = event_type.upper()
+    if event_type not in POWER_EVENTS:
+        raise ValueError(f"Unsupported event type: {event_type}")
+    message = f"{event_type} {ups}" if ups else event_type
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.sendto(message.encode("utf-8"), socket_path)
+
+
+class PowerEventListener:
+    """
+    Receives power events pushed by upsmon's NOTIFYCMD on a Unix socket.
+
+    Events are queued for the control loop, and `on_event` is called from
+    the listener thread so the loop can be woken up immediately. The socket
+    is only writable by its owner and `group`, which upsmon's user (usually
+    `nut`) has to be in.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        on_event: Callable[[], None] = None,
+        group: Optional[str] = None,
+    ):
+        self.socket_path = socket_path
+        self.on_event = on_event
+        self.group = group
+        self.events: "queue.Queue[PowerEvent]" = queue.Queue()
+        self._sock: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+
+        self._stopping.clear()
+        gid = -1
+        if self.group:
+            try:
+                gid = grp.getgrnam(self.group).gr_gid
+            except KeyError:
+                raise OSError(f"Unknown group: {self.group}") from None
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self._sock.bind(self.socket_path)
+            # upsmon runs NOTIFYCMD as its own user, usually nut
+            os.chown(self.socket_path, -1, gid)
+            os.chmod(self.socket_path, 0o660)
+        except OSError:
+            self._sock.close()
+            self._sock = None
+            raise
+        self._thread = threading.Thread(
+            target=self._listen, name="event-listener", daemon=True
+        )
+        self._thread.start()
+        logger.info("Listening for power events on %s", self.socket_path)
+
+    def stop(self):
+        if self._sock is None:
+            return
+        self._stopping.set()
+        # Unblock the listener thread's recv
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+                sock.sendto(b"", self.socket_path)
+        except OSError:
+            pass
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self._sock.close()
+        self._sock = None
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            try:
+                data = self._sock.recv(1024)
+            except OSError:
+                return
+            if self._stopping.is_set():
+                return
+            message = data.decode("utf-8", errors="replace").strip()
+            event = parse_event(message)
+            if event is None:
+                logger.debug("Ignoring unknown event message: %r", message)
+                continue
+            logger.info("Received power event: %s %s", event.type, event.ups or "")
+            self.events.put(event)
+            if self.on_event is not None:
+                self.on_event()
+
+    def drain(self) -> list[PowerEvent]:
+        """Returns and removes every event received since the last call."""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
@@ -0,0 +1,263 @@
+import ipaddress
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Iterable, Optional
+
+logger = logging.getLogger("wolnut")
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+ICMP_HEADER = struct.Struct("!BBHHH")
+PAYLOAD = b"wolnut-probe"
+_RESOLVER_THREADS = 8
+
+
+def checksum(data: bytes) -> int:
+    """
+    Computes the RFC 1071 internet checksum.
+
+    Args:
+        data (bytes): The bytes to checksum.
+
+    Returns:
+        int: The 16-bit one's complement checksum.
+    """
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo_request(ident: int, seq: int, payload: bytes = PAYLOAD) -> bytes:
+    header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    csum = checksum(header + payload)
+    return ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, csum, ident, seq) + payload
+
+
+def parse_echo_reply(packet: bytes, raw: bool) -> Optional[tuple[int, int]]:
+    """
+    Extracts the identifier and sequence number from an echo reply.
+
+    Args:
+        packet (bytes): Data read from the ICMP socket.
+        raw (bool): Whether the data still carries its IPv4 header.
+
+    Returns:
+        tuple[int, int] | None: (identifier, sequence) or None if the packet
+        is not an echo reply.
+    """
+    if raw:
+        if not packet:
+            return None
+        packet = packet[(packet[0] & 0x0F) * 4 :]
+    if len(packet) < ICMP_HEADER.size:
+        return None
+    icmp_type, _, _, ident, seq = ICMP_HEADER.unpack_from(packet)
+    if icmp_type != ICMP_ECHO_REPLY:
+        return None
+    return ident, seq
+
+
+def open_icmp_socket() -> tuple[socket.socket, bool]:
+    """
+    Opens an ICMP socket, preferring the unprivileged datagram kind.
+
+    Returns:
+        tuple[socket.socket, bool]: The socket and whether it is a raw socket.
+
+    Raises:
+        OSError: If neither socket type is permitted.
+    """
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        return sock, False
+    except OSError as e:
+        logger.debug("Unprivileged ICMP socket unavailable (%s), trying raw", e)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+    return sock, True
+
+
+class IcmpPinger:
+    """
+    Pings many hosts at once from a single ICMP socket.
+
+    Echo requests for every host go out in one burst and replies are
+    matched back by sequence number (and identifier on raw sockets)
+    until they all answer or the shared deadline passes.
+
+    Hostnames are looked up in parallel within the same deadline and the
+    addresses are cached, so a slow or unreachable DNS server during an
+    outage can't stretch a sweep. A host is only looked up again after it
+    stops answering, and its last known address is used if that fails.
+
+    Sweeps from different threads, e.g. the probe loop and a background
+    MAC address refresh, take turns: each would drain or take the other's
+    replies otherwise.
+    """
+
+    def __init__(self):
+        self._sock, self._raw = open_icmp_socket()
+        self._sock.setblocking(False)
+        # Datagram ICMP sockets have their identifier rewritten by the kernel,
+        # which also filters replies for us. Raw sockets see everything.
+        self._ident = os.getpid() & 0xFFFF
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._addresses: dict[str, str] = {}  # Last known address by hostname
+        self._stale: set[str] = set()  # Hostnames to look up again
+        self._resolver: Optional[ThreadPoolExecutor] = None
+
+    def close(self):
+        self._sock.close()
+        if self._resolver is not None:
+            # Lookups stuck on DNS are left to finish on their own
+            self._resolver.shutdown(wait=False, cancel_futures=True)
+
+    def _next_seq(self) -> int:
+        self._seq = (self._seq + 1) & 0xFFFF
+        return self._seq
+
+    def _drain(self):
+        """Discards replies that arrived after a previous sweep's deadline."""
+        while True:
+            try:
+                self._sock.recv(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+
+    def _known_address(self, host: str) -> Optional[str]:
+        """Returns the address of an IP or a cached hostname without a lookup."""
+        try:
+            return str(ipaddress.IPv4Address(host))
+        except ValueError:
+            pass
+        if host in self._stale:
+            return None
+        return self._addresses.get(host)
+
+    def _lookup(self, hosts: list[str], deadline: float) -> dict[str, Optional[str]]:
+        """
+        Looks hostnames up in parallel, abandoning those still running at
+        `deadline`. Hosts that can't be looked up keep their last known
+        address, if any.
+        """
+        if self._resolver is None:
+            self._resolver = ThreadPoolExecutor(
+                max_workers=_RESOLVER_THREADS, thread_name_prefix="resolve"
+            )
+        lookups = {
+            host: self._resolver.submit(socket.gethostbyname, host) for host in hosts
+        }
+        done, _ = wait(lookups.values(), timeout=max(0.0, deadline - time.monotonic()))
+
+        addresses = {}
+        for host, lookup in lookups.items():
+            address = None
+            if lookup not in done:
+                logger.warning("Timed out resolving %s", host)
+            elif lookup.exception() is not None:
+                logger.warning("Failed to resolve %s: %s", host, lookup.exception())
+            else:
+                address = lookup.result()
+            if address is not None:
+                self._addresses[host] = address
+                self._stale.discard(host)
+            addresses[host] = address or self._addresses.get(host)
+        return addresses
+
+    def _send_requests(self, addresses: dict[str, Optional[str]], pending: dict):
+        for host, address in addresses.items():
+            if address is None:
+                continue
+            seq = self._next_seq()
+            try:
+                self._sock.sendto(build_echo_request(self._ident, seq), (address, 0))
+            except OSError as e:
+                logger.debug("Failed to send echo request to %s: %s", host, e)
+                continue
+            pending[seq] = (host, address, time.monotonic())
+
+    def ping_many(
+        self, hosts: Iterable[str], timeout: float
+    ) -> dict[str, Optional[float]]:
+        """
+        Sends one echo request to each host and waits for the replies.
+
+        Args:
+            hosts (Iterable[str]): IPs or hostnames to ping.
+            timeout (float): Shared deadline in seconds for the whole sweep,
+                name lookups included.
+
+        Returns:
+            dict[str, float | None]: Round-trip time in seconds keyed by host,
+            or None for hosts that did not answer or resolve in time.
+        """
+        with self._lock:
+            return self._ping_many(hosts, timeout)
+
+    def _ping_many(
+        self, hosts: Iterable[str], timeout: float
+    ) -> dict[str, Optional[float]]:
+        deadline = time.monotonic() + timeout
+        hosts = list(dict.fromkeys(hosts))
+        results: dict[str, Optional[float]] = dict.fromkeys(hosts)
+        pending: dict[int, tuple[str, str, float]] = {}
+        self._drain()
+
+        known = {host: self._known_address(host) for host in hosts}
+        # Hosts with a known address don't wait for the others' lookups
+        self._send_requests(
+            {host: address for host, address in known.items() if address}, pending
+        )
+        unknown = [host for host, address in known.items() if address is None]
+        if unknown:
+            self._send_requests(self._lookup(unknown, deadline), pending)
+
+        while pending:
+            remaining = deadline - time.monotonic()
+            # Lookups can use up the deadline, replies that are in still count
+            readable, _, _ = select.select([self._sock], [], [], max(0.0, remaining))
+            if not readable:
+                break
+            while pending:
+                try:
+                    packet, (address, _) = self._sock.recvfrom(2048)
+                except (BlockingIOError, InterruptedError):
+                    break
+                received_at = time.monotonic()
+                reply = parse_echo_reply(packet, self._raw)
+                if reply is None:
+                    continue
+                ident, seq = reply
+                if self._raw and ident != self._ident:
+                    continue
+                if seq not in pending or pending[seq][1] != address:
+                    continue
+                host, _, sent_at = pending.pop(seq)
+                results[host] = received_at - sent_at
+            if remaining <= 0:
+                break
+
+        # A host that got a new address only answers at the new one
+        self._stale.update(
+            host
+            for host, rtt in results.items()
+            if rtt is None and host in self._addresses
+        )
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,87 @@
+import json
+import logging
+import threading
+
+from datetime import datetime, timezone
+
+LOG_FORMATS = ("text", "json")
+DEFAULT_LOG_FORMAT = "text"
+DEFAULT_LOG_RATE_LIMIT = 0  # Seconds between repeats of a message, 0 is off
+
+# Passed with `extra=`, these become fields of JSON log lines
+STRUCTURED_FIELDS = ("client", "ups", "phase", "latency_ms")
+_MAX_TRACKED_MESSAGES = 1024
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as one JSON object per line.
+
+    Every line has `time`, `level` and `message`, plus any of the
+    `STRUCTURED_FIELDS` that the record was logged with.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for name in STRUCTURED_FIELDS + ("suppressed",):
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drops repeats of a message within `interval` seconds.
+
+    Messages are the same if they render to the same text, or if they were
+    logged with the same `log_key` extra, e.g. a countdown whose text
+    changes every time. The first message after the interval says how many
+    were dropped. Time is taken from the records, so replays in virtual
+    time are limited in virtual time.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        self._lock = threading.Lock()
+        # Message key -> [time it was last let through, repeats dropped since]
+        self._seen: dict = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "log_key", None)
+        if key is None:
+            try:
+                key = (record.levelno, record.getMessage())
+            except Exception:
+                # Let the handler report the broken message
+                return True
+
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is not None and record.created - seen[0] < self.interval:
+                seen[1] += 1
+                return False
+
+            if seen is not None and seen[1]:
+                message = record.getMessage()
+                record.msg = "%s (%s similar messages suppressed)"
+                record.args = (message, seen[1])
+                record.suppressed = seen[1]
+            self._seen[key] = [record.created, 0]
+            if len(self._seen) > _MAX_TRACKED_MESSAGES:
+                self._forget_expired(record.created)
+        return True
+
+    def _forget_expired(self, now: float):
+        for key, seen in list(self._seen.items()):
+            if now - seen[0] >= self.interval:
+                del self._seen[key]
@@ -0,0 +1,109 @@
+import json
+import logging
+import threading
+import time
+
+from pathlib import Path
+from typing import Callable, Dict, Any, Iterable, Optional
+
+logger = logging.getLogger("wolnut")
+
+DEFAULT_MAC_CACHE_TTL = 7 * 24 * 60 * 60
+
+
+def mac_cache_path(status_file: str) -> Path:
+    """Returns the MAC cache location that belongs to a status file."""
+    return Path(status_file).with_suffix(".macs.json")
+
+
+class MacCache:
+    """
+    Remembers resolved MAC addresses between runs.
+
+    Entries record when the MAC was last seen so stale ones can be
+    re-resolved, but a stale MAC is still far better than none when the
+    host is powered off at startup.
+    """
+
+    def __init__(self, path: Path, ttl: int = DEFAULT_MAC_CACHE_TTL):
+        self._path = Path(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if self._path.exists():
+            self._load()
+
+    def _load(self):
+        try:
+            self._entries = json.loads(self._path.read_text())
+            logger.debug("MAC cache loaded from %s", self._path)
+        except Exception as e:
+            logger.warning("Failed to load MAC cache: %s", e)
+
+    def save(self):
+        with self._lock:
+            raw_data = json.dumps(self._entries, indent=4, sort_keys=True)
+        temp_file = self._path.with_suffix(".tmp")
+        try:
+            temp_file.write_text(raw_data)
+            temp_file.replace(self._path)
+        except Exception as e:
+            logger.warning("Failed to save MAC cache to '%s': %s", self._path, e)
+
+    def get(self, host: str) -> Optional[str]:
+        entry = self._entries.get(host)
+        return entry["mac"] if entry else None
+
+    def is_stale(self, host: str) -> bool:
+        entry = self._entries.get(host)
+        return entry is None or time.time() - entry["last_seen"] >= self.ttl
+
+    def update(self, macs: Dict[str, Optional[str]]) -> bool:
+        """
+        Records freshly resolved MAC addresses, ignoring failed lookups.
+
+        Returns:
+            bool: Whether any entry was added or changed.
+        """
+        now = int(time.time())
+        changed = False
+        with self._lock:
+            for host, mac in macs.items():
+                if not mac:
+                    continue
+                entry = self._entries.get(host)
+                changed = changed or entry is None or entry["mac"] != mac
+                self._entries[host] = {"mac": mac, "last_seen": now}
+        return changed
+
+    def refresh_in_background(
+        self,
+        hosts: Iterable[str],
+        resolve: Callable[[list], Dict[str, Optional[str]]],
+        on_change: Callable[[str, str], None] = None,
+    ) -> threading.Thread:
+        """
+        Re-resolves hosts on a background thread and saves the results.
+
+        Args:
+            hosts (Iterable[str]): The hosts to re-resolve.
+            resolve (Callable): Bulk resolver returning a MAC per host.
+            on_change (Callable | None): Called with (host, mac) for every
+                host whose MAC differs from the cached one.
+        """
+        hosts = list(hosts)
+
+        def refresh():
+            previous = {host: self.get(host) for host in hosts}
+            macs = resolve(hosts)
+            self.update(macs)
+            self.save()
+            for host, mac in macs.items():
+                if mac and mac != previous.get(host):
+                    logger.info("MAC for %s changed to %s", host, mac)
+                    if on_change is not None:
+                        on_change(host, mac)
+
+        thread = threading.Thread(target=refresh, name="mac-refresh", daemon=True)
+        thread.start()
+        return thread
@@ -1,57 +1,144 @@
 import subprocess
 import logging
+import math
 import platform
-from typing import Optional
+import threading
+import time
 
-logger = logging.getLogger("wolnut")
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
 
+from wolnut.icmp import IcmpPinger
+from wolnut.nut import NutClient, UPS_STATUS_VARS
 
-def get_ups_status(
-    ups_name: str, username: Optional[str] = None, password: Optional[str] = None
-) -> dict:
-    env = None
+logger = logging.getLogger("wolnut")
 
-    if username and password:
-        env = {**subprocess.os.environ, "USERNAME": username, "PASSWORD": password}
+DEFAULT_PROBE_CONCURRENCY = 16
+DEFAULT_PROBE_TIMEOUT = 1.0
+DEFAULT_PROBE_METHOD = "auto"
+PROBE_METHODS = ("auto", "icmp", "ping")
 
-    try:
-        result = subprocess.run(
-            ["upsc", ups_name],
-            capture_output=True,
-            text=True,
-            env=env,
-            timeout=5,
-            check=False,
-        )
+_icmp_pinger: Optional[IcmpPinger] = None
+_icmp_unavailable = False
+_icmp_pinger_lock = threading.Lock()
 
-        if result.returncode != 0:
-            logger.error("upsc returned error: %s", result.stderr.strip())
-            return {}
 
-        status = {}
-        for line in result.stdout.splitlines():
-            if ":" in line:
-                key, value = line.split(":", 1)
-                status[key.strip()] = value.strip()
+def get_ups_status(
+    client: NutClient, ups_name: str, variables: Iterable[str] = UPS_STATUS_VARS
+) -> dict:
+    """
+    Fetches the variables the main loop needs from upsd.
 
-        return status
+    Args:
+        client (NutClient): A (possibly not yet connected) upsd client.
+        ups_name (str): Name of the UPS on the upsd server.
+        variables (Iterable[str]): The variables to fetch.
 
+    Returns:
+        dict: The UPS variables, or an empty dict on failure.
+    """
+    try:
+        return client.get_vars(ups_name, variables)
     except Exception as e:
         logger.error("Failed to get UPS status: %s", e)
+        client.close()
         return {}
 
 
-def is_client_online(host: str) -> bool:
+def _ping_command(host: str, timeout: float) -> list[str]:
+    system = platform.system().lower()
+    if system == "windows":
+        return ["ping", "-n", "1", "-w", str(int(timeout * 1000)), host]
+    if system == "darwin":
+        return ["ping", "-c", "1", "-W", str(int(timeout * 1000)), host]
+    return ["ping", "-c", "1", "-W", str(max(1, math.ceil(timeout))), host]
+
+
+def is_client_online(host: str, timeout: float = DEFAULT_PROBE_TIMEOUT) -> bool:
     try:
-        count_flag = "-n" if platform.system().lower() == "windows" else "-c"
         result = subprocess.run(
-            ["ping", count_flag, "1", host],
+            _ping_command(host, timeout),
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
+            # ping's own deadline is the real limit, this is a backstop.
+            timeout=timeout + 1,
             check=False,
         )
         logger.debug("Host: %s Online: %s", host, result.returncode == 0)
         return result.returncode == 0
+    except subprocess.TimeoutExpired:
+        logger.debug("Host: %s Online: False (probe timed out)", host)
+        return False
     except Exception as e:
         logger.warning("Failed to ping %s: %s", host, e)
         return False
+
+
+def _get_icmp_pinger() -> Optional[IcmpPinger]:
+    """Returns the shared ICMP pinger, or None if this host does not allow one."""
+    global _icmp_pinger, _icmp_unavailable
+    # Probe sweeps and background MAC resolution can both get here first
+    with _icmp_pinger_lock:
+        if _icmp_pinger is None and not _icmp_unavailable:
+            try:
+                _icmp_pinger = IcmpPinger()
+            except OSError as e:
+                logger.warning(
+                    "ICMP sockets are not permitted (%s), falling back to the ping command",
+                    e,
+                )
+                _icmp_unavailable = True
+        return _icmp_pinger
+
+
+def _probe_with_ping(
+    hosts: list[str], max_concurrency: int, timeout: float
+) -> dict[str, Optional[float]]:
+    def probe(host: str) -> Optional[float]:
+        started = time.monotonic()
+        if is_client_online(host, timeout):
+            return time.monotonic() - started
+        return None
+
+    workers = max(1, min(max_concurrency, len(hosts)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="probe") as pool:
+        return dict(zip(hosts, pool.map(probe, hosts)))
+
+
+def probe_rtts(
+    hosts: Iterable[str],
+    max_concurrency: int = DEFAULT_PROBE_CONCURRENCY,
+    timeout: float = DEFAULT_PROBE_TIMEOUT,
+    method: str = DEFAULT_PROBE_METHOD,
+) -> dict[str, Optional[float]]:
+    """
+    Pings each host and reports how long it took to answer.
+
+    Args:
+        hosts (Iterable[str]): IPs or hostnames to probe. Duplicates are probed once.
+        max_concurrency (int): Maximum number of `ping` commands in flight at once.
+            Unused by the ICMP engine, which sends to every host in one burst.
+        timeout (float): Deadline in seconds for each probe.
+        method (str): "icmp" for the in-process engine, "ping" for the `ping`
+            command, or "auto" to use ICMP when the host allows it.
+
+    Returns:
+        dict[str, float | None]: Round-trip time in seconds keyed by host,
+        or None for hosts that are offline.
+    """
+    unique_hosts = list(dict.fromkeys(hosts))
+    if not unique_hosts:
+        return {}
+
+    if method in ("auto", "icmp"):
+        pinger = _get_icmp_pinger()
+        if pinger is not None:
+            rtts = pinger.ping_many(unique_hosts, timeout)
+            if logger.isEnabledFor(logging.DEBUG):
+                for host, rtt in rtts.items():
+                    logger.debug(
+                        "Host: %s Online: %s RTT: %s", host, rtt is not None, rtt
+                    )
+            return rtts
+
+    return _probe_with_ping(unique_hosts, max_concurrency, timeout)
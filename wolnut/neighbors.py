@@ -0,0 +1,267 @@
+import errno
+import logging
+import socket
+import struct
+import threading
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, Optional
+
+from wolnut import netlink
+from wolnut.clock import SYSTEM_CLOCK, Clock
+
+logger = logging.getLogger("wolnut")
+
+DEFAULT_FAILED_TTL = 30  # Seconds a failed neighbor lookup counts as offline
+
+# From linux/rtnetlink.h and linux/neighbour.h
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+RTMGRP_NEIGH = 0x4
+NDA_DST = 1
+NDA_LLADDR = 2
+
+NUD_INCOMPLETE = 0x01
+NUD_REACHABLE = 0x02
+NUD_STALE = 0x04
+NUD_DELAY = 0x08
+NUD_PROBE = 0x10
+NUD_FAILED = 0x20
+NUD_NOARP = 0x40
+NUD_PERMANENT = 0x80
+
+_NDMSG = struct.Struct("=BxxxiHBB")  # family, ifindex, state, flags, type
+
+
+@dataclass
+class Neighbor:
+    ip: str
+    state: int
+    mac: Optional[str] = None
+    updated_at: float = 0.0
+
+
+def normalize_mac(mac: str) -> str:
+    return mac.replace("-", ":").lower()
+
+
+def parse_messages(data: bytes) -> Iterator[tuple[int, Neighbor]]:
+    """
+    Parses the neighbor messages in one netlink datagram.
+
+    Args:
+        data (bytes): A datagram read from a NETLINK_ROUTE socket.
+
+    Yields:
+        tuple: The message type (RTM_NEWNEIGH, RTM_DELNEIGH, NLMSG_DONE or
+            NLMSG_ERROR) and the neighbor it describes, if any. Entries that
+            are not IPv4 or IPv6 neighbors, e.g. bridge FDB entries, are
+            skipped.
+    """
+    for msg_type, body in netlink.iter_messages(data):
+        if msg_type in (netlink.NLMSG_DONE, netlink.NLMSG_ERROR):
+            yield msg_type, None
+            continue
+        if msg_type not in (RTM_NEWNEIGH, RTM_DELNEIGH) or len(body) < _NDMSG.size:
+            continue
+        family, _, state, _, _ = _NDMSG.unpack_from(body)
+        if family not in (socket.AF_INET, socket.AF_INET6):
+            continue
+
+        attributes = netlink.parse_attributes(body, _NDMSG.size)
+        if NDA_DST not in attributes:
+            continue
+        lladdr = attributes.get(NDA_LLADDR)
+        mac = None
+        if lladdr is not None and len(lladdr) == 6:
+            mac = ":".join(f"{b:02x}" for b in lladdr)
+        yield msg_type, Neighbor(
+            socket.inet_ntop(family, attributes[NDA_DST]), state, mac
+        )
+
+
+def dump_request(seq: int = 1) -> bytes:
+    """Builds an RTM_GETNEIGH request for the whole neighbor table."""
+    return netlink.request(RTM_GETNEIGH, _NDMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0), seq)
+
+
+class NeighborTable:
+    """
+    Follows the kernel's neighbor (ARP/NDP) table over rtnetlink.
+
+    Any traffic from a client confirms its entry, so a REACHABLE entry shows
+    it is online without pinging it, and a recently FAILED one shows it is
+    not. Other states say nothing either way and leave the client to an
+    active probe. Entries are indexed by IP and by MAC, so clients that are
+    configured by hostname can be matched too.
+
+    Linux only. Changes to the entries of watched clients are collected for
+    the control loop, and `on_change` is called from the listener thread so
+    the loop can react to a woken machine straight away.
+    """
+
+    def __init__(
+        self,
+        on_change: Callable[[], None] = None,
+        failed_ttl: float = DEFAULT_FAILED_TTL,
+        clock: Clock = SYSTEM_CLOCK,
+    ):
+        self.on_change = on_change
+        self.failed_ttl = failed_ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._by_ip: dict[str, Neighbor] = {}
+        self._by_mac: dict[str, set[str]] = {}
+        self._watched: set[str] = set()
+        self._changed: set[str] = set()
+        self._sock: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        """
+        Subscribes to neighbor events and loads the current table.
+
+        Raises:
+            OSError: If the host has no rtnetlink, e.g. it is not Linux.
+        """
+        self._stopping.clear()
+        self._sock = netlink.open_socket(RTMGRP_NEIGH)
+        try:
+            # Timeouts let the listener notice stop(), netlink recv can't be shut down
+            self._sock.settimeout(1)
+            self._sock.sendto(dump_request(), (0, 0))
+        except OSError:
+            self._sock.close()
+            self._sock = None
+            raise
+        self._thread = threading.Thread(
+            target=self._listen, name="neighbor-table", daemon=True
+        )
+        self._thread.start()
+        logger.info("Following the kernel neighbor table for client liveness")
+
+    def stop(self):
+        if self._sock is None:
+            return
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self._sock.close()
+        self._sock = None
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            try:
+                data = self._sock.recv(netlink.RECV_BUFFER)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if self._stopping.is_set():
+                    return
+                if e.errno != errno.ENOBUFS:
+                    logger.error("Stopped following the neighbor table: %s", e)
+                    return
+                # Events were dropped, start over from a full dump
+                logger.debug("Neighbor events were dropped, reloading the table")
+                try:
+                    self._sock.sendto(dump_request(), (0, 0))
+                except OSError:
+                    pass
+                continue
+            if self.apply(parse_messages(data)) and self.on_change is not None:
+                self.on_change()
+
+    def apply(self, messages: Iterable[tuple[int, Optional[Neighbor]]]) -> bool:
+        """
+        Updates the index from parsed netlink messages.
+
+        Returns:
+            bool: Whether the entry of any watched client changed state.
+        """
+        now = self.clock.time()
+        changed = set()
+        with self._lock:
+            for msg_type, neighbor in messages:
+                if neighbor is None:
+                    continue
+                old = self._by_ip.pop(neighbor.ip, None)
+                if old is not None and old.mac:
+                    ips = self._by_mac[old.mac]
+                    ips.discard(old.ip)
+                    if not ips:
+                        del self._by_mac[old.mac]
+                if msg_type == RTM_DELNEIGH:
+                    if old is not None:
+                        changed.update((old.ip, old.mac))
+                    continue
+                if neighbor.mac is None and old is not None:
+                    # Entries that are not valid, e.g. FAILED, carry no address
+                    neighbor.mac = old.mac
+                neighbor.updated_at = (
+                    old.updated_at
+                    if old is not None and old.state == neighbor.state
+                    else now
+                )
+                self._by_ip[neighbor.ip] = neighbor
+                if neighbor.mac:
+                    self._by_mac.setdefault(neighbor.mac, set()).add(neighbor.ip)
+                if old is None or old.state != neighbor.state:
+                    changed.update((neighbor.ip, neighbor.mac))
+            changed &= self._watched
+            self._changed |= changed
+        return bool(changed)
+
+    def _lookup(self, host: str, mac: Optional[str]) -> list[Neighbor]:
+        if host in self._by_ip:
+            return [self._by_ip[host]]
+        if not mac:
+            return []
+        return [self._by_ip[ip] for ip in self._by_mac.get(normalize_mac(mac), ())]
+
+    def liveness(self, host: str, mac: Optional[str] = None) -> Optional[bool]:
+        """
+        Says whether a client is online from its neighbor entries alone.
+
+        Args:
+            host (str): The client's IP address (or hostname, see `mac`).
+            mac (str | None): The client's MAC address, used when `host` has
+                no entry of its own.
+
+        Returns:
+            bool | None: True if reachable, False if the kernel recently
+                failed to reach it, None if it needs an active probe.
+        """
+        now = self.clock.time()
+        with self._lock:
+            neighbors = self._lookup(host, mac)
+        if any(n.state & NUD_REACHABLE for n in neighbors):
+            return True
+        if neighbors and all(
+            n.state & NUD_FAILED and now - n.updated_at < self.failed_ttl
+            for n in neighbors
+        ):
+            return False
+        return None
+
+    def watch(self, clients: Iterable[tuple[str, Optional[str]]]):
+        """
+        Sets the clients whose changes are collected and call `on_change`.
+
+        Args:
+            clients (Iterable): (host, MAC address) of each client.
+        """
+        watched = set()
+        for host, mac in clients:
+            watched.add(host)
+            if mac:
+                watched.add(normalize_mac(mac))
+        with self._lock:
+            self._watched = watched
+            self._changed &= watched
+
+    def drain_changes(self) -> set[str]:
+        """Returns the watched IPs and MACs that changed since the last call."""
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        return changed
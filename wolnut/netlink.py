@@ -0,0 +1,108 @@
+import errno
+import os
+import socket
+import struct
+from typing import Iterator
+
+# From linux/netlink.h
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+
+NLMSGHDR = struct.Struct("=IHHII")  # length, type, flags, seq, pid
+RTATTR = struct.Struct("=HH")  # length, type
+_NLMSGERR = struct.Struct("=i")  # negative errno, 0 acknowledges
+RECV_BUFFER = 1024 * 1024
+
+
+def align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def open_socket(groups: int = 0) -> socket.socket:
+    """
+    Opens a NETLINK_ROUTE socket.
+
+    Args:
+        groups (int): The multicast groups to subscribe to, e.g. RTMGRP_NEIGH.
+
+    Raises:
+        OSError: If the host has no rtnetlink, e.g. it is not Linux.
+    """
+    family = getattr(socket, "AF_NETLINK", None)
+    if family is None:
+        raise OSError(errno.EAFNOSUPPORT, "rtnetlink is only available on Linux")
+    sock = socket.socket(family, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+        sock.bind((0, groups))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def request(msg_type: int, payload: bytes, seq: int = 1) -> bytes:
+    """Builds a dump request, e.g. RTM_GETNEIGH for the whole neighbor table."""
+    header = NLMSGHDR.pack(
+        NLMSGHDR.size + len(payload), msg_type, NLM_F_REQUEST | NLM_F_DUMP, seq, 0
+    )
+    return header + payload
+
+
+def iter_messages(data: bytes) -> Iterator[tuple[int, bytes]]:
+    """
+    Splits one netlink datagram into its messages.
+
+    Yields:
+        tuple: The type and body of each message. A truncated message ends
+            the datagram.
+    """
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, msg_type, _, _, _ = NLMSGHDR.unpack_from(data, offset)
+        if length < NLMSGHDR.size or offset + length > len(data):
+            return
+        yield msg_type, data[offset + NLMSGHDR.size : offset + length]
+        offset += align(length)
+
+
+def parse_attributes(body: bytes, offset: int = 0) -> dict[int, bytes]:
+    """Returns the route attributes after `offset` in a message body, by type."""
+    attributes = {}
+    while offset + RTATTR.size <= len(body):
+        length, attr_type = RTATTR.unpack_from(body, offset)
+        if length < RTATTR.size:
+            break
+        attributes[attr_type] = body[offset + RTATTR.size : offset + length]
+        offset += align(length)
+    return attributes
+
+
+def dump(
+    msg_type: int, payload: bytes, timeout: float = 1.0
+) -> list[tuple[int, bytes]]:
+    """
+    Dumps a kernel table, e.g. every address with RTM_GETADDR.
+
+    Returns:
+        list: The type and body of each message of the dump.
+
+    Raises:
+        OSError: If rtnetlink is unavailable or the kernel rejects the request.
+    """
+    messages = []
+    with open_socket() as sock:
+        sock.settimeout(timeout)
+        sock.sendto(request(msg_type, payload), (0, 0))
+        while True:
+            for reply_type, body in iter_messages(sock.recv(RECV_BUFFER)):
+                if reply_type == NLMSG_DONE:
+                    return messages
+                if reply_type == NLMSG_ERROR:
+                    (error,) = _NLMSGERR.unpack_from(body)
+                    if error:
+                        raise OSError(-error, os.strerror(-error))
+                    continue
+                messages.append((reply_type, body))
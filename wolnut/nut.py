@@ -0,0 +1,170 @@
+import logging
+import shlex
+import socket
+from typing import Iterable, Optional
+
+logger = logging.getLogger("wolnut")
+
+DEFAULT_NUT_HOST = "localhost"
+DEFAULT_NUT_PORT = 3493
+UPS_STATUS_VARS = ("ups.status", "battery.charge")
+UPS_LOAD_VAR = "ups.load"
+
+
+class NutError(Exception):
+    """Raised when upsd answers a command with an ERR response."""
+
+
+def parse_ups_name(
+    ups: str, hostname: Optional[str] = None, port: Optional[int] = None
+) -> tuple[str, str, int]:
+    """
+    Splits a UPS identifier into its name, host and port.
+
+    Supports the deprecated `<ups-name>@<hostname>[:<port>]` format for
+    backward compatibility. Explicit `hostname` and `port` values win.
+
+    Args:
+        ups (str): UPS name, optionally with an `@host[:port]` suffix.
+        hostname (str | None): upsd host from the config.
+        port (int | None): upsd port from the config.
+
+    Returns:
+        tuple[str, str, int]: The UPS name, upsd host and upsd port.
+    """
+    name, _, address = ups.partition("@")
+    address_host, _, address_port = address.partition(":")
+
+    host = hostname or address_host or DEFAULT_NUT_HOST
+    if port is None:
+        port = int(address_port) if address_port else DEFAULT_NUT_PORT
+    return name, host, port
+
+
+class NutClient:
+    """
+    A minimal client for the NUT network protocol.
+
+    Keeps one TCP connection to upsd open between polls and reconnects
+    transparently if it drops, so that a status poll costs a couple of
+    round trips instead of spawning `upsc`.
+    """
+
+    def __init__(
+        self,
+        host: str = DEFAULT_NUT_HOST,
+        port: int = DEFAULT_NUT_PORT,
+        timeout: float = 5,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        login_ups: Optional[str] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.username = username
+        self.password = password
+        self.login_ups = login_ups
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+
+    @property
+    def connected(self) -> bool:
+        return self._sock is not None
+
+    def connect(self):
+        """Opens the connection to upsd and authenticates if configured."""
+        self.close()
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock = sock
+        self._reader = sock.makefile("r", encoding="utf-8", newline="\n")
+        try:
+            if self.username:
+                self._command(f"USERNAME {self.username}")
+            if self.password:
+                self._command(f"PASSWORD {self.password}")
+            if self.login_ups:
+                self._command(f"LOGIN {self.login_ups}")
+        except Exception:
+            self.close()
+            raise
+        logger.debug("Connected to upsd at %s:%s", self.host, self.port)
+
+    def close(self):
+        """Closes the connection, politely if possible."""
+        if self._sock is None:
+            return
+        try:
+            self._sock.sendall(b"LOGOUT\n")
+        except OSError:
+            pass
+        try:
+            self._reader.close()
+            self._sock.close()
+        except OSError:
+            pass
+        self._sock = None
+        self._reader = None
+
+    def _readline(self) -> str:
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("upsd closed the connection")
+        return line.rstrip("\r\n")
+
+    def _command(self, command: str) -> str:
+        self._sock.sendall(command.encode("utf-8") + b"\n")
+        response = self._readline()
+        if response.startswith("ERR"):
+            raise NutError(response[4:] or "UNKNOWN-ERROR")
+        return response
+
+    def _request(self, func, *args):
+        """Runs a request, reconnecting once if the connection went stale."""
+        if not self.connected:
+            self.connect()
+        try:
+            return func(*args)
+        except (OSError, ConnectionError):
+            logger.debug("Connection to upsd lost, reconnecting")
+            self.connect()
+            return func(*args)
+
+    def _get_var(self, ups: str, var: str) -> str:
+        response = self._command(f"GET VAR {ups} {var}")
+        # VAR <ups> <var> "<value>"
+        return shlex.split(response)[3]
+
+    def _list_vars(self, ups: str) -> dict:
+        self._command(f"LIST VAR {ups}")
+        variables = {}
+        while True:
+            line = self._readline()
+            if line.startswith("END LIST VAR"):
+                return variables
+            _, _, var, value = shlex.split(line)
+            variables[var] = value
+
+    def _get_vars(self, ups: str, names: Iterable[str]) -> dict:
+        variables = {}
+        for var in names:
+            try:
+                variables[var] = self._get_var(ups, var)
+            except NutError as e:
+                logger.debug("upsd has no %s for %s: %s", var, ups, e)
+        return variables
+
+    def get_var(self, ups: str, var: str) -> str:
+        return self._request(self._get_var, ups, var)
+
+    def list_vars(self, ups: str) -> dict:
+        return self._request(self._list_vars, ups)
+
+    def get_vars(self, ups: str, names: Iterable[str] = UPS_STATUS_VARS) -> dict:
+        return self._request(self._get_vars, ups, tuple(names))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,136 @@
+import heapq
+import logging
+
+from typing import Callable, Iterable, Mapping, Optional
+
+logger = logging.getLogger("wolnut")
+
+
+def find_cycle(dependencies: Mapping[str, Iterable[str]]) -> Optional[list[str]]:
+    """
+    Finds a dependency cycle between clients.
+
+    Args:
+        dependencies (Mapping): The names each client depends on.
+
+    Returns:
+        list[str] | None: The cycle as a path that starts and ends with the
+        same client, or None if there is no cycle.
+    """
+    visiting, done = set(), set()
+
+    for root in dependencies:
+        if root in done:
+            continue
+        # Iterative DFS, the path holds the clients currently being visited
+        path = [root]
+        stack = [iter(dependencies.get(root, ()))]
+        visiting.add(root)
+        while stack:
+            dependency = next(stack[-1], None)
+            if dependency is None:
+                stack.pop()
+                finished = path.pop()
+                visiting.discard(finished)
+                done.add(finished)
+            elif dependency in visiting:
+                return path[path.index(dependency) :] + [dependency]
+            elif dependency not in done:
+                path.append(dependency)
+                stack.append(iter(dependencies.get(dependency, ())))
+                visiting.add(dependency)
+    return None
+
+
+def topological_order(dependencies: Mapping[str, Iterable[str]]) -> list[str]:
+    """
+    Orders clients so every client comes after the clients it depends on.
+
+    Clients that don't depend on each other keep their configured order.
+
+    Raises:
+        ValueError: If the dependencies contain a cycle.
+    """
+    position = {name: i for i, name in enumerate(dependencies)}
+    waiting_on = {
+        name: set(deps) & position.keys() for name, deps in dependencies.items()
+    }
+    dependents = {name: [] for name in dependencies}
+    for name, deps in waiting_on.items():
+        for dependency in deps:
+            dependents[dependency].append(name)
+
+    ready = [(position[name], name) for name, deps in waiting_on.items() if not deps]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        _, name = heapq.heappop(ready)
+        order.append(name)
+        for dependent in dependents[name]:
+            waiting_on[dependent].discard(name)
+            if not waiting_on[dependent]:
+                heapq.heappush(ready, (position[dependent], dependent))
+
+    if len(order) != len(dependencies):
+        cycle = find_cycle(dependencies)
+        raise ValueError(f"Dependency cycle: {' -> '.join(cycle)}")
+    return order
+
+
+class WakePlanner:
+    """
+    Decides which down clients may be woken, given the `depends_on` DAG.
+
+    A client is ready once every client it depends on is online, so
+    independent branches are woken in parallel and each client is woken as
+    soon as its own dependencies allow.
+    """
+
+    def __init__(self, clients: Iterable):
+        clients = list(clients)
+        names = {client.name for client in clients}
+        self.dependencies = {}
+        for client in clients:
+            missing = [name for name in client.depends_on if name not in names]
+            if missing:
+                # e.g. a client that was skipped because its MAC was not found
+                logger.warning(
+                    "%s depends on unknown clients, ignoring: %s",
+                    client.name,
+                    ", ".join(missing),
+                )
+            self.dependencies[client.name] = [
+                name for name in client.depends_on if name in names
+            ]
+        self._rank = {
+            name: i for i, name in enumerate(topological_order(self.dependencies))
+        }
+
+    def ready(self, clients: Iterable, is_satisfied: Callable[[str], bool]) -> list:
+        """
+        Returns the clients whose dependencies are all satisfied, in wake order.
+
+        Args:
+            clients (Iterable): The down clients.
+            is_satisfied (Callable): Whether a dependency no longer blocks its
+                dependents, e.g. because it is online.
+        """
+        ready = []
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for client in clients:
+            blocking = [
+                name
+                for name in self.dependencies.get(client.name, ())
+                if not is_satisfied(name)
+            ]
+            if blocking:
+                if debug:
+                    logger.debug(
+                        "Waiting for %s before waking %s",
+                        ", ".join(blocking),
+                        client.name,
+                        extra={"client": client.name},
+                    )
+                continue
+            ready.append(client)
+        return sorted(ready, key=lambda client: self._rank.get(client.name, 0))
@@ -0,0 +1,79 @@
+from typing import Iterable, Optional
+
+DEFAULT_IDLE_PROBE_INTERVAL = 60
+DEFAULT_WOL_PROBE_BACKOFF = 2.0
+
+
+class ProbePolicy:
+    """
+    Tracks when clients are next worth probing.
+
+    On mains power only the snapshot taken when a UPS switches to battery
+    matters, so clients are swept every `idle_interval` seconds instead of
+    on every poll. A client that has just been sent WOL cannot answer until
+    it has booted, so it is probed after `backoff`, 2 * `backoff`,
+    4 * `backoff`, ... seconds until its expected boot time, then on every
+    step again.
+    """
+
+    def __init__(
+        self,
+        idle_interval: float = DEFAULT_IDLE_PROBE_INTERVAL,
+        backoff: float = DEFAULT_WOL_PROBE_BACKOFF,
+    ):
+        self.idle_interval = idle_interval
+        self.backoff = backoff
+        self.next_idle_sweep: Optional[float] = None
+        # Client name -> (next probe at, current delay, expected boot time)
+        self._backoff: dict[str, tuple[float, float, float]] = {}
+
+    def idle_sweep_due(self, now: float) -> bool:
+        return self.next_idle_sweep is None or now >= self.next_idle_sweep
+
+    def idle_swept(self, now: float):
+        self.next_idle_sweep = now + self.idle_interval
+
+    def wol_sent(self, name: str, boot_time: float, at: float):
+        """Starts backing off probes of a client that was just woken."""
+        if boot_time <= 0 or name in self._backoff:
+            # Retries don't restart the backoff, the first packet may be booting it
+            return
+        delay = min(self.backoff, boot_time)
+        self._backoff[name] = (at + delay, delay, at + boot_time)
+
+    def due(self, name: str, now: float) -> bool:
+        """Whether a client that is being woken should be probed now."""
+        entry = self._backoff.get(name)
+        return entry is None or now >= entry[0] or now >= entry[2]
+
+    def probed(self, results: dict[str, bool], now: float):
+        """
+        Backs off further for clients that are still down.
+
+        Args:
+            results (dict): Whether each probed client is online, by name.
+            now (float): When the clients were probed.
+        """
+        if not self._backoff:
+            return
+        for name, online in results.items():
+            entry = self._backoff.get(name)
+            if entry is None:
+                continue
+            if online:
+                del self._backoff[name]
+            elif now < entry[2]:
+                delay = entry[1] * 2
+                self._backoff[name] = (min(now + delay, entry[2]), delay, entry[2])
+
+    def forget(self, names: Iterable[str]):
+        """Stops backing off, e.g. once a client is online."""
+        for name in names:
+            self._backoff.pop(name, None)
+
+    def next_probe_at(self, now: float) -> Optional[float]:
+        """Returns the earliest moment a probe becomes due, if any is pending."""
+        pending = [entry[0] for entry in self._backoff.values() if entry[0] > now]
+        if self.next_idle_sweep is not None:
+            pending.append(self.next_idle_sweep)
+        return min(pending, default=None)
@@ -0,0 +1,138 @@
+import http.client
+import logging
+import shlex
+import socket
+import ssl
+import subprocess
+import urllib.error
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger("wolnut")
+
+CHECK_TYPES = ("tcp", "http", "command")
+DEFAULT_CHECK_TIMEOUT = 2.0
+
+
+@dataclass
+class ReadinessCheck:
+    """
+    A check that a client's services are up, not just its network stack.
+
+    `{host}` in `url` and `command` is replaced with the client's host.
+    """
+
+    type: str  # "tcp", "http" or "command"
+    port: Optional[int] = None  # tcp
+    url: Optional[str] = None  # http
+    expect_status: int = 200  # http
+    verify_tls: bool = True  # http, off for self-signed certificates
+    command: Optional[str] = None  # command, ready when it exits with 0
+    timeout_sec: float = DEFAULT_CHECK_TIMEOUT
+
+    def describe(self) -> str:
+        if self.type == "tcp":
+            return f"tcp:{self.port}"
+        if self.type == "http":
+            return self.url
+        return self.command
+
+
+def _check_tcp(host: str, check: ReadinessCheck) -> bool:
+    with socket.create_connection((host, check.port), timeout=check.timeout_sec):
+        return True
+
+
+def _check_http(host: str, check: ReadinessCheck) -> bool:
+    context = None
+    if not check.verify_tls:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    url = check.url.replace("{host}", host)
+    try:
+        with urllib.request.urlopen(
+            url, timeout=check.timeout_sec, context=context
+        ) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status == check.expect_status
+
+
+def _check_command(host: str, check: ReadinessCheck) -> bool:
+    result = subprocess.run(
+        [arg.replace("{host}", host) for arg in shlex.split(check.command)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        timeout=check.timeout_sec,
+        check=False,
+    )
+    return result.returncode == 0
+
+
+_CHECKS = {"tcp": _check_tcp, "http": _check_http, "command": _check_command}
+
+
+def run_check(host: str, check: ReadinessCheck) -> bool:
+    """
+    Runs one readiness check against a host.
+
+    Returns:
+        bool: Whether the check passed. Errors and timeouts count as failures.
+    """
+    try:
+        passed = _CHECKS[check.type](host, check)
+    except (
+        OSError,
+        http.client.HTTPException,
+        subprocess.SubprocessError,
+        ValueError,
+    ) as e:
+        # urllib's URLError and socket timeouts are OSErrors, a port that
+        # doesn't speak HTTP raises an HTTPException such as BadStatusLine
+        logger.debug("Readiness check %s failed for %s: %s", check.describe(), host, e)
+        return False
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Readiness check %s for %s: %s",
+            check.describe(),
+            host,
+            "passed" if passed else "failed",
+        )
+    return passed
+
+
+def check_readiness(
+    clients: dict[str, tuple[str, list[ReadinessCheck]]], max_concurrency: int
+) -> dict[str, bool]:
+    """
+    Runs the readiness checks of several clients in parallel.
+
+    Args:
+        clients (dict): (host, checks) keyed by client name.
+        max_concurrency (int): Maximum number of checks in flight at once.
+
+    Returns:
+        dict[str, bool]: Whether every check of each client passed, by name.
+    """
+    jobs = [
+        (name, host, check)
+        for name, (host, checks) in clients.items()
+        for check in checks
+    ]
+    if not jobs:
+        return {name: True for name in clients}
+
+    workers = max(1, min(max_concurrency, len(jobs)))
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="readiness"
+    ) as pool:
+        passed = pool.map(lambda job: run_check(job[1], job[2]), jobs)
+        ready = {name: True for name in clients}
+        for (name, _, _), ok in zip(jobs, passed):
+            ready[name] = ready[name] and ok
+    return ready
@@ -0,0 +1,47 @@
+import random
+from dataclasses import dataclass
+
+DEFAULT_REATTEMPT_DELAY = 30
+DEFAULT_RETRY_MAX_DELAY = 300
+_MAX_BACKOFF_EXPONENT = 32  # Far beyond any max delay, avoids float overflow
+
+
+@dataclass
+class RetryPolicy:
+    """
+    When to send a client that hasn't come back another WOL packet.
+
+    The n-th retry waits `reattempt_delay * backoff ** (n - 1)` seconds,
+    capped at `max_delay_sec` and spread by +/- `jitter` (a fraction of the
+    delay), but never less than the client's expected boot time: a packet
+    that worked needs that long to show. `max_attempts` caps the packets
+    sent per outage, 0 keeps retrying until the client timeout.
+    """
+
+    reattempt_delay: float = DEFAULT_REATTEMPT_DELAY
+    backoff: float = 1.0
+    max_delay_sec: float = DEFAULT_RETRY_MAX_DELAY
+    jitter: float = 0.0
+    max_attempts: int = 0
+
+    def delay(self, attempt: int, boot_time: float = 0, rng=random) -> float:
+        """
+        Returns how long to wait after a client's `attempt`-th WOL packet.
+
+        Args:
+            attempt (int): How many packets the client has been sent, from 1.
+            boot_time (float): The client's expected boot time.
+            rng: The source of jitter, e.g. a seeded `random.Random`.
+        """
+        exponent = min(max(attempt - 1, 0), _MAX_BACKOFF_EXPONENT)
+        delay = min(
+            self.reattempt_delay * self.backoff**exponent,
+            max(self.max_delay_sec, self.reattempt_delay),
+        )
+        if self.jitter:
+            delay *= 1 + rng.uniform(-self.jitter, self.jitter)
+        return max(delay, boot_time)
+
+    def exhausted(self, attempts: int) -> bool:
+        """Whether a client that was sent `attempts` packets gets no more."""
+        return 0 < self.max_attempts <= attempts
@@ -0,0 +1,96 @@
+import heapq
+import itertools
+import threading
+from typing import Optional
+
+from wolnut.clock import SYSTEM_CLOCK, Clock
+
+
+class DeadlineScheduler:
+    """
+    Tracks named deadlines in a heap and sleeps until the earliest one is due.
+
+    Each key has at most one deadline; scheduling a key again replaces its
+    previous deadline. Stale heap entries are discarded lazily when they
+    reach the top, so schedule and cancel are O(log n) and O(1).
+    """
+
+    def __init__(self, clock: Clock = None):
+        self.clock = clock or SYSTEM_CLOCK
+        self._heap: list[tuple[float, int, str]] = []
+        self._deadlines: dict[str, tuple[float, int]] = {}
+        self._counter = itertools.count()
+        self._wakeup = threading.Event()
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._deadlines
+
+    def schedule(self, key: str, when: float):
+        """Sets the deadline for `key`, replacing any existing one."""
+        current = self._deadlines.get(key)
+        if current is not None and current[0] == when:
+            return
+        entry_id = next(self._counter)
+        self._deadlines[key] = (when, entry_id)
+        heapq.heappush(self._heap, (when, entry_id, key))
+
+    def cancel(self, key: str):
+        self._deadlines.pop(key, None)
+
+    def deadline(self, key: str) -> Optional[float]:
+        entry = self._deadlines.get(key)
+        return entry[0] if entry else None
+
+    def _discard_stale(self):
+        while self._heap:
+            when, entry_id, key = self._heap[0]
+            if self._deadlines.get(key) == (when, entry_id):
+                return
+            heapq.heappop(self._heap)
+
+    def next_deadline(self) -> Optional[tuple[str, float]]:
+        """Returns the earliest (key, deadline) pair, or None if nothing is scheduled."""
+        self._discard_stale()
+        if not self._heap:
+            return None
+        when, _, key = self._heap[0]
+        return key, when
+
+    def pop_due(self, now: Optional[float] = None) -> list[str]:
+        """Removes and returns every key whose deadline has passed, earliest first."""
+        now = self.clock.time() if now is None else now
+        due = []
+        while True:
+            upcoming = self.next_deadline()
+            if upcoming is None or upcoming[1] > now:
+                return due
+            heapq.heappop(self._heap)
+            del self._deadlines[upcoming[0]]
+            due.append(upcoming[0])
+
+    def wake(self):
+        """Interrupts a pending `wait`, e.g. when an external event arrives."""
+        self._wakeup.set()
+
+    def wait(self, max_wait: Optional[float] = None) -> list[str]:
+        """
+        Sleeps until the earliest deadline, `max_wait` seconds or a `wake` call.
+
+        Args:
+            max_wait (float | None): Upper bound on the sleep in seconds.
+
+        Returns:
+            list[str]: The keys that are due when the sleep ends.
+        """
+        upcoming = self.next_deadline()
+        timeout = max_wait
+        if upcoming is not None:
+            until_due = max(0.0, upcoming[1] - self.clock.time())
+            timeout = until_due if timeout is None else min(timeout, until_due)
+
+        self.clock.wait(self._wakeup, timeout)
+        self._wakeup.clear()
+        return self.pop_due()
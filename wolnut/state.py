@@ -1,15 +1,92 @@
 import json
 import logging
-import time
+import os
 
+from dataclasses import dataclass, fields
 from hashlib import md5
 from pathlib import Path
 from typing import Dict, Any, Optional, List
 
+from wolnut.clock import SYSTEM_CLOCK, Clock
+from wolnut.metrics import STATE_SAVES
+
 logger = logging.getLogger("wolnut")
 
 DEFAULT_STATE_FILEPATH = "/config/wolnut_state.json"
 ASSUME_UNINITIALIZED_ONLINE = False  # Assume clients are online if no state file exists
+DEFAULT_JOURNAL_COMPACT_EVERY = 500  # Journal records between snapshots
+STATE_SCHEMA_VERSION = 2  # Version 1 files have no "version" key
+
+
+@dataclass(slots=True)
+class ClientState:
+    """The tracked state of one client."""
+
+    was_online_before_battery: bool = ASSUME_UNINITIALIZED_ONLINE
+    is_online: bool = False  # Answers probes
+    is_ready: bool = False  # Answers probes and passes its readiness checks
+    wol_sent: bool = False
+    wol_sent_at: int = 0
+    wol_attempts: int = 0  # WOL packets sent during this outage
+    wol_retry_at: float = 0  # Earliest next WOL packet, from the retry policy
+    skip: bool = False
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ClientState":
+        """Builds a state from a saved record, ignoring unknown fields."""
+        return cls(**{key: data[key] for key in CLIENT_STATE_FIELDS if key in data})
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Every field is a scalar, so asdict's recursive copy isn't needed
+        return {key: getattr(self, key) for key in CLIENT_STATE_FIELDS}
+
+
+CLIENT_STATE_FIELDS = tuple(f.name for f in fields(ClientState))
+_UNKNOWN_CLIENT = ClientState()  # Read-only stand-in for untracked clients
+
+
+def serialize_state(
+    meta: Dict[str, Any],
+    clients: Dict[str, ClientState],
+    ups: Dict[str, Dict[str, Any]],
+    generation: int = 0,
+) -> Dict[str, Any]:
+    """Converts the tracked state into the current status file layout."""
+    return {
+        "version": STATE_SCHEMA_VERSION,
+        "generation": generation,
+        "meta": meta,
+        "clients": {name: state.to_dict() for name, state in clients.items()},
+        "ups": ups,
+    }
+
+
+def deserialize_state(save_data: Dict[str, Any]) -> tuple:
+    """
+    Reads a status file written by this or an earlier version of WOLNUT.
+
+    Returns:
+        tuple: The meta state, client states, per-UPS states and the
+        snapshot's generation.
+
+    Raises:
+        ValueError: If the file was written by a newer, unknown schema.
+    """
+    version = save_data.get("version", 1)
+    if version > STATE_SCHEMA_VERSION:
+        raise ValueError(f"Unsupported state file version: {version}")
+
+    # Version 1 had the same client records but no per-UPS state
+    clients = {
+        name: ClientState.from_dict(data)
+        for name, data in save_data.get("clients", {}).items()
+    }
+    return (
+        save_data["meta"],
+        clients,
+        save_data.get("ups", {}),
+        save_data.get("generation", 0),
+    )
 
 
 class ClientStateTracker:
@@ -20,29 +97,51 @@ class ClientStateTracker:
     Attributes:
         _clients (list): List of clients being tracked.
         _status_file (str): Path to the JSON file for persisting state.
-        _client_states (dict): Tracks per-client status info.
+        _client_states (dict): Tracks a ClientState per client name.
         _meta_state (dict): Tracks global UPS-related status.
+        _journal (bool): Whether changes are appended to a journal instead of
+            rewriting the whole status file on every save.
 
     Methods:
         update(client_name, online): Updates online status.
+        update_many(results): Updates online status for a batch of clients.
+        update_ready_many(results): Updates readiness for a batch of clients.
         mark_wol_sent(client_name): Marks a client as having been sent a WOL packet.
+        mark_wol_sent_many(client_names): Marks a batch of clients as sent a WOL packet.
         reset(): Clears all stored state information.
         ...
     """
 
-    def __init__(self, clients: List[Any], status_file: str):
+    def __init__(
+        self,
+        clients: List[Any],
+        status_file: str,
+        journal: bool = False,
+        compact_every: int = DEFAULT_JOURNAL_COMPACT_EVERY,
+        clock: Clock = None,
+    ):
         # Search default locations for existing state file
         if not status_file:
             raise ValueError("A status file must be specified.")
 
         self._status_file = Path(status_file)  # Filename for storing state data
+        self._clock = clock or SYSTEM_CLOCK
+        self._journal_file = self._status_file.with_suffix(".journal")
+        self._journal = journal
+        self._compact_every = compact_every
+        self._journal_records = 0  # Records appended since the last snapshot
+        # Bumped by every snapshot that supersedes a journal. Records are
+        # stamped with it, so ones left behind by a crash are not replayed.
+        self._generation = 0
+        self._pending: Dict[str, Any] = {}  # Changes not yet journaled
         self._status_hash = None  # Hash of the current/previous status file contents
         self._dirty = False  # Whether the state has changed since last save
         self._meta_state: Dict[str, Any] = {
             "ups_on_battery": False,
             "battery_percent_at_shutdown": 100,
         }
-        self._client_states: Dict[str, Dict[str, Any]] = {}
+        self._client_states: Dict[str, ClientState] = {}
+        self._ups_states: Dict[str, Dict[str, Any]] = {}
 
         # Load existing state from file first
         if self._status_file.exists():
@@ -51,13 +150,11 @@ class ClientStateTracker:
         # Initialize any clients not in the loaded state
         for client in clients:
             if client.name not in self._client_states:
-                self._client_states[client.name] = {
-                    "was_online_before_battery": ASSUME_UNINITIALIZED_ONLINE,
-                    "is_online": False,
-                    "wol_sent": False,
-                    "wol_sent_at": 0,
-                    "skip": False,
-                }
+                self._client_states[client.name] = ClientState()
+
+        # Replay changes made after the last snapshot on top of it
+        if self._journal_file.exists():
+            self._replay_journal()
 
     def _load_state(self):
         """
@@ -70,9 +167,13 @@ class ClientStateTracker:
             # Remember the hash of the loaded data to avoid unnecessary writes later
             # I'm aware that md5 is not cryptographically secure, but this is not a security use case.
             status_hash = md5(raw_data.encode("utf-8")).hexdigest()
-            save_data = json.loads(raw_data)
-            self._meta_state.update(save_data["meta"])
-            self._client_states = save_data.get("clients", {})
+            meta_state, client_states, ups_states, generation = deserialize_state(
+                json.loads(raw_data)
+            )
+            self._meta_state.update(meta_state)
+            self._client_states = client_states
+            self._ups_states = ups_states
+            self._generation = generation
             self._status_hash = status_hash
             logger.info("State loaded from %s", self._status_file)
         except Exception as e:
@@ -87,16 +188,26 @@ class ClientStateTracker:
         if not self._dirty:
             return
 
-        save_data = {"meta": self._meta_state, "clients": self._client_states}
+        if self._journal and self._journal_records < self._compact_every:
+            self._append_journal()
+            return
+
         try:
-            # Make it pretty for humans
-            raw_data = json.dumps(
-                save_data, indent=4, separators=(",", ": "), sort_keys=True
-            )
+            raw_data = self._serialize(self._generation)
             new_hash = md5(raw_data.encode("utf-8")).hexdigest()
             if self._status_hash == new_hash:
                 logging.debug("State unchanged, skipping save.")
+                STATE_SAVES.inc(result="skipped")
+                if self._journal_records:
+                    self._pending.clear()
+                    self._truncate_journal()
                 return
+            generation = self._generation
+            if self._journal_records:
+                # Supersede the journal, which is only removed after the replace
+                generation += 1
+                raw_data = self._serialize(generation)
+                new_hash = md5(raw_data.encode("utf-8")).hexdigest()
         except Exception:
             logger.exception("Failed to serialize state to JSON.")
             return
@@ -119,78 +230,349 @@ class ClientStateTracker:
                 temp_state_file,
                 self._status_file,
             )
+            return
 
+        self._generation = generation
         self._status_hash = new_hash
         self._dirty = False
+        self._pending.clear()
+        if self._journal_records:
+            self._truncate_journal()
+        STATE_SAVES.inc(result="written")
         logger.debug("State saved to %s", self._status_file)
 
-    def update(self, client_name: str, online: bool):
-        if (
-            client_name in self._client_states
-            and self._client_states[client_name]["is_online"] != online
-        ):
-            self._client_states[client_name]["is_online"] = online
+    def _serialize(self, generation: int) -> str:
+        save_data = serialize_state(
+            self._meta_state, self._client_states, self._ups_states, generation
+        )
+        # Make it pretty for humans
+        return json.dumps(save_data, indent=4, separators=(",", ": "), sort_keys=True)
+
+    def _append_journal(self):
+        """
+        Appends the changes since the last save as one compact JSON line,
+        stamped with the generation of the snapshot it applies to.
+        """
+        if not self._pending:
+            self._dirty = False
+            STATE_SAVES.inc(result="skipped")
+            return
+
+        try:
+            record = json.dumps(
+                {"generation": self._generation, **self._pending},
+                separators=(",", ":"),
+            )
+            with self._journal_file.open("a") as f:
+                f.write(record + "\n")
+        except Exception:
+            logger.exception(
+                "Failed to append to state journal: '%s'", self._journal_file
+            )
+            return
+
+        self._journal_records += 1
+        self._pending = {}
+        self._dirty = False
+        STATE_SAVES.inc(result="appended")
+
+    def _replay_journal(self):
+        """
+        Applies journaled changes on top of the loaded snapshot.
+
+        A crash while appending can leave a truncated last line, so replay
+        stops at the first record that cannot be parsed. The next save then
+        writes a snapshot that replaces the damaged journal. Records from an
+        older generation than the snapshot are already part of it, left
+        behind by a crash before the journal was removed, and are skipped.
+        """
+        try:
+            with self._journal_file.open("r") as f:
+                lines = f.readlines()
+        except Exception as e:
+            logger.warning("Failed to read state journal: %s", e)
+            return
+
+        replayed = 0
+        stale = 0
+        damaged = False
+        for line_number, line in enumerate(lines, start=1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(
+                    "Ignoring damaged state journal from line %s: '%s'",
+                    line_number,
+                    self._journal_file,
+                )
+                damaged = True
+                break
+            if record.get("generation", 0) < self._generation:
+                stale += 1
+                continue
+            self._meta_state.update(record.get("meta", {}))
+            for name, values in record.get("ups", {}).items():
+                self._ups_states.setdefault(name, {}).update(values)
+            for name, values in record.get("clients", {}).items():
+                client_state = self._client_states.setdefault(name, ClientState())
+                for key, value in values.items():
+                    if key in CLIENT_STATE_FIELDS:
+                        setattr(client_state, key, value)
+            replayed += 1
+        self._journal_records = replayed
+
+        if damaged or stale or not self._journal:
+            # Fold everything into a fresh snapshot on the next save
+            self._journal_records = self._compact_every
             self._dirty = True
+        if stale:
+            logger.info(
+                "Skipped %s state changes already saved to %s",
+                stale,
+                self._status_file,
+            )
+        logger.info("Replayed %s state changes from %s", replayed, self._journal_file)
+
+    def _truncate_journal(self):
+        self._journal_records = 0
+        try:
+            os.remove(self._journal_file)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.exception("Failed to remove state journal: '%s'", self._journal_file)
+
+    def update(self, client_name: str, online: bool):
+        if client_name in self._client_states:
+            self._set_client_values(client_name, is_online=online)
+
+    def update_many(self, results: Dict[str, bool]):
+        """Applies a batch of probe results keyed by client name."""
+        states = self._client_states
+        for client_name, online in results.items():
+            # Most clients don't change between sweeps
+            state = states.get(client_name)
+            if state is not None and state.is_online != online:
+                self._set_client_values(client_name, is_online=online)
+
+    def update_ready_many(self, results: Dict[str, bool]):
+        """Applies a batch of readiness results keyed by client name."""
+        states = self._client_states
+        for client_name, ready in results.items():
+            state = states.get(client_name)
+            if state is not None and state.is_ready != ready:
+                self._set_client_values(client_name, is_ready=ready)
 
-    def mark_wol_sent(self, client_name: str):
+    def mark_wol_sent(self, client_name: str, retry_delay: float = 0):
+        """
+        Records a WOL packet sent to a client.
+
+        Args:
+            client_name (str): The client.
+            retry_delay (float): How long its retry policy waits before the
+                next packet.
+        """
         if client_name in self._client_states:
-            self._client_states[client_name]["wol_sent"] = True
-            self._client_states[client_name]["wol_sent_at"] = int(time.time())
-            self._dirty = True
+            now = self._clock.time()
+            self._set_client_values(
+                client_name,
+                wol_sent=True,
+                wol_sent_at=int(now),
+                wol_attempts=self._client_states[client_name].wol_attempts + 1,
+                wol_retry_at=round(now + retry_delay, 3),
+            )
+
+    def mark_wol_sent_many(
+        self, client_names: List[str], retry_delays: Optional[Dict[str, float]] = None
+    ):
+        """Marks a batch of clients as having been sent a WOL packet."""
+        retry_delays = retry_delays or {}
+        for client_name in client_names:
+            self.mark_wol_sent(client_name, retry_delays.get(client_name, 0))
 
     def mark_skip(self, client_name: str):
-        if client_name in self._client_states and not self._client_states[
-            client_name
-        ].get("skip", False):
-            self._client_states[client_name]["skip"] = True
-            self._dirty = True
+        if client_name in self._client_states:
+            self._set_client_values(client_name, skip=True)
+
+    def mark_all_online_clients(self, client_names: Optional[List[str]] = None):
+        """
+        Snapshots which clients are online, e.g. when a UPS switches to battery.
 
-    def mark_all_online_clients(self):
+        Args:
+            client_names (list | None): Only snapshot these clients, such as
+                the ones powered by the UPS that lost power. Defaults to all.
+        """
+        if client_names is not None:
+            client_names = set(client_names)
         for name, state in self._client_states.items():
-            state["was_online_before_battery"] = state["is_online"]
+            if client_names is not None and name not in client_names:
+                continue
+            self._set_client_values(name, was_online_before_battery=state.is_online)
             self._dirty = True
 
+    def sync_clients(self, client_names: List[str]):
+        """
+        Tracks exactly these clients, e.g. after a configuration reload.
+
+        Clients that are still configured keep their state, so a reload in
+        the middle of an outage doesn't forget who was online before it.
+        """
+        names = set(client_names)
+        removed = [name for name in self._client_states if name not in names]
+        for name in removed:
+            del self._client_states[name]
+            self._pending.get("clients", {}).pop(name, None)
+        added = [name for name in client_names if name not in self._client_states]
+        for name in added:
+            self._client_states[name] = ClientState()
+            self._pending.setdefault("clients", {})[name] = ClientState().to_dict()
+
+        if removed:
+            # The journal can't record removals, so write a snapshot instead
+            self._journal_records = self._compact_every
+        if added or removed:
+            self._dirty = True
+
+    def _client_state(self, client_name: str) -> ClientState:
+        return self._client_states.get(client_name, _UNKNOWN_CLIENT)
+
+    def get_client_state(self, client_name: str) -> Dict[str, Any]:
+        """Returns a copy of a client's tracked state."""
+        return self._client_state(client_name).to_dict()
+
     def is_online(self, client_name: str) -> bool:
-        return self._client_states.get(client_name, {}).get("is_online", False)
+        return self._client_state(client_name).is_online
+
+    def is_ready(self, client_name: str) -> bool:
+        return self._client_state(client_name).is_ready
 
     def was_online_before_shutdown(self, client_name: str) -> bool:
-        return self._client_states.get(client_name, {}).get(
-            "was_online_before_battery", False
-        )
+        return self._client_state(client_name).was_online_before_battery
 
     def has_been_wol_sent(self, client_name: str) -> bool:
-        return self._client_states.get(client_name, {}).get("wol_sent", False)
+        return self._client_state(client_name).wol_sent
+
+    def wol_attempts(self, client_name: str) -> int:
+        return self._client_state(client_name).wol_attempts
 
-    def should_attempt_wol(self, client_name: str, reattempt_delay: int) -> bool:
-        state = self._client_states.get(client_name, {})
-        last = state.get("wol_sent_at", 0)
-        return time.time() - last >= reattempt_delay
+    def should_attempt_wol(self, client_name: str, reattempt_delay: int = 0) -> bool:
+        """
+        Whether a client is due another WOL packet.
+
+        Args:
+            client_name (str): The client.
+            reattempt_delay (int): A minimum time since the last packet, on
+                top of the retry time recorded by `mark_wol_sent`.
+        """
+        return self._clock.time() >= self.next_wol_attempt_at(
+            client_name, reattempt_delay
+        )
+
+    def next_wol_attempt_at(self, client_name: str, reattempt_delay: int = 0) -> float:
+        """Returns the timestamp from which `should_attempt_wol` will be true."""
+        state = self._client_state(client_name)
+        return max(state.wol_sent_at + reattempt_delay, state.wol_retry_at)
 
     def should_skip(self, client_name: str) -> bool:
-        return self._client_states.get(client_name, {}).get("skip", False)
+        return self._client_state(client_name).skip
 
-    def set_ups_on_battery(self, is_on_battery: bool, battery_percent: int = 100):
-        if self._meta_state["ups_on_battery"] != is_on_battery:
-            self._meta_state["ups_on_battery"] = is_on_battery
-            self._dirty = True
+    def _set_state_values(
+        self, state: Dict[str, Any], section: str, name: Optional[str] = None, **values
+    ):
+        """
+        Updates a meta or UPS record, remembering what changed for the journal.
 
-        if self._meta_state["battery_percent_at_shutdown"] != battery_percent:
-            self._meta_state["battery_percent_at_shutdown"] = battery_percent
-            self._dirty = True
+        Args:
+            state (dict): The record to update.
+            section (str): "meta" or "ups".
+            name (str | None): The UPS the record belongs to.
+        """
+        for key, value in values.items():
+            if state.get(key) != value:
+                state[key] = value
+                self._dirty = True
+                if section == "meta":
+                    self._pending.setdefault(section, {})[key] = value
+                else:
+                    pending = self._pending.setdefault(section, {})
+                    pending.setdefault(name, {})[key] = value
+
+    def _set_client_values(self, client_name: str, **values):
+        state = self._client_states[client_name]
+        pending = None
+        for key, value in values.items():
+            if getattr(state, key) != value:
+                setattr(state, key, value)
+                self._dirty = True
+                if pending is None:
+                    pending = self._pending.setdefault("clients", {})
+                    pending = pending.setdefault(client_name, {})
+                pending[key] = value
+
+    def set_ups_on_battery(
+        self, is_on_battery: bool, battery_percent: int = 100, ups: Optional[str] = None
+    ):
+        """
+        Records whether a UPS is on battery.
+
+        Args:
+            is_on_battery (bool): Whether the UPS is running on battery.
+            battery_percent (int): The battery charge at the time.
+            ups (str | None): The UPS label. Defaults to every tracked UPS.
+        """
+        values = {
+            "ups_on_battery": is_on_battery,
+            "battery_percent_at_shutdown": battery_percent,
+        }
+        if ups is None:
+            for label, ups_state in self._ups_states.items():
+                self._set_state_values(ups_state, "ups", label, **values)
+        else:
+            self._set_state_values(
+                self._ups_states.setdefault(ups, {}), "ups", ups, **values
+            )
+            values["ups_on_battery"] = any(
+                ups_state["ups_on_battery"] for ups_state in self._ups_states.values()
+            )
+
+        # The meta state summarizes all UPS units
+        self._set_state_values(self._meta_state, "meta", **values)
+
+    def was_ups_on_battery(self, ups: Optional[str] = None) -> bool:
+        """
+        Returns whether a UPS (by default, any UPS) was last seen on battery.
 
-    def was_ups_on_battery(self) -> bool:
-        return self._meta_state["ups_on_battery"]
-
-    def reset(self):
-        for state in self._client_states.values():
-            state.update(
-                {
-                    "was_online_before_battery": False,
-                    "wol_sent": False,
-                    "wol_sent_at": 0,
-                    "skip": False,
-                }
+        State files written before UPS units were tracked separately only
+        have the summary, which is then used for every UPS.
+        """
+        if ups is None or ups not in self._ups_states:
+            return self._meta_state["ups_on_battery"]
+        return self._ups_states[ups]["ups_on_battery"]
+
+    def reset(
+        self, client_names: Optional[List[str]] = None, ups: Optional[str] = None
+    ):
+        """
+        Clears the outage state of clients and UPS units.
+
+        Args:
+            client_names (list | None): Only reset these clients. Defaults to all.
+            ups (str | None): Only reset this UPS. Defaults to all.
+        """
+        if client_names is not None:
+            client_names = set(client_names)
+        for name, state in self._client_states.items():
+            if client_names is not None and name not in client_names:
+                continue
+            self._set_client_values(
+                name,
+                was_online_before_battery=False,
+                wol_sent=False,
+                wol_sent_at=0,
+                wol_attempts=0,
+                wol_retry_at=0,
+                skip=False,
             )
         # Also reset the meta state for a complete reset
-        self.set_ups_on_battery(False)
+        self.set_ups_on_battery(False, ups=ups)
         self._dirty = True
@@ -0,0 +1,146 @@
+import ipaddress
+import logging
+import socket
+import struct
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from wolnut import netlink
+from wolnut.wol import DEFAULT_BROADCAST_IP, WolTarget
+
+logger = logging.getLogger("wolnut")
+
+# From linux/rtnetlink.h and linux/if_addr.h
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_BROADCAST = 4
+RT_SCOPE_HOST = 254
+
+_IFADDRMSG = struct.Struct("=BBBBI")  # family, prefixlen, flags, scope, index
+
+
+@dataclass(frozen=True)
+class Subnet:
+    """An IPv4 subnet this host has an address on."""
+
+    interface: str
+    network: ipaddress.IPv4Network
+    broadcast: str
+
+
+def parse_addresses(
+    messages: Iterable[tuple[int, bytes]],
+    index_name: Callable[[int], str] = socket.if_indextoname,
+) -> list[Subnet]:
+    """
+    Turns an RTM_GETADDR dump into the subnets that can take a broadcast.
+
+    Loopback addresses and /31 and /32 networks, which have no broadcast
+    address, are left out.
+
+    Args:
+        messages (Iterable): The type and body of each message of the dump.
+        index_name (Callable): Maps an interface index to its name.
+    """
+    subnets = []
+    for msg_type, body in messages:
+        if msg_type != RTM_NEWADDR or len(body) < _IFADDRMSG.size:
+            continue
+        family, prefix, _, scope, index = _IFADDRMSG.unpack_from(body)
+        if family != socket.AF_INET or scope == RT_SCOPE_HOST or prefix > 30:
+            continue
+        attributes = netlink.parse_attributes(body, _IFADDRMSG.size)
+        # IFA_ADDRESS is the peer on point-to-point links, IFA_LOCAL our own
+        address = attributes.get(IFA_LOCAL, attributes.get(IFA_ADDRESS))
+        if address is None:
+            continue
+        network = ipaddress.IPv4Network(
+            (socket.inet_ntoa(address), prefix), strict=False
+        )
+        broadcast = attributes.get(IFA_BROADCAST)
+        try:
+            interface = index_name(index)
+        except OSError:
+            continue  # Removed since the dump
+        subnets.append(
+            Subnet(
+                interface=interface,
+                network=network,
+                broadcast=(
+                    socket.inet_ntoa(broadcast)
+                    if broadcast is not None
+                    else str(network.broadcast_address)
+                ),
+            )
+        )
+    return subnets
+
+
+def local_subnets() -> list[Subnet]:
+    """
+    Lists the IPv4 subnets of this host's interfaces over rtnetlink.
+
+    Raises:
+        OSError: If the host has no rtnetlink, e.g. it is not Linux.
+    """
+    return parse_addresses(
+        netlink.dump(RTM_GETADDR, _IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0))
+    )
+
+
+def find_subnet(
+    host: str, subnets: list[Subnet], interface: Optional[str] = None
+) -> Optional[Subnet]:
+    """
+    Finds the most specific local subnet a host is on.
+
+    Args:
+        host (str): An IPv4 address or a hostname to resolve.
+        subnets (list[Subnet]): The local subnets, see `local_subnets`.
+        interface (str | None): Only consider the subnets of this interface.
+    """
+    candidates = [s for s in subnets if interface in (None, s.interface)]
+    if not candidates:
+        return None
+    try:
+        ip = ipaddress.IPv4Address(socket.gethostbyname(host))
+    except (OSError, ValueError) as e:
+        logger.debug("Could not resolve %s to find its subnet: %s", host, e)
+        return None
+    matches = [s for s in candidates if ip in s.network]
+    return max(matches, key=lambda s: s.network.prefixlen, default=None)
+
+
+def wol_target(
+    host: str,
+    subnets: list[Subnet],
+    broadcast: Optional[str] = None,
+    interface: Optional[str] = None,
+    default_broadcast: str = DEFAULT_BROADCAST_IP,
+    transport: str = "udp",
+) -> WolTarget:
+    """
+    Works out where to send a client's WOL packets.
+
+    A configured broadcast address wins. Otherwise a client on one of the
+    local subnets is woken with that subnet's directed broadcast, sent out
+    of its interface, and any other client with `default_broadcast`. Raw
+    Ethernet frames only need the interface, which is also taken from the
+    client's subnet unless configured.
+
+    Args:
+        host (str): The client's address or hostname.
+        subnets (list[Subnet]): The local subnets, see `local_subnets`.
+        broadcast (str | None): The client's configured broadcast address.
+        interface (str | None): The client's configured interface.
+        default_broadcast (str): The address for clients on no local subnet.
+        transport (str): "udp" or "ethernet", see `wol.WOL_TRANSPORTS`.
+    """
+    if broadcast is None or (transport == "ethernet" and interface is None):
+        subnet = find_subnet(host, subnets, interface)
+        if subnet is not None:
+            broadcast = broadcast or subnet.broadcast
+            interface = subnet.interface
+    return WolTarget(broadcast or default_broadcast, interface, transport)
@@ -0,0 +1,170 @@
+import bisect
+import json
+import logging
+import threading
+
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from wolnut.clock import VirtualClock
+from wolnut.config import WolnutConfig
+from wolnut.daemon import WolnutDaemon
+
+logger = logging.getLogger("wolnut")
+
+
+class TraceRecorder:
+    """
+    Appends every UPS reading and probe sweep to a JSON lines trace file.
+
+    Each line is either `{"time": ..., "ups": <label>, "status": {...}}`,
+    `{"time": ..., "probe": {<host>: <rtt or null>}}` or, for clients with
+    readiness checks, `{"time": ..., "ready": {<client>: <bool>}}`.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._file = self.path.open("a", buffering=1)
+        logger.info("Recording UPS and probe readings to %s", self.path)
+
+    def _write(self, record: Dict[str, Any]):
+        line = json.dumps(record, separators=(",", ":"))
+        with self._lock:
+            try:
+                self._file.write(line + "\n")
+            except OSError as e:
+                logger.warning("Failed to record trace to '%s': %s", self.path, e)
+
+    def record_ups(self, ups: str, status: Dict[str, str], at: float):
+        self._write({"time": at, "ups": ups, "status": status})
+
+    def record_probe(self, rtts: Dict[str, Optional[float]], at: float):
+        self._write({"time": at, "probe": rtts})
+
+    def record_ready(self, ready: Dict[str, bool], at: float):
+        self._write({"time": at, "ready": ready})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Trace:
+    """
+    A recorded trace, answering what the UPS and probes reported at a time.
+
+    Between recordings the latest earlier reading applies, so a replay can
+    poll and probe at different moments than the recorded run did. A probe
+    record only covers the clients probed in that sweep, so each host keeps
+    its own readings.
+    """
+
+    def __init__(self, records: Iterable[Dict[str, Any]]):
+        self._ups: Dict[str, tuple[list, list]] = {}
+        self._probe: Dict[str, tuple[list, list]] = {}
+        self._ready: Dict[str, tuple[list, list]] = {}
+        times = []
+        for record in sorted(records, key=lambda record: record["time"]):
+            times.append(record["time"])
+            if "ups" in record:
+                readings = self._ups.setdefault(record["ups"], ([], []))
+                readings[0].append(record["time"])
+                readings[1].append(record["status"])
+            elif "probe" in record:
+                for host, rtt in record["probe"].items():
+                    readings = self._probe.setdefault(host, ([], []))
+                    readings[0].append(record["time"])
+                    readings[1].append(rtt)
+            elif "ready" in record:
+                for name, ready in record["ready"].items():
+                    readings = self._ready.setdefault(name, ([], []))
+                    readings[0].append(record["time"])
+                    readings[1].append(ready)
+        if not times:
+            raise ValueError("The trace is empty")
+        self.start = times[0]
+        self.end = times[-1]
+
+    @classmethod
+    def load(cls, path: str) -> "Trace":
+        """
+        Reads a trace file, skipping a last line cut short by a crash.
+        """
+        records = []
+        with open(path, "r") as f:
+            for line_number, line in enumerate(f, start=1):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping damaged trace line %s", line_number)
+        return cls(records)
+
+    @property
+    def ups_labels(self) -> list[str]:
+        return list(self._ups)
+
+    @staticmethod
+    def _latest(readings: tuple[list, list], at: float):
+        index = bisect.bisect_right(readings[0], at) - 1
+        # Before the first reading, the first one is the best guess
+        return readings[1][max(index, 0)] if readings[0] else None
+
+    def ups_status(self, ups: str, at: float) -> Dict[str, str]:
+        readings = self._ups.get(ups)
+        return (self._latest(readings, at) if readings else None) or {}
+
+    def probe_rtts(self, hosts: Iterable[str], at: float) -> Dict[str, Optional[float]]:
+        return {
+            host: self._latest(self._probe[host], at) if host in self._probe else None
+            for host in hosts
+        }
+
+    def readiness(self, names: Iterable[str], at: float) -> Dict[str, bool]:
+        # Clients checked in the recording are ready when they were, the others
+        # (e.g. traces recorded before the checks were configured) straight away
+        return {
+            name: self._latest(self._ready[name], at) if name in self._ready else True
+            for name in names
+        }
+
+
+class ReplayDaemon(WolnutDaemon):
+    """
+    Runs the real control loop against a recorded trace in virtual time.
+
+    UPS readings and probe results come from the trace and WOL packets are
+    only logged, so a recorded outage of several hours replays in seconds.
+    Clients come back online when they did in the recording, not in
+    response to the replayed WOL packets.
+    """
+
+    def __init__(self, config: WolnutConfig, trace: Trace):
+        super().__init__(config, clock=VirtualClock(trace.start))
+        self.trace = trace
+        self.wol_sent: list[tuple[float, list[str]]] = []
+
+    def read_ups_status(self, unit) -> dict:
+        return self.trace.ups_status(unit.label, self.clock.time())
+
+    def read_probe_rtts(self, hosts: list[str]) -> dict:
+        return self.trace.probe_rtts(hosts, self.clock.time())
+
+    def check_readiness(self, clients: list) -> dict[str, bool]:
+        return self.trace.readiness([c.name for c in clients], self.clock.time())
+
+    def transmit_wol(self, packets: dict[str, bytes], targets: dict) -> dict[str, bool]:
+        self.wol_sent.append((self.clock.time() - self.trace.start, list(packets)))
+        return {name: True for name in packets}
+
+    def replay(self):
+        """Steps through the whole trace, deadline by deadline."""
+        missing = [
+            unit.label for unit in self.units if unit.label not in self.trace.ups_labels
+        ]
+        for label in missing:
+            logger.warning("The trace has no readings for UPS %s", label)
+
+        while self.clock.time() <= self.trace.end:
+            self.step()
+            self.scheduler.wait()
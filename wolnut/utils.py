@@ -1,9 +1,18 @@
 import subprocess
 import re
 import logging
+import socket
+
+from typing import Iterable
+
+from wolnut.monitor import DEFAULT_PROBE_CONCURRENCY, DEFAULT_PROBE_METHOD, probe_rtts
 
 logger = logging.getLogger("wolnut")
 
+PROC_NET_ARP = "/proc/net/arp"
+DEFAULT_MAC_RESOLVE_TIMEOUT = 2.0
+MAC_PATTERN = re.compile(r"(([0-9A-Fa-f]{1,2}[:\-]){5}[0-9A-Fa-f]{1,2})")
+
 
 def validate_mac_format(mac: str) -> bool:
     """
@@ -51,3 +60,96 @@ def resolve_mac_from_host(host: str) -> str | None:
         logger.warning("Failed to resolve ARP for: %s: %s", host, e)
 
     return None
+
+
+def _normalize_mac(mac: str) -> str:
+    return ":".join(part.zfill(2) for part in re.split(r"[:\-]", mac)).lower()
+
+
+def read_arp_table(path: str = PROC_NET_ARP) -> dict[str, str]:
+    """
+    Reads the kernel's IPv4 neighbor table in one go.
+
+    Uses /proc/net/arp where available and falls back to a single
+    `arp -an` call elsewhere.
+
+    Args:
+        path (str): Location of the kernel ARP table.
+
+    Returns:
+        dict[str, str]: Lowercase colon-separated MAC addresses keyed by IP.
+    """
+    table = {}
+    try:
+        with open(path, "r") as f:
+            lines = f.read().splitlines()[1:]
+    except OSError:
+        lines = None
+
+    if lines is not None:
+        # IP address  HW type  Flags  HW address  Mask  Device
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 4 or int(fields[2], 16) & 0x2 == 0:
+                continue  # Incomplete entry
+            table[fields[0]] = _normalize_mac(fields[3])
+        return table
+
+    try:
+        result = subprocess.run(["arp", "-an"], capture_output=True, text=True)
+    except Exception as e:
+        logger.warning("Failed to read the ARP table: %s", e)
+        return table
+
+    # ? (192.168.1.10) at de:ad:be:ef:0:1 on en0 ifscope [ethernet]
+    for line in result.stdout.splitlines():
+        ip_match = re.search(r"\((\d+\.\d+\.\d+\.\d+)\)", line)
+        mac_match = MAC_PATTERN.search(line)
+        if ip_match and mac_match:
+            table[ip_match.group(1)] = _normalize_mac(mac_match.group(0))
+    return table
+
+
+def resolve_macs_from_hosts(
+    hosts: Iterable[str],
+    timeout: float = DEFAULT_MAC_RESOLVE_TIMEOUT,
+    max_concurrency: int = DEFAULT_PROBE_CONCURRENCY,
+    method: str = DEFAULT_PROBE_METHOD,
+) -> dict[str, str | None]:
+    """
+    Resolves the MAC addresses of many hosts at once.
+
+    All hosts are pinged in parallel so the kernel populates its neighbor
+    table, which is then read once and used for every host. With the ICMP
+    engine every host shares one `timeout`. The `ping` command fallback
+    only runs `max_concurrency` pings at a time, so with more hosts than
+    that the sweep takes up to `timeout` per batch. Hostnames are looked
+    up before the sweep starts.
+
+    Args:
+        hosts (Iterable[str]): IPs or hostnames.
+        timeout (float): Seconds to wait for each host to answer.
+        max_concurrency (int): Maximum number of `ping` commands in flight at once.
+        method (str): Probe method, see `wolnut.monitor.probe_rtts`.
+
+    Returns:
+        dict[str, str | None]: MAC address keyed by host, or None if the
+        host could not be resolved.
+    """
+    addresses = {}
+    for host in dict.fromkeys(hosts):
+        try:
+            addresses[host] = socket.gethostbyname(host)
+        except OSError as e:
+            logger.warning("Failed to resolve %s: %s", host, e)
+            addresses[host] = None
+
+    to_prime = [address for address in addresses.values() if address]
+    if to_prime:
+        probe_rtts(to_prime, max_concurrency, timeout, method)
+
+    table = read_arp_table()
+    return {
+        host: table.get(address) if address else None
+        for host, address in addresses.items()
+    }
@@ -1,10 +1,40 @@
 import logging
-from wakeonlan import send_magic_packet
+import socket
+import time
+
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Mapping, Optional
+from wakeonlan import create_magic_packet, send_magic_packet
 
 logger = logging.getLogger("wolnut")
 
+DEFAULT_BROADCAST_IP = "255.255.255.255"
+DEFAULT_WOL_PORT = 9
+WOL_TRANSPORTS = ("udp", "ethernet")
+ETH_P_WOL = 0x0842  # The EtherType of raw Wake-on-LAN frames
+BROADCAST_MAC = b"\xff" * 6
+# Missing from the socket module on some platforms, this is Linux's value
+_SO_BINDTODEVICE = getattr(socket, "SO_BINDTODEVICE", 25)
+
+
+@dataclass(frozen=True)
+class WolTarget:
+    """Where a client's WOL packets go, and the interface they leave from."""
+
+    broadcast_ip: str = DEFAULT_BROADCAST_IP
+    interface: Optional[str] = None  # None leaves it to the routing table
+    transport: str = "udp"  # Or "ethernet" for raw frames, needs an interface
+
+    def describe(self) -> str:
+        if self.transport == "ethernet":
+            return f"raw Ethernet frames on {self.interface}"
+        if self.interface:
+            return f"{self.broadcast_ip} on {self.interface}"
+        return self.broadcast_ip
+
 
-def send_wol_packet(mac_address: str, broadcast_ip: str = "255.255.255.255") -> bool:
+def send_wol_packet(mac_address: str, broadcast_ip: str = DEFAULT_BROADCAST_IP) -> bool:
     """
     Sends a Wake-on-LAN (WOL) packet to the specified MAC address.
 
@@ -21,3 +51,169 @@ def send_wol_packet(mac_address: str, broadcast_ip: str = "255.255.255.255") ->
     except Exception as e:
         logger.error("Failed to send WOL packet to %s: %s", mac_address, e)
         return False
+
+
+def build_magic_packet(mac_address: str) -> bytes:
+    """
+    Builds the 102-byte magic packet for a MAC address.
+
+    Args:
+        mac_address (str): The MAC address of the target device.
+
+    Returns:
+        bytes: The magic packet payload.
+
+    Raises:
+        ValueError: If the MAC address is malformed.
+    """
+    return create_magic_packet(mac_address)
+
+
+def build_ethernet_frame(
+    packet: bytes, source: bytes, destination: bytes = BROADCAST_MAC
+) -> bytes:
+    """
+    Wraps a magic packet in a raw Ethernet frame with EtherType 0x0842.
+
+    Some NICs and switches drop WOL packets sent over UDP broadcast but
+    honor this frame.
+
+    Args:
+        packet (bytes): The magic packet, see `build_magic_packet`.
+        source (bytes): The MAC address of the sending interface.
+        destination (bytes): The MAC address to send the frame to.
+
+    Returns:
+        bytes: The frame, without the checksum the NIC appends.
+    """
+    return destination + source + ETH_P_WOL.to_bytes(2, "big") + packet
+
+
+def _open_packet_socket(interface: str) -> Optional[socket.socket]:
+    family = getattr(socket, "AF_PACKET", None)
+    if family is None:
+        logger.error("Raw Ethernet WOL frames are only supported on Linux")
+        return None
+    sock = None
+    try:
+        # Needs root or CAP_NET_RAW
+        sock = socket.socket(family, socket.SOCK_RAW, socket.htons(ETH_P_WOL))
+        sock.bind((interface, ETH_P_WOL))
+    except OSError as e:
+        if sock is not None:
+            sock.close()
+        logger.error("Failed to open a packet socket on %s: %s", interface, e)
+        return None
+    return sock
+
+
+def _open_socket(target: WolTarget) -> Optional[socket.socket]:
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    except OSError as e:
+        logger.error("Failed to open WOL socket: %s", e)
+        return None
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    if target.interface:
+        try:
+            sock.setsockopt(
+                socket.SOL_SOCKET, _SO_BINDTODEVICE, target.interface.encode()
+            )
+        except OSError as e:
+            # Needs CAP_NET_RAW before Linux 5.7. A directed broadcast still
+            # leaves through the right interface, a global one may not.
+            logger.warning(
+                "Could not bind the WOL socket to %s, leaving it to routing: %s",
+                target.interface,
+                e,
+            )
+    return sock
+
+
+def send_wol_packets(
+    packets: Mapping[str, bytes],
+    broadcast_ip: str = DEFAULT_BROADCAST_IP,
+    port: int = DEFAULT_WOL_PORT,
+    burst_count: int = 1,
+    burst_interval: float = 0.0,
+    targets: Optional[Mapping[str, WolTarget]] = None,
+) -> dict[str, bool]:
+    """
+    Sends prebuilt magic packets to many devices, one socket per target.
+
+    Packets are grouped by target, so each subnet gets a single socket,
+    bound to its interface if the target names one. Targets with the
+    "ethernet" transport share one packet socket per interface, and their
+    frames are built once for every round. Each round sends one packet to
+    every device, subnet after subnet. With a burst count
+    above one, rounds are repeated after `burst_interval` seconds, which
+    helps on lossy or busy links.
+
+    Args:
+        packets (Mapping[str, bytes]): Magic packets keyed by device, e.g.
+            client name.
+        broadcast_ip (str): Address to send packets without a target to.
+        port (int): UDP port to send the packets to.
+        burst_count (int): How many times to send each packet.
+        burst_interval (float): Seconds to wait between rounds.
+        targets (Mapping[str, WolTarget] | None): Where to send each
+            device's packet.
+
+    Returns:
+        dict[str, bool]: Whether at least one packet reached the network,
+        keyed by device.
+    """
+    results = {device: False for device in packets}
+    if not packets:
+        return results
+
+    default = WolTarget(broadcast_ip)
+    groups: dict[WolTarget, dict[str, bytes]] = {}
+    for device, packet in packets.items():
+        target = targets.get(device, default) if targets else default
+        if target.transport == "ethernet":
+            # Frames don't have a broadcast IP, only the interface matters
+            target = WolTarget(interface=target.interface, transport="ethernet")
+        groups.setdefault(target, {})[device] = packet
+
+    with ExitStack() as stack:
+        senders = []
+        for target, group in groups.items():
+            if target.transport == "ethernet":
+                sock = _open_packet_socket(target.interface)
+                if sock is None:
+                    continue
+                stack.enter_context(sock)
+                # The bound address ends with the interface's MAC address
+                source = sock.getsockname()[4]
+                frames = {
+                    device: build_ethernet_frame(packet, source)
+                    for device, packet in group.items()
+                }
+                senders.append((sock, (target.interface, ETH_P_WOL), frames))
+                continue
+            sock = _open_socket(target)
+            if sock is not None:
+                stack.enter_context(sock)
+                senders.append((sock, (target.broadcast_ip, port), group))
+        if not senders:
+            return results
+
+        for round_number in range(max(1, burst_count)):
+            if round_number and burst_interval > 0:
+                time.sleep(burst_interval)
+            for sock, address, group in senders:
+                for device, packet in group.items():
+                    try:
+                        sock.sendto(packet, address)
+                        results[device] = True
+                    except OSError as e:
+                        logger.error("Failed to send WOL packet to %s: %s", device, e)
+
+    logger.debug(
+        "Sent WOL packets to %s of %s devices over %s subnets",
+        sum(results.values()),
+        len(results),
+        len(groups),
+    )
+    return results